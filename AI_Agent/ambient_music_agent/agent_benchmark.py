@@ -0,0 +1,741 @@
+"""
+ambient_music_agent (LLM エージェント側) の性能計測スクリプト
+
+使い方:
+    python agent_benchmark.py catalog-prompt [--sizes 10 1000 100000] [--live]
+    python agent_benchmark.py soak [--turns 1000] [--no-compaction]
+    python agent_benchmark.py server-load [--sessions 10 100 500] [--llm-ms 300]
+    python agent_benchmark.py checkpointer [--threads 10000] [--savers memory bounded sqlite]
+    python agent_benchmark.py graph-overhead [--graphs ambient media] [--concurrency 1 8 64]
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+import catalog_search
+from benchmark import synthetic_catalog, write_playback_tracks
+from token_count import count_tokens, tokenizer_name
+
+
+# ==============================================
+# カタログ: プロンプト埋め込み vs 検索ツール
+# ==============================================
+# 役割・ツールの説明 (両方式で共通なので、差は曲リストと検索結果の部分だけになる)
+ROLE_TEXT = """
+【あなたの役割】
+- ユーザーから「自然な雰囲気」や「lofiで」などのテーマや要望を受けたら、テーマに合致する曲を選び、プレイリストを提示してください。
+- ユーザーが提示されたプレイリストに同意（例：「OK」）した場合、選ばれた曲を順番に再生してください。
+"""
+
+USER_MESSAGE = "雨の音が入った落ち着いた lofi の曲を5曲選んで"
+
+TITLE_WORDS = ["rain", "piano", "night", "forest", "breeze", "ocean", "cafe", "thunder", "garden", "window"]
+
+
+def benchmark_catalog(n_tracks, seed=0):
+    """
+    synthetic_catalog にテキスト検索用のタイトルを付けたカタログ
+    """
+    rng = np.random.default_rng(seed)
+    items = synthetic_catalog(n_tracks, seed=seed)
+    for item in items:
+        words = rng.choice(TITLE_WORDS, 2, replace=False)
+        item["title"] = f"{words[0].title()} {words[1].title()}"
+    return items
+
+
+def embedded_prompt(items):
+    # 変更前の ambient_music_agent と同じく曲リスト全体を JSON でシステムプロンプトに入れる
+    return (
+        "あなたは音楽再生エージェントです。以下は利用可能な曲のリストです:\n"
+        + json.dumps(items, ensure_ascii=False, indent=2) + ROLE_TEXT
+    )
+
+
+def retrieval_prompt(catalog):
+    return (
+        "あなたは音楽再生エージェントです。曲は music_catalog_search_tool でカタログを検索して選びます。\n"
+        "カタログの概要:\n" + json.dumps(catalog.summary(), ensure_ascii=False) + ROLE_TEXT
+    )
+
+
+def estimated_call_seconds(input_tokens, output_tokens, args):
+    return args.call_overhead_ms / 1000.0 + input_tokens / args.prefill_tps + output_tokens / args.decode_tps
+
+
+def _live_call(llm, messages):
+    start = time.perf_counter()
+    llm.invoke(messages)
+    return time.perf_counter() - start
+
+
+def bench_catalog_prompt(args):
+    """
+    システムプロンプトに全曲を埋め込む方式と、概要だけを載せて検索ツールで上位 k 件を引く方式で、
+    1ターンの入力トークン数とレイテンシを比べる。
+    - 埋め込み: LLM 呼び出し1回 (システムプロンプト + ユーザー発話)
+    - 検索: 呼び出し2回 (1回目で検索ツールを呼び、2回目は検索結果を加えて応答する)
+    レイテンシは --prefill-tps などの仮定から見積もる。--live なら実際に OpenAI の API を呼ぶ。
+    """
+    llm = None
+    if args.live:
+        from langchain_openai import ChatOpenAI
+        from langchain_core.messages import HumanMessage, SystemMessage
+        llm = ChatOpenAI(model_name=args.model)
+
+    user_tokens = count_tokens(USER_MESSAGE)
+    print(f"tokenizer: {tokenizer_name()}")
+    print(
+        f"latency estimate: {args.call_overhead_ms:.0f} ms/call + {args.prefill_tps:.0f} input tok/s + "
+        f"{args.decode_tps:.0f} output tok/s, reply {args.reply_tokens} tokens, tool call {args.tool_call_tokens} tokens"
+    )
+    print(
+        f"{'tracks':>7s} {'mode':9s} {'prompt tok':>11s} {'turn in tok':>11s} {'load s':>8s} "
+        f"{'search ms':>9s} {'est turn s':>10s} {'live turn s':>11s}"
+    )
+    for n_tracks in args.sizes:
+        items = benchmark_catalog(n_tracks)
+
+        start = time.perf_counter()
+        prompt = embedded_prompt(items)
+        build = time.perf_counter() - start
+        prompt_tokens = count_tokens(prompt)
+        turn_tokens = prompt_tokens + user_tokens
+        estimate = estimated_call_seconds(turn_tokens, args.reply_tokens, args)
+        live = "-"
+        if llm is not None and turn_tokens <= args.context_tokens:
+            live = f"{_live_call(llm, [SystemMessage(content=prompt), HumanMessage(content=USER_MESSAGE)]):.2f}"
+        note = "" if turn_tokens <= args.context_tokens else "  (exceeds context window)"
+        print(
+            f"{n_tracks:7d} {'embedded':9s} {prompt_tokens:11d} {turn_tokens:11d} {build:8.3f} "
+            f"{'-':>9s} {estimate:10.2f} {live:>11s}{note}"
+        )
+
+        start = time.perf_counter()
+        catalog = catalog_search.CatalogSearch(items)
+        load = time.perf_counter() - start
+        prompt = retrieval_prompt(catalog)
+        prompt_tokens = count_tokens(prompt)
+
+        latencies = []
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            result = catalog.search(text="rain", lofi=True, energy=(None, 0.1), k=args.k)
+            latencies.append(time.perf_counter() - start)
+        search_ms = np.percentile(latencies, 50) * 1e3
+        result_text = json.dumps(result, ensure_ascii=False)
+        result_tokens = count_tokens(result_text)
+
+        first = prompt_tokens + user_tokens
+        second = first + args.tool_call_tokens + result_tokens
+        estimate = (
+            estimated_call_seconds(first, args.tool_call_tokens, args)
+            + search_ms / 1000.0
+            + estimated_call_seconds(second, args.reply_tokens, args)
+        )
+        live = "-"
+        if llm is not None:
+            messages = [SystemMessage(content=prompt), HumanMessage(content=USER_MESSAGE)]
+            elapsed = _live_call(llm, messages)
+            start = time.perf_counter()
+            catalog.search(text="rain", lofi=True, energy=(None, 0.1), k=args.k)
+            elapsed += time.perf_counter() - start
+            elapsed += _live_call(llm, messages + [HumanMessage(content=f"検索結果: {result_text}")])
+            live = f"{elapsed:.2f}"
+        print(
+            f"{n_tracks:7d} {'retrieval':9s} {prompt_tokens:11d} {first + second:11d} {load:8.3f} "
+            f"{search_ms:9.2f} {estimate:10.2f} {live:>11s}"
+        )
+
+
+# ==============================================
+# 長い会話での状態の大きさ (soak)
+# ==============================================
+SOAK_USER_MESSAGE = "ターン {turn}: 雨の音が入った落ち着いた lofi の曲を探して、気に入ったら再生して"
+SOAK_REPLY_TOKENS = 60
+
+
+def _import_agent(sink="null:0"):
+    # 音声デバイスも API キーも無い環境で ambient_music_agent を読み込む
+    os.environ.setdefault("AMBIENT_AUDIO_SINK", sink)
+    os.environ.setdefault("AMBIENT_LLM", "fake")
+    os.environ.setdefault("AMBIENT_CHECKPOINT_DB", ":memory:")
+    os.environ.setdefault("AMBIENT_CATALOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "output.json"))
+    import ambient_music_agent
+    return ambient_music_agent
+
+
+def soak_route(tool_every):
+    # tool_every ターンに1回カタログ検索ツールを呼ぶ
+    turns = itertools.count(1)
+
+    def route(text):
+        if next(turns) % tool_every:
+            return []
+        return [{"name": "music_catalog_search_tool", "args": {"query": "rain", "lofi": True, "k": 10}}]
+
+    return route
+
+
+def _byte_size(value):
+    # MemorySaver が保持しているシリアライズ済みの値のバイト数
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_byte_size(k) + _byte_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_byte_size(v) for v in value)
+    return 0
+
+
+def checkpointer_bytes(saver):
+    return _byte_size(saver.storage) + _byte_size(saver.writes) + _byte_size(saver.blobs)
+
+
+def bench_soak(args):
+    """
+    実際のグラフ (compact -> chatbot <-> tools) を API を呼ばない LLM で --turns ターン回し、
+    --report-every ターンごとに Python のヒープ使用量・チェックポイントのバイト数・
+    State のメッセージ数・その時点の LLM の入力トークン数を表示する。
+    上限管理が効いていれば、どれも一定の値で頭打ちになる。
+    --no-compaction は変更前と同じく履歴を縮めず、すべてのチェックポイントを残す。
+    """
+    from langchain_core.messages import HumanMessage
+    from langgraph.checkpoint.memory import MemorySaver
+
+    import conversation
+    import fake_llm
+
+    agent = _import_agent()
+    budget = conversation.HISTORY_TOKEN_BUDGET if args.budget is None else args.budget
+    model = fake_llm.ScriptedChatModel(
+        route=soak_route(args.tool_every), output_tokens=SOAK_REPLY_TOKENS, token_counter=conversation.message_tokens
+    )
+    input_tokens = model.input_tokens
+    if args.no_compaction:
+        saver = MemorySaver()
+        graph = agent.build_graph(model, saver, history_token_budget=None)
+    else:
+        saver = conversation.BoundedMemorySaver(keep=args.keep_checkpoints)
+        graph = agent.build_graph(model, saver, history_token_budget=budget)
+    config = {"configurable": {"thread_id": "soak"}}
+
+    mode = "no compaction" if args.no_compaction else f"history budget {budget} tokens"
+    print(f"tokenizer: {tokenizer_name()}, {mode}, tool call every {args.tool_every} turns")
+    print(
+        f"{'turn':>6s} {'heap MB':>8s} {'ckpt KB':>9s} {'state msgs':>10s} {'summary tok':>11s} "
+        f"{'input tok':>9s} {'turn ms':>8s}"
+    )
+    tracemalloc.start()
+    elapsed = 0.0
+    try:
+        for turn in range(1, args.turns + 1):
+            start = time.perf_counter()
+            graph.invoke({"messages": [HumanMessage(content=SOAK_USER_MESSAGE.format(turn=turn))]}, config)
+            elapsed += time.perf_counter() - start
+            if turn % args.report_every:
+                continue
+            gc.collect()
+            heap, _ = tracemalloc.get_traced_memory()
+            values = graph.get_state(config).values
+            print(
+                f"{turn:6d} {heap / 2**20:8.2f} {checkpointer_bytes(saver) / 1024:9.1f} "
+                f"{len(values['messages']):10d} {count_tokens(values.get('summary', '')):11d} "
+                f"{input_tokens[-1]:9d} {elapsed / args.report_every * 1e3:8.2f}"
+            )
+            elapsed = 0.0
+    finally:
+        tracemalloc.stop()
+        agent.playback_engines.close_all()
+
+
+# ==============================================
+# サーバーモードの同時セッション数 (server-load)
+# ==============================================
+# 1セッションの会話の流れ (この順に繰り返す)
+SESSION_SCRIPT = ("検索: rain", "再生", "雨の日に合う?", "状態")
+
+
+def session_route(track_ms):
+    def route(text):
+        if text.startswith("検索:"):
+            return [{"name": "music_catalog_search_tool", "args": {"query": text[3:].strip(), "k": 10}}]
+        if text.startswith("再生:"):
+            filename = text[3:].strip()
+            return [{
+                "name": "music_playback_tool",
+                "args": {"filename": filename, "start_time_ms": 0, "end_time_ms": track_ms, "sleep_time_ms": 500},
+            }]
+        if text.startswith("状態"):
+            return [{"name": "music_status_tool", "args": {}}]
+        return []
+
+    return route
+
+
+async def _client(port, session_id, turns, think_s, n_tracks, rng, latencies, ttfts, errors):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    # セッションの開始をずらして全員が同時に話さないようにする
+    await asyncio.sleep(rng.uniform(0, think_s))
+    try:
+        for turn in range(turns):
+            text = SESSION_SCRIPT[turn % len(SESSION_SCRIPT)]
+            if text == "再生":
+                text = f"再生: track{rng.integers(n_tracks)}.wav"
+            start = time.perf_counter()
+            writer.write(json.dumps({"session": session_id, "text": text}).encode("utf-8") + b"\n")
+            await writer.drain()
+            # 再生イベント ("event" のある行) は読み飛ばして、このターンの応答を待つ
+            while True:
+                response = json.loads(await reader.readline())
+                if "event" not in response:
+                    break
+            latencies.append(time.perf_counter() - start)
+            if "error" in response:
+                errors.append(response["error"])
+            elif response.get("ttft_ms") is not None:
+                ttfts.append(response["ttft_ms"])
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * think_s)
+    finally:
+        writer.close()
+
+
+async def _server_load_run(agent, n_sessions, args, n_tracks):
+    import agent_server
+    import conversation
+    import fake_llm
+
+    model = fake_llm.ScriptedChatModel(
+        route=session_route(int(args.track_seconds * 1000)), latency_ms=args.llm_ms,
+        token_counter=conversation.message_tokens,
+    )
+    saver = conversation.BoundedMemorySaver()
+    graph = agent.build_graph(model, saver)
+    server = agent_server.AgentServer(graph, agent.playback_engines, saver, max_sessions=n_sessions)
+    await server.start("127.0.0.1", 0)
+
+    rng = np.random.default_rng(n_sessions)
+    latencies, ttfts, errors = [], [], []
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    await asyncio.gather(*(
+        _client(server.port, f"s{i}", args.turns, args.think_ms / 1000.0, n_tracks,
+                np.random.default_rng(rng.integers(2**32)), latencies, ttfts, errors)
+        for i in range(n_sessions)
+    ))
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+
+    underruns = 0
+    for session_id in list(server.sessions):
+        engine = agent.playback_engines.get(session_id, create=False)
+        if engine is not None and engine.sink is not None:
+            underruns += engine.sink.stats()["underruns"]
+    threads = threading.active_count()
+    await server.aclose()
+    return latencies, ttfts, errors, wall, cpu, underruns, threads
+
+
+def bench_server_load(args):
+    """
+    agent_server.AgentServer を同じプロセスで起動し、--sessions 個のクライアントがそれぞれ
+    検索 -> 再生 -> 雑談 -> 状態確認 を --turns ターン、--think-ms 前後の間隔で送る。
+    LLM は --llm-ms だけ待って応答するスタブで、再生は NullSink が実時間で消費する。
+    ターンの応答時間 (クライアントで計測)、処理できたターン数、プロセスの CPU 使用量から
+    1コアあたりのセッション数 (= セッション数 / 使ったコア数) を表示する。
+    CPU 使用量にはクライアントと再生スレッドの分も含まれる。
+    """
+    import tempfile
+
+    agent = _import_agent(sink=args.sink)
+    work_dir = tempfile.mkdtemp(prefix="server_load_")
+    music_dir = os.path.join(work_dir, "music")
+    os.makedirs(music_dir)
+    write_playback_tracks(music_dir, args.tracks, args.track_seconds)
+
+    print(
+        f"fake LLM {args.llm_ms:.0f} ms/call, think {args.think_ms:.0f} ms, {args.turns} turns/session, "
+        f"{args.track_seconds:.0f} s tracks, sink {args.sink}"
+    )
+    print(
+        f"{'sessions':>8s} {'turns/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'ttft p50':>8s} {'cores':>6s} "
+        f"{'sess/core':>9s} {'threads':>7s} {'underruns':>9s} {'errors':>6s}"
+    )
+    cwd = os.getcwd()
+    # music_playback_tool は ./music/ から曲を探す
+    os.chdir(work_dir)
+    try:
+        for n_sessions in args.sessions:
+            latencies, ttfts, errors, wall, cpu, underruns, threads = asyncio.run(
+                _server_load_run(agent, n_sessions, args, args.tracks)
+            )
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e3
+            ttft = np.percentile(ttfts, 50) if ttfts else float("nan")
+            cores = cpu / wall
+            print(
+                f"{n_sessions:8d} {len(latencies) / wall:8.1f} {p50:8.1f} {p95:8.1f} {p99:8.1f} {ttft:8.1f} {cores:6.2f} "
+                f"{n_sessions / max(cores, 1e-9):9.0f} {threads:7d} {underruns:9d} {len(errors):6d}"
+            )
+    finally:
+        os.chdir(cwd)
+        agent.playback_engines.close_all()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# ==============================================
+# チェックポインタの比較 (checkpointer)
+# ==============================================
+def make_saver(kind, work_dir):
+    import checkpoint_store
+    import conversation
+    from langgraph.checkpoint.memory import MemorySaver
+
+    if kind == "memory":
+        return MemorySaver()
+    if kind == "bounded":
+        return conversation.BoundedMemorySaver()
+    if kind == "sqlite":
+        return checkpoint_store.SqliteCheckpointSaver(os.path.join(work_dir, "checkpoints.sqlite"))
+    raise ValueError(f"unknown saver: {kind}")
+
+
+def saver_bytes(saver):
+    if hasattr(saver, "stats"):
+        return saver.stats()["db_bytes"]
+    return checkpointer_bytes(saver)
+
+
+def _restore_latencies(saver, n_threads, n_samples, rng):
+    latencies = []
+    for i in rng.integers(n_threads, size=n_samples).tolist():
+        start = time.perf_counter()
+        saver.get_tuple({"configurable": {"thread_id": f"t{i}", "checkpoint_ns": ""}})
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies)
+
+
+def bench_checkpointer(args):
+    """
+    エージェントのグラフ (API を呼ばない LLM) で --threads 個のスレッドにそれぞれ --turns ターン話し、
+    チェックポインタごとに以下を表示する (スレッド数が 10 の累乗になるたび)。
+    - heap MB: Python のヒープの増加分 (tracemalloc)
+    - stored MB: 保持しているシリアライズ済みの値のバイト数 (SQLite はデータベースの大きさ)
+    - put: 1回のチェックポイント保存の時間
+    - restore: ランダムなスレッドの最新チェックポイントを読む時間
+    sqlite は最後に開き直して (プロセスを再起動したのと同じ状態で) 読む時間も表示する。
+    """
+    import tempfile
+
+    from langchain_core.messages import HumanMessage
+
+    import conversation
+    import fake_llm
+
+    agent = _import_agent()
+    work_dir = tempfile.mkdtemp(prefix="checkpointer_")
+    milestones = {10 ** k for k in range(1, 9) if 10 ** k < args.threads} | {args.threads}
+    print(f"{args.turns} turns/thread, tool call every 3 turns, history budget {conversation.HISTORY_TOKEN_BUDGET} tokens")
+    print(
+        f"{'saver':8s} {'threads':>8s} {'heap MB':>8s} {'stored MB':>9s} {'put p50 us':>10s} {'put p99 us':>10s} "
+        f"{'restore p50 us':>14s} {'restore p99 us':>14s}"
+    )
+    try:
+        for kind in args.savers:
+            gc.collect()
+            tracemalloc.start()
+            saver = make_saver(kind, work_dir)
+            put_latencies = []
+            put = saver.put
+
+            def timed_put(*a, **kw):
+                start = time.perf_counter()
+                result = put(*a, **kw)
+                put_latencies.append(time.perf_counter() - start)
+                return result
+
+            saver.put = timed_put
+            graph = agent.build_graph(fake_llm.ScriptedChatModel(route=soak_route(3)), saver)
+            rng = np.random.default_rng(0)
+            for n in range(1, args.threads + 1):
+                config = {"configurable": {"thread_id": f"t{n - 1}"}}
+                for turn in range(args.turns):
+                    graph.invoke({"messages": [HumanMessage(content=SOAK_USER_MESSAGE.format(turn=turn))]}, config)
+                if n not in milestones:
+                    continue
+                gc.collect()
+                heap, _ = tracemalloc.get_traced_memory()
+                puts = np.array(put_latencies[-10_000:]) * 1e6
+                restores = _restore_latencies(saver, n, args.restore_samples, rng) * 1e6
+                print(
+                    f"{kind:8s} {n:8d} {heap / 2**20:8.1f} {saver_bytes(saver) / 2**20:9.1f} "
+                    f"{np.percentile(puts, 50):10.0f} {np.percentile(puts, 99):10.0f} "
+                    f"{np.percentile(restores, 50):14.0f} {np.percentile(restores, 99):14.0f}"
+                )
+            tracemalloc.stop()
+            if kind == "sqlite":
+                saver.close()
+                reopened = make_saver(kind, work_dir)
+                restores = _restore_latencies(reopened, args.threads, args.restore_samples, rng) * 1e6
+                print(
+                    f"{'(reopen)':8s} {args.threads:8d} {'-':>8s} {saver_bytes(reopened) / 2**20:9.1f} {'-':>10s} "
+                    f"{'-':>10s} {np.percentile(restores, 50):14.0f} {np.percentile(restores, 99):14.0f}"
+                )
+                reopened.close()
+            del graph, saver
+    finally:
+        agent.playback_engines.close_all()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# ==============================================
+# グラフの実行のオーバーヘッド (graph-overhead)
+# ==============================================
+# ambient のグラフで繰り返すツール呼び出し (ネットワークを使わないツールだけ)
+AMBIENT_SCRIPT = [
+    [],
+    [{"name": "music_catalog_search_tool", "args": {"query": "rain", "lofi": True, "k": 10}}],
+    [{"name": "music_status_tool", "args": {}}],
+]
+
+MEDIA_AGENT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "langgraph", "langgraph-media-api-agent"
+)
+
+
+def _node_timer():
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class NodeTimer(BaseCallbackHandler):
+        """
+        グラフのノードごとの実行時間と、その中の LLM 呼び出しの時間を記録するコールバック
+        """
+        # 非同期の実行でもイベントループの中で呼ばせる (別スレッドに回すと時刻がずれる)
+        run_inline = True
+
+        def __init__(self):
+            self.roots = set()
+            self.starts = {}
+            self.llm_starts = {}
+            self.nodes = {}      # ノード名 -> [(実行時間, LLM の時間)]
+            self.llm = {}        # ノードの run_id -> LLM の時間の合計
+            self.node_of = {}    # ノードの中の Runnable の run_id -> ノードの run_id
+
+        def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+            if parent_run_id is None:
+                self.roots.add(run_id)
+            elif parent_run_id in self.roots and (metadata or {}).get("langgraph_node") == kwargs.get("name"):
+                self.starts[run_id] = (kwargs["name"], time.perf_counter())
+            elif parent_run_id in self.starts:
+                self.node_of[run_id] = parent_run_id
+            elif parent_run_id in self.node_of:
+                self.node_of[run_id] = self.node_of[parent_run_id]
+
+        def on_chain_end(self, outputs, *, run_id, **kwargs):
+            self.roots.discard(run_id)
+            self.node_of.pop(run_id, None)
+            started = self.starts.pop(run_id, None)
+            if started is not None:
+                name, start = started
+                self.nodes.setdefault(name, []).append((time.perf_counter() - start, self.llm.pop(run_id, 0.0)))
+
+        def on_chain_error(self, error, *, run_id, **kwargs):
+            self.roots.discard(run_id)
+            self.node_of.pop(run_id, None)
+            self.starts.pop(run_id, None)
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+            self.llm_starts[run_id] = (parent_run_id, time.perf_counter())
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            parent, start = self.llm_starts.pop(run_id, (None, None))
+            if start is None:
+                return
+            # LLM はノードの直下か、ノードの中の Runnable の下で呼ばれる
+            node = parent if parent in self.starts else self.node_of.get(parent)
+            if node is not None:
+                self.llm[node] = self.llm.get(node, 0.0) + time.perf_counter() - start
+
+    return NodeTimer()
+
+
+def _overhead_graphs(args):
+    """
+    グラフ名 -> (LLM の待ち時間からグラフと設定を作る関数)
+    """
+    from langgraph.checkpoint.memory import MemorySaver
+
+    import conversation
+    import fake_llm
+
+    graphs = {}
+    if "ambient" in args.graphs:
+        agent = _import_agent()
+
+        def ambient(latency_ms):
+            model = fake_llm.ScriptedChatModel(
+                script=AMBIENT_SCRIPT, latency_ms=latency_ms, token_counter=conversation.message_tokens
+            )
+            graph = agent.build_graph(model, MemorySaver())
+            return graph, model, lambda session: {"configurable": {"thread_id": f"s{session}"}}
+
+        graphs["ambient"] = ambient
+    if "media" in args.graphs:
+        import sys
+        # media_agent のツールは初期化に API キーの文字列が要るだけで、呼ばれない (ツールを呼ばない応答にする)
+        for name in ("TAVILY_API_KEY", "YOUTUBE_API", "SPOTIFY_TOKEN", "SPOTIFY_CLIENTID"):
+            os.environ.setdefault(name, "unused")
+        sys.path.insert(0, os.path.abspath(args.media_agent_dir))
+        from media_agent import agent as media_agent
+        from media_agent.utils import nodes as media_nodes
+
+        def media(latency_ms):
+            os.environ["MEDIA_AGENT_FAKE_LLM_LATENCY_MS"] = str(latency_ms)
+            media_nodes._get_model.cache_clear()
+            model = media_nodes._get_model("fake")
+            return media_agent.graph, model, lambda session: {"configurable": {"model_name": "fake"}}
+
+        graphs["media"] = media
+    return graphs
+
+
+def _turn_input(turn):
+    from langchain_core.messages import HumanMessage
+    return {"messages": [HumanMessage(content=SOAK_USER_MESSAGE.format(turn=turn))]}
+
+
+async def _concurrent_turns(graph, config_for, concurrency, turns):
+    latencies = []
+
+    async def worker(session):
+        config = config_for(session)
+        for turn in range(session, turns, concurrency):
+            start = time.perf_counter()
+            await graph.ainvoke(_turn_input(turn), config)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return np.array(latencies), time.perf_counter() - start
+
+
+def bench_graph_overhead(args):
+    """
+    API を呼ばない LLM (fake_llm.ScriptedChatModel / media_agent の _get_model("fake")) でグラフを回し、
+    1. LLM の待ち時間 0 で --turns ターンを順に実行し、ノードごとの時間 (中の LLM 呼び出しの時間を除く) と
+       ノードの外 (グラフの実行・チェックポイント) の時間を表示する
+    2. LLM の待ち時間 --llm-ms で --concurrency 個のセッションを並行に実行し (ainvoke)、
+       ターンの応答時間の分位数・スループット・LLM の待ち時間を除いた1ターンの時間を表示する
+    """
+    for name, factory in _overhead_graphs(args).items():
+        graph, model, config_for = factory(0.0)
+        timer = _node_timer()
+        turn_times = []
+        for turn in range(args.warmup + args.turns):
+            if turn == args.warmup:
+                timer.nodes.clear()
+                turn_times.clear()
+            config = dict(config_for(0), callbacks=[timer])
+            start = time.perf_counter()
+            graph.invoke(_turn_input(turn), config)
+            turn_times.append(time.perf_counter() - start)
+
+        print(f"graph {name}: {args.turns} turns, LLM latency 0 (per-node time excludes time inside the LLM)")
+        print(f"{'node':10s} {'calls':>6s} {'mean us':>9s} {'p50 us':>9s} {'p99 us':>9s}")
+        in_nodes = 0.0
+        for node, samples in timer.nodes.items():
+            own = np.array([t - llm for t, llm in samples]) * 1e6
+            in_nodes += sum(t for t, _ in samples)
+            print(f"{node:10s} {len(own):6d} {own.mean():9.0f} {np.percentile(own, 50):9.0f} {np.percentile(own, 99):9.0f}")
+        turn_us = np.array(turn_times) * 1e6
+        outside = (turn_us.sum() - in_nodes * 1e6) / len(turn_us)
+        print(f"{'(outside)':10s} {len(turn_us):6d} {outside:9.0f} {'-':>9s} {'-':>9s}")
+        print(f"{'(turn)':10s} {len(turn_us):6d} {turn_us.mean():9.0f} {np.percentile(turn_us, 50):9.0f} "
+              f"{np.percentile(turn_us, 99):9.0f}")
+
+        print(f"graph {name}: LLM latency {args.llm_ms:.0f} ms/call, {args.turns} turns per run")
+        print(f"{'sessions':>8s} {'turns/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'LLM calls':>9s} "
+              f"{'over LLM ms':>11s}")
+        for concurrency in args.concurrency:
+            graph, model, config_for = factory(args.llm_ms)
+            calls = len(model.input_tokens)
+            latencies, wall = asyncio.run(_concurrent_turns(graph, config_for, concurrency, args.turns))
+            calls_per_turn = (len(model.input_tokens) - calls) / len(latencies)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e3
+            over = latencies.mean() * 1e3 - calls_per_turn * args.llm_ms
+            print(f"{concurrency:8d} {len(latencies) / wall:8.1f} {p50:8.1f} {p95:8.1f} {p99:8.1f} "
+                  f"{calls_per_turn:9.2f} {over:11.2f}")
+    if "ambient" in args.graphs:
+        _import_agent().playback_engines.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ambient_music_agent benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("catalog-prompt", help="曲リストのプロンプト埋め込みと検索ツールのトークン数・ターンのレイテンシ")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100_000])
+    p.add_argument("--k", type=int, default=10, help="検索ツールが返す曲数")
+    p.add_argument("--queries", type=int, default=50)
+    p.add_argument("--prefill-tps", type=float, default=20_000.0, help="見積もりに使う入力トークンの処理速度")
+    p.add_argument("--decode-tps", type=float, default=80.0, help="見積もりに使う出力トークンの生成速度")
+    p.add_argument("--call-overhead-ms", type=float, default=300.0, help="見積もりに使う1呼び出しあたりの固定時間")
+    p.add_argument("--reply-tokens", type=int, default=150)
+    p.add_argument("--tool-call-tokens", type=int, default=60)
+    p.add_argument("--context-tokens", type=int, default=128_000)
+    p.add_argument("--live", action="store_true", help="OpenAI の API を実際に呼んでターンの時間を測る")
+    p.add_argument("--model", default="gpt-4o")
+    p.set_defaults(func=bench_catalog_prompt)
+
+    p = subparsers.add_parser("soak", help="長い会話でメモリ・チェックポイント・入力トークン数が頭打ちになるか")
+    p.add_argument("--turns", type=int, default=1000)
+    p.add_argument("--report-every", type=int, default=100)
+    p.add_argument("--tool-every", type=int, default=3, help="何ターンに1回カタログ検索ツールを呼ぶか")
+    p.add_argument("--budget", type=int, default=None, help="履歴のトークン数の上限 (既定は conversation.HISTORY_TOKEN_BUDGET)")
+    p.add_argument("--keep-checkpoints", type=int, default=4)
+    p.add_argument(
+        "--no-compaction", action="store_true",
+        help="履歴を縮めない比較用 (状態が増え続けるので --turns 200 程度で)"
+    )
+    p.set_defaults(func=bench_soak)
+
+    p = subparsers.add_parser("server-load", help="サーバーモードの同時セッション数と応答時間 (スタブの LLM)")
+    p.add_argument("--sessions", type=int, nargs="+", default=[10, 100, 500])
+    p.add_argument("--turns", type=int, default=8, help="1セッションのターン数")
+    p.add_argument("--think-ms", type=float, default=2000.0, help="ターンの間隔 (0.5〜1.5倍でばらつかせる)")
+    p.add_argument("--llm-ms", type=float, default=300.0, help="スタブの LLM の1呼び出しの待ち時間")
+    p.add_argument("--tracks", type=int, default=4)
+    p.add_argument("--track-seconds", type=float, default=10.0)
+    p.add_argument("--sink", default="null", help="再生の出力先 (audio_sink.sink_factory の指定)")
+    p.set_defaults(func=bench_server_load)
+
+    p = subparsers.add_parser("checkpointer", help="MemorySaver と SQLite のチェックポインタのメモリ・保存・復元の時間")
+    p.add_argument("--threads", type=int, default=10_000)
+    p.add_argument("--turns", type=int, default=4, help="1スレッドのターン数")
+    p.add_argument("--savers", nargs="+", default=["memory", "bounded", "sqlite"], choices=["memory", "bounded", "sqlite"])
+    p.add_argument("--restore-samples", type=int, default=1000)
+    p.set_defaults(func=bench_checkpointer)
+
+    p = subparsers.add_parser("graph-overhead", help="API を呼ばない LLM でのグラフの実行時間 (ノードごと・並行時)")
+    p.add_argument("--graphs", nargs="+", default=["ambient", "media"], choices=["ambient", "media"])
+    p.add_argument("--turns", type=int, default=500)
+    p.add_argument("--warmup", type=int, default=20)
+    p.add_argument("--llm-ms", type=float, default=200.0, help="並行実行での LLM の1呼び出しの待ち時間")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 64])
+    p.add_argument("--media-agent-dir", default=MEDIA_AGENT_DIR)
+    p.set_defaults(func=bench_graph_overhead)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
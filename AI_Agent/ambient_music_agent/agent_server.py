@@ -0,0 +1,272 @@
+"""
+ambient_music_agent のサーバーモード
+
+1つのプロセス・1つのグラフで複数の聞き手 (セッション) の会話を並行して扱う。
+セッションごとに会話のスレッド (thread_id)、再生キュー (PlaybackEngine)、上限付きの履歴を持ち、
+グラフは astream で実行するので、あるセッションの LLM 呼び出しや再生が他のセッションを待たせない。
+
+使い方:
+    python agent_server.py [--host 127.0.0.1] [--port 8765] [--max-sessions 1000] [--idle-timeout 1800]
+
+プロトコル (TCP、1行に1つの JSON):
+    -> {"session": "alice", "text": "雨の日に合う曲を流して"}
+    <- {"session": "alice", "replies": ["..."], "tools": ["music_catalog_search_tool"], "ttft_ms": 420.5, "ms": 812.3}
+    -> {"session": "alice", "text": "...", "stream": true}
+    <- {"session": "alice", "event": "token", "text": "..."}        (turn_events のイベント。最後は上と同じ応答)
+    -> {"session": "alice", "close": true}
+    <- {"session": "alice", "closed": true}
+    -> {"session": "alice", "close": true, "forget": true}      (会話の履歴 (チェックポイント) も消す)
+    <- {"session": "alice", "closed": true, "forgotten": true}
+session を省略すると接続ごとのセッションになる。1つの接続で複数のセッションの要求を並行して送ってよい
+(応答は終わった順に返る)。
+セッションを閉じても (close・一定時間の無操作・サーバーの終了) 会話の履歴はチェックポインタに残り、
+同じ session で要求を送れば続きから話せる。履歴を消すのは "forget": true を付けて閉じたときだけ。
+再生の進み具合 ({"session": ..., "event": "now_playing", "track_id": ...} など) は、そのセッションの
+要求を最後に送った接続に届く。
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+import turn_events
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        # 同じセッションのターンは順に処理する (チェックポイントの更新が前後しないように)
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+        self.turns = 0
+        # 再生イベントを送る先 (このセッションの要求を最後に送った接続)
+        self.send = None
+        # close_session が閉じ終えたら True。lock を待っていたターンはこれを見て新しいセッションでやり直す
+        self.closed = False
+
+
+class AgentServer:
+    """
+    - graph: build_graph で作ったコンパイル済みのグラフ (全セッションで共有)
+    - playback_engines: セッションごとの再生エンジン (playback.PlaybackSessions)
+    - checkpointer: グラフのチェックポインタ。forget=True で閉じるときに delete_thread があれば呼ぶ
+    - max_sessions: 同時に持つセッション数の上限
+    - idle_timeout: この秒数だけ会話が無く再生もしていないセッションを閉じる
+    """
+
+    def __init__(self, graph, playback_engines, checkpointer=None, max_sessions=1000, idle_timeout=1800.0):
+        self.graph = graph
+        self.playback_engines = playback_engines
+        self.checkpointer = checkpointer
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self._connection_ids = itertools.count(1)
+        self._server = None
+        self._reaper = None
+        self._loop = None
+
+    def _session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            if len(self.sessions) >= self.max_sessions:
+                raise RuntimeError(f"too many sessions (max {self.max_sessions})")
+            session = self.sessions[session_id] = Session(session_id)
+        return session
+
+    async def turn(self, session_id, text, on_event=None, send=None):
+        """
+        セッションの1ターン (ユーザーの発話から応答まで) を実行する。
+        on_event を渡すとトークン・ツール呼び出しのイベントを届いた順に await on_event(event) で渡す。
+        send を渡すと、このセッションの再生イベントの送り先にする。
+        """
+        while True:
+            session = self._session(session_id)
+            if send is not None:
+                session.send = send
+            async with session.lock:
+                if session.closed:
+                    # 待っている間に閉じられた。閉じ終わった後の新しいセッションでやり直す
+                    continue
+                config = {"configurable": {"thread_id": session_id}}
+                async for event in turn_events.astream_turn(self.graph, text, config):
+                    if event["event"] == "done":
+                        result = event
+                    elif on_event is not None:
+                        await on_event(event)
+                session.turns += 1
+                session.last_active = time.monotonic()
+                break
+        result = {k: v for k, v in result.items() if k != "event"}
+        return dict(result, session=session_id)
+
+    def _on_playback(self, session_id, event):
+        # 再生スレッドから呼ばれるので、送信はイベントループに任せる
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._push_playback, session_id, event)
+
+    def _push_playback(self, session_id, event):
+        session = self.sessions.get(session_id)
+        if session is not None and session.send is not None:
+            asyncio.ensure_future(session.send(dict(event, session=session_id)))
+
+    async def close_session(self, session_id, forget=False):
+        """
+        メモリ上のセッションと再生エンジンを閉じる (セッションがあれば True)。
+        会話の履歴 (チェックポイント) は forget=True のときだけ消す。
+        実行中のターンが終わるのを待ってから閉じ、閉じ終わるまでセッションを self.sessions に残すので、
+        その間に届いた同じセッションのターンは閉じ終わった後に新しいセッションで実行される。
+        """
+        session = self.sessions.get(session_id)
+        existed = session is not None
+        if not existed:
+            if not forget:
+                return False
+            # 履歴を消している間に同じセッションのターンが始まらないよう、一時的なセッションで順番を取る
+            session = self.sessions[session_id] = Session(session_id)
+        async with session.lock:
+            if session.closed:
+                # 待っている間に別の close が閉じた
+                return await self.close_session(session_id, forget)
+            if existed:
+                # 再生スレッドの終了を待つのでイベントループの外で閉じる
+                await asyncio.to_thread(self.playback_engines.close, session_id)
+            if forget and hasattr(self.checkpointer, "delete_thread"):
+                await asyncio.to_thread(self.checkpointer.delete_thread, session_id)
+            session.closed = True
+            del self.sessions[session_id]
+        return existed
+
+    async def close_all(self):
+        for session_id in list(self.sessions):
+            await self.close_session(session_id)
+
+    def _idle(self, session, now):
+        if session.lock.locked() or now - session.last_active < self.idle_timeout:
+            return False
+        engine = self.playback_engines.get(session.id, create=False)
+        return engine is None or engine.wait_idle(0)
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(min(self.idle_timeout / 4, 60.0))
+            now = time.monotonic()
+            for session in [s for s in self.sessions.values() if self._idle(s, now)]:
+                await self.close_session(session.id)
+
+    async def dispatch(self, request, default_session, send):
+        session_id = str(request.get("session") or default_session)
+        if request.get("close"):
+            if request.get("forget"):
+                closed = await self.close_session(session_id, forget=True)
+                return {"session": session_id, "closed": closed, "forgotten": hasattr(self.checkpointer, "delete_thread")}
+            return {"session": session_id, "closed": await self.close_session(session_id)}
+        if "text" not in request:
+            raise ValueError('request needs "text" or "close"')
+        on_event = None
+        if request.get("stream"):
+            async def on_event(event):
+                await send(dict(event, session=session_id))
+        return await self.turn(session_id, str(request["text"]), on_event, send=send)
+
+    async def handle(self, reader, writer):
+        default_session = f"conn-{next(self._connection_ids)}"
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def send(message):
+            if writer.is_closing():
+                return
+            async with write_lock:
+                writer.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    # 再生イベントは接続が切れていれば捨てる (要求の応答は読み取り側で終了に気づく)
+                    pass
+
+        async def respond(request):
+            try:
+                response = await self.dispatch(request, default_session, send)
+            except Exception as e:
+                response = {"session": request.get("session") or default_session, "error": str(e)}
+            await send(response)
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = None
+                if not isinstance(request, dict):
+                    await send({"error": "invalid JSON request"})
+                    continue
+                # 要求ごとにタスクにして、遅いターンが同じ接続の他のセッションを待たせないようにする
+                task = asyncio.create_task(respond(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            for session in self.sessions.values():
+                if session.send is send:
+                    session.send = None
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self._loop = asyncio.get_running_loop()
+        self.playback_engines.subscribe(self._on_playback)
+        self._server = await asyncio.start_server(self.handle, host, port)
+        self._reaper = asyncio.create_task(self._reap())
+        return self._server
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def aclose(self):
+        self.playback_engines.unsubscribe(self._on_playback)
+        if self._reaper is not None:
+            self._reaper.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.close_all()
+
+
+async def serve(args):
+    import ambient_music_agent as agent
+
+    server = AgentServer(
+        agent.graph, agent.playback_engines, agent.memory,
+        max_sessions=args.max_sessions, idle_timeout=args.idle_timeout,
+    )
+    await server.start(args.host, args.port)
+    print(f"ambient agent server listening on {args.host}:{server.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ambient_music_agent server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--idle-timeout", type=float, default=1800.0, help="会話も再生も無いセッションを閉じるまでの秒数")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
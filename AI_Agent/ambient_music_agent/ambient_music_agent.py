@@ -1,178 +1,130 @@
 import os
 import json
-import time
-from typing import Any, Dict, Type, Annotated
+from typing import Any, Dict, Optional, Type, Annotated
 from typing_extensions import TypedDict
 from pydantic import BaseModel, Field
 from langchain_openai import ChatOpenAI
 from langchain.tools import BaseTool
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
-from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
-from langgraph.checkpoint.memory import MemorySaver
 
-# --- ここでは pydub を利用して実際にwavファイルを再生します ---
-from pydub import AudioSegment
-from pydub.playback import play
+import catalog_search
+import checkpoint_store
+import conversation
+import fake_llm
+import turn_events
+
+# --- WAV の指定区間をメモリマップから少しずつ出力デバイスへ書き込んで再生します ---
+import audio_sink
+import playback
 
 # --------------------------------------------------
-# システムプロンプトに曲リストを直接埋め込む
+# カタログは起動時に1回だけ読み込み、曲はツールで検索する
 # --------------------------------------------------
-full_track_list = """
-[
-  {
-    "id": "track-001",
-    "title": "Untitled",
-    "description": "",
-    "duration_ms": 240000,
-    "genre": "music",
-    "instrumentation": "unknown",
-    "mood": "neutral",
-    "acousticness": 0.14296111464500427,
-    "energy": 0.11403120309114456,
-    "lofi": false,
-    "filename": "Piano-Nocturne-No2.wav"
-  },
-  {
-    "id": "track-002",
-    "title": "Untitled",
-    "description": "",
-    "duration_ms": 239799,
-    "genre": "music",
-    "instrumentation": "unknown",
-    "mood": "neutral",
-    "acousticness": 0.19966106116771698,
-    "energy": 0.1513269692659378,
-    "lofi": false,
-    "filename": "Whisper-in-the-Breeze.wav"
-  },
-  {
-    "id": "track-003",
-    "title": "Untitled",
-    "description": "",
-    "duration_ms": 15580,
-    "genre": "music",
-    "instrumentation": "unknown",
-    "mood": "neutral",
-    "acousticness": 0.019347477704286575,
-    "energy": 0.018994690850377083,
-    "lofi": false,
-    "filename": "fireworks.wav"
-  },
-  {
-    "id": "track-004",
-    "title": "Untitled",
-    "description": "",
-    "duration_ms": 136533,
-    "genre": "music",
-    "instrumentation": "unknown",
-    "mood": "neutral",
-    "acousticness": 0.13434147834777832,
-    "energy": 0.10481898486614227,
-    "lofi": false,
-    "filename": "garden-Atmosphere-Night.wav"
-  },
-  {
-    "id": "track-005",
-    "title": "Untitled",
-    "description": "",
-    "duration_ms": 60000,
-    "genre": "music",
-    "instrumentation": "unknown",
-    "mood": "neutral",
-    "acousticness": 0.10954444110393524,
-    "energy": 0.06612014025449753,
-    "lofi": true,
-    "filename": "giter.wav"
-  },
-  {
-    "id": "track-006",
-    "title": "Untitled",
-    "description": "",
-    "duration_ms": 60000,
-    "genre": "music",
-    "instrumentation": "unknown",
-    "mood": "neutral",
-    "acousticness": 0.07623947411775589,
-    "energy": 0.057526275515556335,
-    "lofi": true,
-    "filename": "lo-fi-piano.wav"
-  },
-  {
-    "id": "track-007",
-    "title": "Untitled",
-    "description": "",
-    "duration_ms": 117260,
-    "genre": "music",
-    "instrumentation": "unknown",
-    "mood": "neutral",
-    "acousticness": 0.0602198988199234,
-    "energy": 0.05491151288151741,
-    "lofi": false,
-    "filename": "rain.wav"
-  },
-  {
-    "id": "track-008",
-    "title": "Untitled",
-    "description": "",
-    "duration_ms": 15380,
-    "genre": "music",
-    "instrumentation": "unknown",
-    "mood": "neutral",
-    "acousticness": 0.040839437395334244,
-    "energy": 0.039267826825380325,
-    "lofi": true,
-    "filename": "thunder.wav"
-  },
-  {
-    "id": "track-009",
-    "title": "Untitled",
-    "description": "",
-    "duration_ms": 136533,
-    "genre": "music",
-    "instrumentation": "unknown",
-    "mood": "neutral",
-    "acousticness": 0.1381658911705017,
-    "energy": 0.035597704350948334,
-    "lofi": false,
-    "filename": "window-atoms.wav"
-  }
-]
-"""
+# システムプロンプトには曲リストではなくカタログの概要だけを載せるので、
+# ライブラリが大きくなっても1回の LLM 呼び出しで送るトークン数は増えない。
+CATALOG_PATH = os.environ.get("AMBIENT_CATALOG", "./output.json")
+catalog = catalog_search.CatalogSearch.load(CATALOG_PATH)
 
 system_prompt = f"""
-あなたは音楽再生エージェントです。以下は利用可能な曲のリストです:
-{full_track_list}
+あなたは音楽再生エージェントです。曲は music_catalog_search_tool でカタログを検索して選びます。
+カタログの概要:
+{json.dumps(catalog.summary(), ensure_ascii=False)}
 
 【あなたの役割】
-- ユーザーから「自然な雰囲気」や「lofiで」などのテーマや要望を受けたら、上記の曲リストからテーマに合致する曲を選び、プレイリストを提示してください。
+- ユーザーから「自然な雰囲気」や「lofiで」などのテーマや要望を受けたら、music_catalog_search_tool で条件 (テキスト・ジャンル・lofi・energy / acousticness / 長さの範囲) に合う曲を検索し、テーマに合致する曲を選んでプレイリストを提示してください。
 - ユーザーが提示されたプレイリストに同意（例：「OK」）した場合、選ばれた曲を順番に再生してください。
-  - 曲の再生は music_playback_tool を用い、指定された再生開始位置と終了位置で実施してください。
-  - 曲と曲の間には短い待機時間 (sleep_time_ms) を設けます。
-  - 曲の再生は指示がない限り１曲づつ再生してください。
-- ユーザーが「ストップ」や「終了」と指示するまで再生を続けます。ただし、プレイリストの全曲が再生されたら再生を終了します。
+  - 曲の再生は music_playback_tool を用い、指定された再生開始位置と終了位置でプレイリストの曲を順にキューへ追加してください。
+  - 曲と曲の間には短い待機時間 (sleep_time_ms) を設けます。ユーザーが途切れずにつなぐことを望む場合は crossfade_ms で次の曲と重ねてください。
+  - 再生はバックグラウンドで行われるので、再生中もユーザーとの会話を続けてください。
+- ユーザーが「ストップ」や「終了」と指示したら music_stop_tool で再生を止めます。プレイリストの全曲が再生されたら再生は終了します。
+- 「次の曲」などの指示には music_skip_tool、再生状況の質問には music_status_tool を使ってください。
 
 【利用可能なツール】
-- music_playback_tool: 指定した曲IDの曲を実際のwavファイルから再生し、終了後に待機するツールです。
+- music_catalog_search_tool: カタログから条件に合う曲を上位 k 件だけ返す検索ツールです。
+- music_playback_tool: 指定した曲IDの曲を再生キューに追加するツールです (すぐに戻ります)。
+- music_stop_tool: 再生を止めてキューを空にするツールです。
+- music_skip_tool: 再生中の曲を飛ばして次の曲へ進むツールです。
+- music_status_tool: 再生中の曲・再生位置・キューを確認するツールです。
 
 【注意】
-- 再生には pydub と simpleaudio が必要です。
+- 再生には PyAudio (または pydub と simpleaudio) が必要です。
 """
 
+# --------------------------------------------------
+# カタログ検索ツール (CatalogSearchTool)
+# --------------------------------------------------
+class CatalogSearchToolInput(BaseModel):
+    query: Optional[str] = Field(default=None, description="タイトル・説明・ジャンル・ムード・ファイル名から探す単語 (空白区切り)")
+    genre: Optional[str] = Field(default=None, description="ジャンル")
+    lofi: Optional[bool] = Field(default=None, description="lofi の曲だけ (true) / lofi 以外だけ (false)")
+    min_energy: Optional[float] = Field(default=None, description="energy の下限")
+    max_energy: Optional[float] = Field(default=None, description="energy の上限")
+    min_acousticness: Optional[float] = Field(default=None, description="acousticness の下限")
+    max_acousticness: Optional[float] = Field(default=None, description="acousticness の上限")
+    min_duration_ms: Optional[int] = Field(default=None, description="曲の長さの下限（ミリ秒）")
+    max_duration_ms: Optional[int] = Field(default=None, description="曲の長さの上限（ミリ秒）")
+    k: int = Field(default=10, description="返す曲数の上限 (最大 50)")
+
+class CatalogSearchTool(BaseTool):
+    name: str = "music_catalog_search_tool"
+    description: str = "カタログから条件に合う曲を検索し、一致した曲数と上位 k 件の曲情報 (id, filename など) を JSON で返す。"
+    args_schema: Type[BaseModel] = CatalogSearchToolInput
+
+    def _run(
+        self,
+        query: Optional[str] = None,
+        genre: Optional[str] = None,
+        lofi: Optional[bool] = None,
+        min_energy: Optional[float] = None,
+        max_energy: Optional[float] = None,
+        min_acousticness: Optional[float] = None,
+        max_acousticness: Optional[float] = None,
+        min_duration_ms: Optional[int] = None,
+        max_duration_ms: Optional[int] = None,
+        k: int = 10
+    ) -> str:
+        result = catalog.search(
+            text=query,
+            genre=genre,
+            lofi=lofi,
+            energy=(min_energy, max_energy),
+            acousticness=(min_acousticness, max_acousticness),
+            duration_ms=(min_duration_ms, max_duration_ms),
+            k=max(1, min(k, 50)),
+        )
+        return json.dumps(result, ensure_ascii=False)
+
+    async def _arun(self, **kwargs) -> str:
+        return self._run(**kwargs)
+
 # --------------------------------------------------
 # 3. 音楽再生ツール (MusicPlaybackTool)【実際にwavファイル再生】
 # --------------------------------------------------
+# 再生はバックグラウンドの再生エンジンが行い、ツールはキューへの追加・停止・スキップ・
+# 状態確認をすぐに返す。再生中もエージェントは会話を続けられる。
+# 再生エンジンは会話のスレッド (thread_id) ごとに持つので、サーバーモードでは聞き手ごとに別のキューになる。
+# 出力先は環境変数 AMBIENT_AUDIO_SINK で変えられる ("device" / "null" / "null:8" / "wav:./out.wav")。
+playback_engines = playback.PlaybackSessions(
+    sink_factory=audio_sink.sink_factory(os.environ.get("AMBIENT_AUDIO_SINK", "device"))
+)
+
+def session_playback(config: RunnableConfig, create: bool = True):
+    thread_id = (config or {}).get("configurable", {}).get("thread_id", "default")
+    return playback_engines.get(thread_id, create=create)
+
 class MusicPlaybackToolInput(BaseModel):
     filename: str = Field(description="再生したいトラックID。対応するファイル名は filename とする")
     start_time_ms: int = Field(default=0, description="再生開始位置（ミリ秒）")
     end_time_ms: int = Field(default=60000, description="再生終了位置（ミリ秒）")
     sleep_time_ms: int = Field(default=1000, description="次の曲へ行く前の待ち時間（ミリ秒）")
+    crossfade_ms: int = Field(default=0, description="次の曲と重ねるクロスフェードの長さ（ミリ秒）。0 なら待ち時間を挟む")
 
 class MusicPlaybackTool(BaseTool):
     name: str = "music_playback_tool"
-    description: str = "指定したトラックのwavファイルを、指定区間再生し、終了後に少し待機する。"
+    description: str = "指定したトラックのwavファイルを再生キューに追加する。キューの曲は順に指定区間再生され、曲間に少し待機する。"
     args_schema: Type[BaseModel] = MusicPlaybackToolInput
 
     def _run(
@@ -180,7 +132,10 @@ class MusicPlaybackTool(BaseTool):
         filename: str,
         start_time_ms: int = 0,
         end_time_ms: int = 60000,
-        sleep_time_ms: int = 1000
+        sleep_time_ms: int = 1000,
+        crossfade_ms: int = 0,
+        *,
+        config: RunnableConfig
     ) -> str:
         # ファイルパスは '{track_id}.wav' と仮定
         file_path = f"./music/{filename}"
@@ -188,81 +143,177 @@ class MusicPlaybackTool(BaseTool):
             return f"エラー: ファイル {file_path} が存在しません。"
 
         try:
-            # WAVファイルを読み込み
-            audio = AudioSegment.from_wav(file_path)
-            # end_time_ms がオーディオ長より長い場合は、オーディオの長さに合わせる
-            if end_time_ms > len(audio):
-                end_time_ms = len(audio)
-            # 指定区間を抽出
-            segment = audio[start_time_ms:end_time_ms]
-            print(f"[MusicPlaybackTool] {file_path} を {start_time_ms}ms から {end_time_ms}ms まで再生します。")
-            play(segment)  # 再生（ブロッキング呼び出し）
+            pending = session_playback(config).enqueue(
+                filename, file_path, start_time_ms, end_time_ms, sleep_time_ms, crossfade_ms
+            )
         except Exception as e:
-            return f"ファイル {file_path} の再生中にエラーが発生しました: {e}"
+            return f"ファイル {file_path} をキューに追加できませんでした: {e}"
 
-        print(f"[MusicPlaybackTool] {filename} の再生が終了しました。{sleep_time_ms}ms 待機します。")
-        time.sleep(sleep_time_ms / 1000.0)
-        return f"Played track {filename} from {start_time_ms}ms to {end_time_ms}ms, then waited {sleep_time_ms}ms."
+        transition = f"a {crossfade_ms}ms crossfade" if crossfade_ms else f"a {sleep_time_ms}ms gap"
+        return (
+            f"Queued track {filename} from {start_time_ms}ms to {end_time_ms}ms with {transition} "
+            f"({pending} track(s) waiting)."
+        )
 
-    async def _arun(self, *args, **kwargs) -> str:
-        raise NotImplementedError("Async playback is not supported yet.")
+    async def _arun(
+        self,
+        filename: str,
+        start_time_ms: int = 0,
+        end_time_ms: int = 60000,
+        sleep_time_ms: int = 1000,
+        crossfade_ms: int = 0,
+        *,
+        config: RunnableConfig
+    ) -> str:
+        # キューへの追加はすぐに返るのでイベントループを止めない
+        return self._run(filename, start_time_ms, end_time_ms, sleep_time_ms, crossfade_ms, config=config)
+
+class EmptyInput(BaseModel):
+    pass
+
+class MusicStopTool(BaseTool):
+    name: str = "music_stop_tool"
+    description: str = "再生中の曲を止め、再生キューを空にする。"
+    args_schema: Type[BaseModel] = EmptyInput
+
+    def _run(self, config: RunnableConfig) -> str:
+        engine = session_playback(config, create=False)
+        cancelled = engine.stop() if engine is not None else 0
+        return f"Stopped playback and cleared {cancelled} track(s)."
+
+    async def _arun(self, config: RunnableConfig) -> str:
+        return self._run(config)
+
+class MusicSkipTool(BaseTool):
+    name: str = "music_skip_tool"
+    description: str = "再生中の曲を止めて、キューの次の曲へ進む。"
+    args_schema: Type[BaseModel] = EmptyInput
+
+    def _run(self, config: RunnableConfig) -> str:
+        engine = session_playback(config, create=False)
+        skipped = engine.skip() if engine is not None else None
+        if skipped is None:
+            return "Nothing is playing."
+        return f"Skipped track {skipped['track_id']}."
+
+    async def _arun(self, config: RunnableConfig) -> str:
+        return self._run(config)
+
+class MusicStatusTool(BaseTool):
+    name: str = "music_status_tool"
+    description: str = "再生状態 (再生中の曲・再生位置・キューの曲) を JSON で返す。"
+    args_schema: Type[BaseModel] = EmptyInput
+
+    def _run(self, config: RunnableConfig) -> str:
+        engine = session_playback(config, create=False)
+        if engine is None:
+            return json.dumps({"state": "idle", "current": None, "queue": []})
+        return json.dumps(engine.status(), ensure_ascii=False)
+
+    async def _arun(self, config: RunnableConfig) -> str:
+        return self._run(config)
 
 # --------------------------------------------------
 # エージェントの状態定義
 # --------------------------------------------------
+# 会話の状態はチェックポイントの State だけに持つ (run_agent 側で履歴のリストを持たない)。
+# システムプロンプトは State に入れず、LLM を呼ぶたびに要約と一緒に先頭へ付ける。
 class State(TypedDict):
     messages: Annotated[list, add_messages]
+    # 履歴から削除した古いターンの要約
+    summary: str
 
 # --------------------------------------------------
 # LLM の設定とツールのバインド
 # --------------------------------------------------
-llm = ChatOpenAI(model_name="gpt-4o")
-tools = [MusicPlaybackTool()]
-
-# Bind tools to the LLM
-llm_with_tools = llm.bind_tools(tools)
-
-# Definition of nodes
-def chatbot(state: State):
-    return {"messages": [llm_with_tools.invoke(state["messages"])]}
+# AMBIENT_LLM=fake なら API を呼ばない決まった応答の LLM を使う (オフラインでのグラフの計測用。
+# 応答は環境変数 AMBIENT_FAKE_LLM_SCRIPT / _LATENCY_MS などで決める。fake_llm.py を参照)
+if os.environ.get("AMBIENT_LLM", "openai") == "fake":
+    llm = fake_llm.ScriptedChatModel.from_env("AMBIENT_FAKE_LLM", token_counter=conversation.message_tokens)
+else:
+    llm = ChatOpenAI(model_name="gpt-4o")
+tools = [CatalogSearchTool(), MusicPlaybackTool(), MusicStopTool(), MusicSkipTool(), MusicStatusTool()]
 
 # --------------------------------------------------
 # ノード定義とグラフ構築
 # --------------------------------------------------
-def chatbot(state: State):
-    return {"messages": [llm_with_tools.invoke(state["messages"])]}
+def build_graph(llm, checkpointer, history_token_budget=conversation.HISTORY_TOKEN_BUDGET):
+    """
+    compact (履歴の上限管理) -> chatbot <-> tools のグラフ。
+    history_token_budget=None なら履歴を縮めない (比較用)。
+    """
+    llm_with_tools = llm.bind_tools(tools)
+
+    def compact(state: State):
+        updates, summary = conversation.compact_history(
+            state["messages"], state.get("summary", ""), budget=history_token_budget
+        )
+        if not updates:
+            return {}
+        return {"messages": updates, "summary": summary}
 
-tool_node = ToolNode(tools=tools)
-graph_builder = StateGraph(State)
-graph_builder.add_node("chatbot", chatbot)
-graph_builder.add_node("tools", tool_node)
-graph_builder.add_conditional_edges("chatbot", tools_condition)
-graph_builder.add_edge("tools", "chatbot")
-graph_builder.add_edge(START, "chatbot")
+    def chatbot(state: State):
+        prompt = conversation.build_prompt(system_prompt, state.get("summary", ""), state["messages"])
+        return {"messages": [llm_with_tools.invoke(prompt)]}
 
-memory = MemorySaver()
-graph = graph_builder.compile(checkpointer=memory)
+    # astream (サーバーモード) では LLM の応答を待つ間スレッドを使わずに他のセッションを進める
+    async def achatbot(state: State):
+        prompt = conversation.build_prompt(system_prompt, state.get("summary", ""), state["messages"])
+        return {"messages": [await llm_with_tools.ainvoke(prompt)]}
+
+    graph_builder = StateGraph(State)
+    graph_builder.add_node("compact", compact)
+    graph_builder.add_node("chatbot", RunnableLambda(chatbot, afunc=achatbot, name="chatbot"))
+    graph_builder.add_node("tools", ToolNode(tools=tools))
+    graph_builder.add_conditional_edges("chatbot", tools_condition)
+    graph_builder.add_edge("tools", "chatbot")
+    graph_builder.add_edge(START, "compact")
+    graph_builder.add_edge("compact", "chatbot")
+    return graph_builder.compile(checkpointer=checkpointer)
+
+# 会話はスレッドごとに SQLite に保存し (直近のチェックポイントだけを残す)、再起動しても続きから話せる。
+# 保存先は環境変数 AMBIENT_CHECKPOINT_DB で変えられる (":memory:" ならプロセスのメモリ上)。
+# ファイルは最初の会話を保存するときに作る (import しただけでは作らない)。
+memory = checkpoint_store.SqliteCheckpointSaver(os.environ.get("AMBIENT_CHECKPOINT_DB", "./checkpoints.sqlite"))
+graph = build_graph(llm, memory)
 
 # --------------------------------------------------
-# エージェント実行用メッセージリストの準備と対話ループ
+# 対話ループ
 # --------------------------------------------------
-messages = [SystemMessage(content=system_prompt)]
-
+# 応答はトークンが届くたびに表示し、ツールの呼び出しと再生の進み具合はイベントとして1行ずつ表示する
 def run_agent(user_input: str, thread_id: str = "default"):
     config = {"configurable": {"thread_id": thread_id}}
-    messages.append(HumanMessage(content=user_input))
-    events = graph.stream({"messages": messages}, config, stream_mode="values")
-    last_message = None
-    for event in events:
-        if "messages" in event:
-            last_message = event["messages"][-1]
-            print("Assistant:", last_message.content)
-    if last_message and isinstance(last_message, AIMessage):
-        messages.append(last_message)
+    # 送るのは新しい発話だけ。それまでの履歴はチェックポイントから復元される
+    in_reply = False
+    for event in turn_events.stream_turn(graph, user_input, config):
+        if event["event"] == "token":
+            if not in_reply:
+                print("Assistant: ", end="")
+                in_reply = True
+            print(event["text"], end="", flush=True)
+            continue
+        if in_reply:
+            print()
+            in_reply = False
+        if event["event"] == "tool_call":
+            print(f"  … {event['name']} {json.dumps(event['args'], ensure_ascii=False)}")
+        elif event["event"] == "done":
+            ttft = "-" if event["ttft_ms"] is None else f"{event['ttft_ms']:.0f} ms"
+            print(f"  [最初のトークンまで {ttft} / 応答 {event['ms']:.0f} ms]")
+
+def print_playback_event(thread_id, event):
+    if event["event"] == "now_playing":
+        print(f"\n♪ 再生開始: {event['track_id']} ({event['start_ms']}〜{event['end_ms']} ms)")
+    elif event["event"] == "queue_finished":
+        print("\n♪ キューの曲をすべて再生しました")
+    elif event["event"] == "playback_error":
+        print(f"\n♪ {event['track_id']} を再生できませんでした: {event['error']}")
 
 if __name__ == "__main__":
+    playback_engines.subscribe(print_playback_event)
     while True:
         user_input = input("User: ")
         if user_input.lower() in ["exit", "quit"]:
             break
         run_agent(user_input)
+    playback_engines.close_all()
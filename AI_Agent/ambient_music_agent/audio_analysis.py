@@ -1,8 +1,25 @@
 import os
 import json
+import time
+import argparse
 import librosa
 import numpy as np
+import scipy.fft
+import scipy.signal
 import uuid
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import cached_property, lru_cache
+
+import audio_io
+from catalog_store import write_catalog_columnar
+from feature_store import FeatureStore
+from similarity_index import write_similarity_index
+from stage_profiler import StageSummary, merge_records, profile_stages, scale_records, stage
+from timeline_store import TimelineStore
+
+# 特徴量の計算方法を変えたら上げる (特徴量キャッシュのキーに含まれる)
+ANALYSIS_VERSION = 1
 
 # ==============================================
 # 追加：NumPy型をJSONに変換するためのエンコーダ
@@ -17,125 +34,716 @@ class NumpyEncoder(json.JSONEncoder):
             return obj.tolist()
         return super().default(obj)
 
+# ==============================================
+# 帯域エネルギー
+# ==============================================
+# (帯域名, 上限周波数[Hz]) を低い順に並べる。最後の上限 None はナイキスト周波数まで。
+# 既定は 低域: ~250Hz, 中域:250~2000Hz, 高域:2000Hz~
+DEFAULT_BANDS = (("low", 250.0), ("mid", 2000.0), ("high", None))
+
+
+@lru_cache(maxsize=64)
+def band_bin_starts(sr, n_fft, bands=DEFAULT_BANDS):
+    """
+    (sr, n_fft, bands) ごとに、各帯域の先頭 FFT ビン番号を計算してキャッシュする。
+    帯域は周波数順に連続しているので「先頭ビン」だけで区切りが決まる。
+    戻り値: (starts, counts) いずれも書き込み不可の int 配列
+    """
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+    # 上限周波数「以下」のビンをその帯域に含める
+    stops = np.array([
+        len(freqs) if upper is None else np.searchsorted(freqs, upper, side="right")
+        for _, upper in bands
+    ])
+    if np.any(np.diff(stops) < 0):
+        raise ValueError(f"bands must be sorted by upper frequency: {bands}")
+    starts = np.concatenate([[0], stops[:-1]])
+    counts = stops - starts
+    starts.flags.writeable = False
+    counts.flags.writeable = False
+    return starts, counts
+
+
+def band_energy_series(S, sr, n_fft, bands=DEFAULT_BANDS):
+    """
+    振幅スペクトログラム S (ビン, フレーム) を帯域ごとに合計した時系列 (帯域, フレーム) を返す。
+    マスクでコピーを作らず、np.add.reduceat による1回の縮約で全帯域をまとめて計算する。
+    """
+    starts, counts = band_bin_starts(sr, n_fft, tuple(bands))
+    series = np.zeros((len(starts), S.shape[-1]), dtype=S.dtype)
+    nonempty = counts > 0
+    if nonempty.any():
+        series[nonempty] = np.add.reduceat(S, starts[nonempty], axis=0)
+    return series
+
+
+def band_ratios(band_totals, bands=DEFAULT_BANDS):
+    """
+    帯域ごとの合計エネルギーから {"<帯域名>_band_ratio": 比率} を作る
+    """
+    total_energy = float(np.sum(band_totals))
+    if total_energy == 0:
+        total_energy = 1e-9
+    return {
+        f"{name}_band_ratio": float(energy) / total_energy
+        for (name, _), energy in zip(bands, band_totals)
+    }
+
+
+# 類似検索の埋め込み (features["embedding"]) の MFCC 次数
+EMBEDDING_MFCC = 20
+
+
+# ==============================================
+# 1ファイル分の解析で共有するスペクトル表現
+# ==============================================
+class AnalysisContext:
+    """
+    1ファイルの解析中に使い回す中間表現をキャッシュする。
+    STFT振幅・メルスペクトログラム・オンセット包絡・CQTクロマは
+    最初に参照されたときに一度だけ計算され、以降の特徴量はそれを共有する。
+    """
+
+    def __init__(self, y, sr, n_fft=2048, hop_length=512):
+        self.y = y
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        # 音楽 / 環境音の判定に使う中間表現 (テンポ・オンセット包絡とその依存先) をファイル全体で
+        # 計算した時間 {名前: 秒}。features_from_context が測る (計算しなければ None)
+        self.classify_seconds = None
+
+    @cached_property
+    def duration(self):
+        return librosa.get_duration(y=self.y, sr=self.sr)
+
+    @cached_property
+    def max_amplitude(self):
+        peak = np.max(np.abs(self.y)) if self.y.size else 0.0
+        return peak if peak != 0 else 1.0
+
+    @cached_property
+    def stft_magnitude(self):
+        with stage("stft"):
+            return np.abs(librosa.stft(self.y, n_fft=self.n_fft, hop_length=self.hop_length))
+
+    def band_energy(self, bands=DEFAULT_BANDS):
+        """
+        帯域ごとのエネルギー時系列 (帯域, フレーム)。帯域定義ごとにキャッシュする。
+        """
+        bands = tuple(bands)
+        cache = self.__dict__.setdefault("_band_energy", {})
+        if bands not in cache:
+            with stage("band_energy"):
+                cache[bands] = band_energy_series(self.stft_magnitude, self.sr, self.n_fft, bands)
+        return cache[bands]
+
+    @cached_property
+    def mel_spectrogram(self):
+        # onset_strength(y=...) と同じくパワースペクトルからメル化する
+        S = self.stft_magnitude
+        with stage("mel"):
+            return librosa.feature.melspectrogram(S=S ** 2, sr=self.sr)
+
+    @cached_property
+    def mel_db(self):
+        mel = self.mel_spectrogram
+        with stage("mel"):
+            return librosa.power_to_db(mel)
+
+    @cached_property
+    def onset_envelope(self):
+        mel_db = self.mel_db
+        with stage("onset"):
+            return librosa.onset.onset_strength(S=mel_db, sr=self.sr, hop_length=self.hop_length)
+
+    @cached_property
+    def beat_onset_envelope(self):
+        # beat_track(y=...) は中央値集約のオンセット包絡を使うため別に保持する
+        mel_db = self.mel_db
+        with stage("onset"):
+            return librosa.onset.onset_strength(
+                S=mel_db, sr=self.sr, hop_length=self.hop_length, aggregate=np.median
+            )
+
+    @cached_property
+    def chroma(self):
+        with stage("chroma_cqt"):
+            return librosa.feature.chroma_cqt(y=self.y, sr=self.sr, hop_length=self.hop_length)
+
+    @cached_property
+    def mfcc(self):
+        mel_db = self.mel_db
+        with stage("mfcc"):
+            return librosa.feature.mfcc(S=mel_db, sr=self.sr, n_mfcc=EMBEDDING_MFCC)
+
+    @cached_property
+    def chroma_stft(self):
+        # 類似検索の埋め込み用。CQT より軽い STFT クロマ (チューニング推定なし)
+        S = self.stft_magnitude
+        with stage("chroma_stft"):
+            return librosa.feature.chroma_stft(S=S ** 2, sr=self.sr, n_fft=self.n_fft, tuning=0.0)
+
+    @cached_property
+    def rms(self):
+        with stage("rms"):
+            return librosa.feature.rms(y=self.y, frame_length=self.n_fft, hop_length=self.hop_length)
+
+    @cached_property
+    def spectral_flatness(self):
+        S = self.stft_magnitude
+        with stage("spectral_flatness"):
+            return librosa.feature.spectral_flatness(S=S)
+
+    @cached_property
+    def tempo(self):
+        envelope = self.beat_onset_envelope
+        with stage("tempo"):
+            return estimate_tempo(envelope, self.sr, hop_length=self.hop_length)
+
+
+def mean_tempogram(onset_envelope, sr, hop_length=512, win_length=384, max_elements=1 << 20):
+    """
+    librosa.feature.tempogram(...).mean(axis=1) と同じ値を、(win_length, T) の行列を
+    一度に作らずに計算する。フレームを max_elements 要素程度ずつ FFT 自己相関して足し合わせる。
+    """
+    envelope = np.asarray(onset_envelope, dtype=np.float64)
+    n_frames = len(envelope)
+    half = win_length // 2
+    # tempogram(center=True) と同じく両端を 0 へのランプで埋める
+    padded = np.pad(envelope, (half, half), mode="linear_ramp", end_values=[0, 0])
+
+    ac_window = scipy.signal.get_window("hann", win_length, fftbins=True)
+    n_fft = scipy.fft.next_fast_len(2 * win_length - 1)
+    total = np.zeros(win_length)
+    chunk = max(1, max_elements // n_fft)
+    for start in range(0, n_frames, chunk):
+        stop = min(start + chunk, n_frames)
+        frames = np.lib.stride_tricks.sliding_window_view(padded[start:stop + win_length - 1], win_length)
+        spectrum = np.fft.rfft(frames * ac_window, n=n_fft, axis=-1)
+        ac = np.fft.irfft(np.abs(spectrum) ** 2, n=n_fft, axis=-1)[:, :win_length]
+        # librosa.util.normalize(norm=np.inf) と同じく、ほぼ 0 のフレームは正規化しない
+        peak = np.abs(ac).max(axis=-1, keepdims=True)
+        ac /= np.where(peak < np.finfo(ac.dtype).tiny, 1.0, peak)
+        total += ac.sum(axis=0)
+    return total / max(n_frames, 1)
+
+
+def estimate_tempo(onset_envelope, sr, hop_length=512, start_bpm=120.0, ac_size=8.0):
+    """
+    beat_track(onset_envelope=...) が返すテンポと同じ値を求める。
+    ビート位置の動的計画法は使わず、平均テンポグラムと対数正規の事前分布だけで決める。
+    """
+    # beat_track はオンセットが全く無いとテンポ 0 を返す
+    if not np.any(onset_envelope):
+        return 0.0
+    win_length = librosa.time_to_frames(ac_size, sr=sr, hop_length=hop_length).item()
+    tg = mean_tempogram(onset_envelope, sr, hop_length=hop_length, win_length=win_length)
+    tempo = librosa.feature.tempo(tg=tg[:, np.newaxis], sr=sr, hop_length=hop_length, start_bpm=start_bpm)
+    return float(np.asarray(tempo).reshape(-1)[0])
+
+
+def batch_mean_tempogram(onset_envelopes, win_length=384, max_elements=1 << 20):
+    """
+    長さの異なる複数のオンセット包絡について、mean_tempogram と同じ値を
+    (ファイル数, win_length) でまとめて返す。
+    包絡を2次元配列に詰め、フレームを max_elements 要素程度ずつ全ファイル同時に FFT 自己相関する。
+    短いクリップが多いときだけファイルごとの mean_tempogram より速く、長さがまちまちだと
+    パディングの分だけ遅くなるので (benchmark.py tempo)、バッチ解析の tempo_batch_size を
+    指定したときだけ使う。
+    """
+    lengths = np.array([len(env) for env in onset_envelopes])
+    n_files = len(onset_envelopes)
+    half = win_length // 2
+    max_len = int(lengths.max()) if n_files else 0
+
+    # tempogram(center=True) と同じく両端を 0 へのランプで埋めてから詰める
+    padded = np.zeros((n_files, max_len + 2 * half))
+    for i, env in enumerate(onset_envelopes):
+        padded[i, :len(env) + 2 * half] = np.pad(
+            np.asarray(env, dtype=np.float64), (half, half), mode="linear_ramp", end_values=[0, 0]
+        )
+
+    ac_window = scipy.signal.get_window("hann", win_length, fftbins=True)
+    n_fft = scipy.fft.next_fast_len(2 * win_length - 1)
+    total = np.zeros((n_files, win_length))
+    chunk = max(1, max_elements // max(n_files * n_fft, 1))
+    for start in range(0, max_len, chunk):
+        stop = min(start + chunk, max_len)
+        frames = np.lib.stride_tricks.sliding_window_view(
+            padded[:, start:stop + win_length - 1], win_length, axis=1
+        )
+        spectrum = np.fft.rfft(frames * ac_window, n=n_fft, axis=-1)
+        ac = np.fft.irfft(np.abs(spectrum) ** 2, n=n_fft, axis=-1)[..., :win_length]
+        peak = np.abs(ac).max(axis=-1, keepdims=True)
+        ac /= np.where(peak < np.finfo(ac.dtype).tiny, 1.0, peak)
+        # 各ファイルの長さを超える (パディングだけの) フレームは平均に含めない
+        valid = np.arange(start, stop)[np.newaxis, :] < lengths[:, np.newaxis]
+        total += np.einsum("ftw,ft->fw", ac, valid)
+    return total / np.maximum(lengths, 1)[:, np.newaxis]
+
+
+def batch_estimate_tempo(onset_envelopes, sr, hop_length=512, start_bpm=120.0, ac_size=8.0):
+    """
+    estimate_tempo と同じ値を、複数ファイル分まとめて求める。
+    全ファイルの sr と hop_length は揃っている必要がある。
+    """
+    if not len(onset_envelopes):
+        return np.zeros(0)
+    win_length = librosa.time_to_frames(ac_size, sr=sr, hop_length=hop_length).item()
+    tg = batch_mean_tempogram(onset_envelopes, win_length=win_length)
+    tempo = librosa.feature.tempo(
+        tg=tg[:, :, np.newaxis], sr=sr, hop_length=hop_length, start_bpm=start_bpm
+    )
+    tempo = np.asarray(tempo, dtype=np.float64).reshape(len(onset_envelopes))
+    # beat_track はオンセットが全く無いとテンポ 0 を返す
+    silent = np.array([not np.any(env) for env in onset_envelopes])
+    tempo[silent] = 0.0
+    return tempo
+
+
+# ==============================================
+# 解析プロファイル
+# ==============================================
+# - sr: 解析サンプルレート (None ならファイルのネイティブレート)
+# - window_seconds / n_windows: ファイル全体ではなく、等間隔に置いた n_windows 個の
+#   窓 (各 window_seconds 秒) だけを読み込んでつなげて解析する (None なら全体)
+ANALYSIS_PROFILES = {
+    "full": {"sr": None, "window_seconds": None, "n_windows": None},
+    "fast": {"sr": 22050, "window_seconds": 20.0, "n_windows": 3},
+}
+
+
+def load_audio(audio_path, profile="full"):
+    """
+    プロファイルに従って音声を読み込み、(y, sr, ファイル全体の長さ[秒]) を返す
+    """
+    with stage("decode"):
+        return _load_audio(audio_path, profile)
+
+
+def _load_audio(audio_path, profile):
+    settings = ANALYSIS_PROFILES[profile]
+    window_seconds = settings["window_seconds"]
+    n_windows = settings["n_windows"]
+
+    if not window_seconds or not n_windows:
+        y, sr = audio_io.load(audio_path, sr=settings["sr"])
+        return y, sr, librosa.get_duration(y=y, sr=sr)
+
+    file_duration = audio_io.get_duration(audio_path)
+    if file_duration <= window_seconds * n_windows:
+        y, sr = audio_io.load(audio_path, sr=settings["sr"])
+        return y, sr, file_duration
+
+    # 窓の中心をファイル全体に等間隔に配置する
+    chunks = []
+    sr = settings["sr"]
+    for i in range(n_windows):
+        center = file_duration * (i + 1) / (n_windows + 1)
+        offset = max(0.0, center - window_seconds / 2)
+        chunk, sr = audio_io.load(audio_path, sr=settings["sr"], offset=offset, duration=window_seconds)
+        chunks.append(chunk)
+    return np.concatenate(chunks), sr, file_duration
+
+
+# classify_audio_type の判定境界
+MIN_MUSIC_TEMPO = 30
+MIN_MUSIC_ONSET_STRENGTH = 0.01
+
+
 def classify_audio_type(y, sr, tempo, mean_onset_strength):
     """
     簡易的に「音楽」か「環境音」かを二分する例
     """
-    if tempo < 30 or mean_onset_strength < 0.01:
+    if tempo < MIN_MUSIC_TEMPO or mean_onset_strength < MIN_MUSIC_ONSET_STRENGTH:
         return "environment"
     else:
         return "music"
 
-def estimate_key(y, sr):
+
+# ==============================================
+# 抜粋による事前判定
+# ==============================================
+# ファイル全体のオンセット包絡とテンポを求める前に、数か所から切り出した短い抜粋を
+# 低いサンプルレートで解析して音楽 / 環境音を決める。判定境界から十分離れているときだけ
+# 結果を使い、曖昧なときは None を返して通常の (全体での) 判定に任せる。
+# - sr / n_fft / hop_length: 抜粋の解析条件 (間引いたレートに合わせて窓も短くする)
+# - excerpt_seconds / n_excerpts: 等間隔に置く抜粋の長さと数
+# - margin: 平均オンセット強度が境界の margin 倍以上なら音楽、1/margin 倍以下なら環境音
+# - min_active: 音楽と判定するのに必要な、中央値集約のオンセット包絡が 0 でないフレームの割合
+#   (全フレームで 0 だとテンポ推定が 0 になり環境音と判定されるため)
+PRECLASSIFY_SETTINGS = {
+    "sr": 11025,
+    "n_fft": 1024,
+    "hop_length": 256,
+    "excerpt_seconds": 5.0,
+    "n_excerpts": 3,
+    "margin": 4.0,
+    "min_active": 0.05,
+}
+
+
+def load_excerpts(audio_path, file_duration=None, settings=PRECLASSIFY_SETTINGS):
+    """
+    ファイル全体に等間隔に置いた抜粋をそれぞれ読み込み、([y, ...], sr) を返す。
+    ファイルが抜粋の合計より短ければ全体を1つの抜粋として返す。
+    """
+    if file_duration is None:
+        file_duration = audio_io.get_duration(audio_path)
+    excerpt_seconds = settings["excerpt_seconds"]
+    n_excerpts = settings["n_excerpts"]
+    if file_duration <= excerpt_seconds * n_excerpts:
+        y, sr = audio_io.load(audio_path, sr=settings["sr"], res_type="soxr_lq")
+        return [y], sr
+
+    excerpts = []
+    sr = settings["sr"]
+    for i in range(n_excerpts):
+        center = file_duration * (i + 1) / (n_excerpts + 1)
+        offset = max(0.0, center - excerpt_seconds / 2)
+        y, sr = audio_io.load(
+            audio_path, sr=settings["sr"], offset=offset, duration=excerpt_seconds, res_type="soxr_lq"
+        )
+        excerpts.append(y)
+    return excerpts, sr
+
+
+def preclassify_audio_type(audio_path, file_duration=None, settings=PRECLASSIFY_SETTINGS):
+    """
+    抜粋から音楽 / 環境音を判定する。"music" / "environment"、曖昧なら None。
+    classify_audio_type と同じ指標 (平均オンセット強度と、テンポ推定が 0 になるか) を
+    抜粋ごとの包絡から求め、境界付近では判定しない。
+    """
+    with stage("preclassify"):
+        excerpts, sr = load_excerpts(audio_path, file_duration, settings)
+        onset_sum = 0.0
+        active = 0
+        frames = 0
+        for y in excerpts:
+            ctx = AnalysisContext(y, sr, n_fft=settings["n_fft"], hop_length=settings["hop_length"])
+            onset_sum += float(ctx.onset_envelope.sum())
+            active += int(np.count_nonzero(ctx.beat_onset_envelope))
+            frames += len(ctx.onset_envelope)
+
+    frames = max(frames, 1)
+    mean_onset_strength = onset_sum / frames
+    active_fraction = active / frames
+    margin = settings["margin"]
+    if active == 0 or mean_onset_strength <= MIN_MUSIC_ONSET_STRENGTH / margin:
+        return "environment"
+    if mean_onset_strength >= MIN_MUSIC_ONSET_STRENGTH * margin and active_fraction >= settings["min_active"]:
+        return "music"
+    return None
+
+
+def _classify_seconds(excerpt_seconds, classified_by, full_seconds, skipped):
     """
-    クロマ特徴量を使用してキーを推定する。
+    事前判定の時間の内訳。features["classify_seconds"] に入れる。
+    - excerpt: 抜粋の解析にかかった時間
+    - full: 判定に使う中間表現をファイル全体で計算した時間 {名前: 秒} (判定のためでも、
+      特徴量のためでも。計算しなかったら None)
+    - skipped: 抜粋で判定でき、ファイル全体では計算せずに済んだ判定用の中間表現の名前のリスト
     """
-    chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-    chroma_sum = chroma.sum(axis=1)
-    key_idx = np.argmax(chroma_sum)  # 最大のエネルギーを持つクロマ
-    key_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-    return key_names[key_idx]
+    return {
+        "excerpt": excerpt_seconds,
+        "full": full_seconds,
+        "skipped": sorted(skipped) if classified_by == "excerpt" else [],
+    }
+
 
-def extract_music_features(y, sr, tempo):
+def _preclassified_flag(audio_path, environment_flag):
     """
-    音楽向けの特徴量を抽出
+    environment_flag が None なら事前判定し、(environment_flag, 判定方法) を返す。
+    判定方法は "flag" (指定済み) / "excerpt" (事前判定) / "full" (曖昧なので全体で判定)
     """
-    duration = librosa.get_duration(y=y, sr=sr)
+    if environment_flag is not None:
+        return environment_flag, "flag"
+    audio_type = preclassify_audio_type(audio_path)
+    if audio_type is None:
+        return None, "full"
+    return audio_type == "environment", "excerpt"
 
-    rms_values = librosa.feature.rms(y=y)
-    rms = rms_values.mean()
-    max_y = np.max(np.abs(y)) if np.max(np.abs(y)) != 0 else 1.0
 
-    features = {}
-    # 簡易的なアコースティック性指標
-    features["acousticness"] = rms / max_y
+def warm_up_preclassify(settings=PRECLASSIFY_SETTINGS):
+    """
+    短い合成ノイズで抜粋の解析と同じ計算を一度だけ行い、numba のコンパイルや FFT の準備を済ませる。
+    プロセスで最初の解析は数秒かかり、事前判定を有効にするとその分が抜粋の解析時間に乗って
+    短縮時間の見積もりが負に偏るので、バッチ解析ではワーカーごとに計測の外で呼ぶ。
+    """
+    y = np.random.default_rng(0).standard_normal(int(settings["sr"] * settings["excerpt_seconds"]))
+    ctx = AnalysisContext(y.astype(np.float32), settings["sr"], settings["n_fft"], settings["hop_length"])
+    ctx.onset_envelope
+    ctx.tempo
 
-    # リズムの揺れ(テンポグラム平均)
-    tempogram = librosa.feature.tempogram(y=y, sr=sr)
-    features["danceability"] = np.mean(tempogram) if tempogram.size else 0.0
+KEY_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
 
-    features["duration_ms"] = int(duration * 1000)
-    features["energy"] = rms
+def estimate_key(y, sr, chroma=None):
+    """
+    クロマ特徴量を使用してキーを推定する。
+    chroma が渡された場合は再計算せずにそれを使う。
+    """
+    if chroma is None:
+        chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
+    chroma_sum = chroma.sum(axis=1)
+    key_idx = np.argmax(chroma_sum)  # 最大のエネルギーを持つクロマ
+    return KEY_NAMES[key_idx]
 
-    spectral_contrast = librosa.feature.spectral_contrast(y=y, sr=sr)
-    features["instrumentalness"] = 1.0 if np.mean(spectral_contrast) > 20 else 0.0
+# ==============================================
+# 特徴量と中間表現の依存関係
+# ==============================================
+# 中間表現 (AnalysisContext の属性) -> 直接依存する中間表現
+INTERMEDIATE_DEPENDENCIES = {
+    "duration": (),
+    "max_amplitude": (),
+    "stft_magnitude": (),
+    "band_energy": ("stft_magnitude",),
+    "mel_spectrogram": ("stft_magnitude",),
+    "mel_db": ("mel_spectrogram",),
+    "onset_envelope": ("mel_db",),
+    "beat_onset_envelope": ("mel_db",),
+    "chroma": (),
+    "mfcc": ("mel_db",),
+    "chroma_stft": ("stft_magnitude",),
+    "rms": (),
+    "spectral_flatness": ("stft_magnitude",),
+    "tempo": ("beat_onset_envelope",),
+}
 
-    features["key"] = estimate_key(y, sr)
+# 音楽 / 環境音の判定に使う中間表現 (environment_flag が None のとき)
+CLASSIFY_DEPENDENCIES = ("tempo", "onset_envelope")
 
-    onset_strength = librosa.onset.onset_strength(y=y, sr=sr).mean()
-    features["liveness"] = onset_strength
 
-    features["loudness"] = rms * 100
+def _danceability(ctx):
+    # リズムの揺れ(テンポグラム平均)
+    onset_env = ctx.onset_envelope
+    with stage("tempogram"):
+        tempogram = librosa.feature.tempogram(onset_envelope=onset_env, sr=ctx.sr, hop_length=ctx.hop_length)
+    return np.mean(tempogram) if tempogram.size else 0.0
+
 
+def _instrumentalness(ctx):
+    S = ctx.stft_magnitude
+    with stage("spectral_contrast"):
+        spectral_contrast = librosa.feature.spectral_contrast(S=S, sr=ctx.sr)
+    return 1.0 if np.mean(spectral_contrast) > 20 else 0.0
+
+
+def _mode(ctx):
     # 簡易的モード判定
-    tonnetz = librosa.feature.tonnetz(y=y, sr=sr)
+    chroma = ctx.chroma
+    with stage("tonnetz"):
+        tonnetz = librosa.feature.tonnetz(y=ctx.y, sr=ctx.sr, chroma=chroma)
     tonnetz_mean = tonnetz.mean() if tonnetz.size else 0.0
-    features["mode"] = 1 if tonnetz_mean > 0 else 0
+    return 1 if tonnetz_mean > 0 else 0
+
 
+def _speechiness(ctx):
     # スピーチの可能性
-    zcr = librosa.feature.zero_crossing_rate(y=y)
-    features["speechiness"] = np.mean(zcr) if zcr.size else 0.0
+    with stage("zcr"):
+        zcr = librosa.feature.zero_crossing_rate(y=ctx.y)
+    return np.mean(zcr) if zcr.size else 0.0
+
+
+def _onset_count(ctx):
+    onset_env = ctx.onset_envelope
+    with stage("onset_detect"):
+        return np.count_nonzero(
+            librosa.onset.onset_detect(onset_envelope=onset_env, sr=ctx.sr, hop_length=ctx.hop_length)
+        )
+
+
+def _mean_or_zero(x):
+    return np.mean(x) if x.size else 0.0
+
+
+def _embedding(ctx):
+    # 類似検索用: MFCC とクロマのフレーム平均 (similarity_index のベクトルに使う)
+    return {
+        "mfcc": ctx.mfcc.mean(axis=1).tolist() if ctx.mfcc.size else [0.0] * EMBEDDING_MFCC,
+        "chroma": ctx.chroma_stft.mean(axis=1).tolist() if ctx.chroma_stft.size else [0.0] * 12,
+    }
 
-    features["tempo"] = tempo
-    features["time_signature"] = 4  # デフォルト
+
+# 音楽の特徴量名 -> (依存する中間表現, ctx から値を計算する関数)
+MUSIC_FEATURES = {
+    # 簡易的なアコースティック性指標
+    "acousticness": (("rms", "max_amplitude"), lambda ctx: ctx.rms.mean() / ctx.max_amplitude),
+    "danceability": (("onset_envelope",), _danceability),
+    "duration_ms": (("duration",), lambda ctx: int(ctx.duration * 1000)),
+    "energy": (("rms",), lambda ctx: ctx.rms.mean()),
+    "instrumentalness": (("stft_magnitude",), _instrumentalness),
+    "key": (("chroma",), lambda ctx: estimate_key(ctx.y, ctx.sr, chroma=ctx.chroma)),
+    "liveness": (("onset_envelope",), lambda ctx: ctx.onset_envelope.mean()),
+    "loudness": (("rms",), lambda ctx: ctx.rms.mean() * 100),
+    "mode": (("chroma",), _mode),
+    "speechiness": ((), _speechiness),
+    "tempo": (("tempo",), lambda ctx: ctx.tempo),
+    "time_signature": ((), lambda ctx: 4),  # デフォルト
     # スペクトルフラットネスを仮のvalenceに
-    sf = librosa.feature.spectral_flatness(y=y)
-    features["valence"] = np.mean(sf) if sf.size else 0.0
+    "valence": (("spectral_flatness",), lambda ctx: _mean_or_zero(ctx.spectral_flatness)),
+}
 
-    return features
+# 音楽・環境音の両方で計算できる任意の特徴量 (fields で指定したときだけ計算する)
+OPTIONAL_FEATURES = {
+    "embedding": (("mfcc", "chroma_stft"), _embedding),
+}
 
-def extract_environment_features(y, sr):
+
+def environment_feature_specs(bands=DEFAULT_BANDS):
     """
-    環境音向けの特徴量を抽出
+    環境音の特徴量名 -> (依存する中間表現, 計算関数)。帯域比の名前は bands から決まる。
     """
-    duration = librosa.get_duration(y=y, sr=sr)
+    bands = tuple(bands)
 
-    rms_values = librosa.feature.rms(y=y)
-    rms = rms_values.mean()
-    max_y = np.max(np.abs(y)) if np.max(np.abs(y)) != 0 else 1.0
+    def band_ratio(name):
+        return lambda ctx: band_ratios(ctx.band_energy(bands).sum(axis=1), bands)[name]
 
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-    onset_count = np.count_nonzero(librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr))
+    specs = {
+        "duration_ms": (("duration",), lambda ctx: int(ctx.duration * 1000)),
+        "rms": (("rms",), lambda ctx: ctx.rms.mean()),
+        "loudness": (("rms",), lambda ctx: ctx.rms.mean() * 100),
+        "onset_count": (("onset_envelope",), _onset_count),
+        "spectral_flatness": (("spectral_flatness",), lambda ctx: _mean_or_zero(ctx.spectral_flatness)),
+    }
+    for name, _ in bands:
+        specs[f"{name}_band_ratio"] = (("band_energy",), band_ratio(f"{name}_band_ratio"))
+    # 環境音なのでキー等は None
+    for name in ("key", "mode", "tempo", "time_signature", "valence"):
+        specs[name] = ((), lambda ctx: None)
+    return specs
 
-    sf = librosa.feature.spectral_flatness(y=y)
-    spectral_flatness = np.mean(sf) if sf.size else 0.0
 
-    stft = np.abs(librosa.stft(y))
-    freqs = librosa.fft_frequencies(sr=sr, n_fft=2048)
+# annotate_features が必ず付ける項目
+ANNOTATION_FIELDS = ("type", "id", "genre", "title", "description")
 
-    # バンド定義(例) 低域: ~250Hz, 中域:250~2000Hz, 高域:2000Hz~
-    low_band_energy = stft[(freqs <= 250)].sum()
-    mid_band_energy = stft[(freqs > 250) & (freqs <= 2000)].sum()
-    high_band_energy = stft[(freqs > 2000)].sum()
-    total_energy = low_band_energy + mid_band_energy + high_band_energy
-    if total_energy == 0:
-        total_energy = 1e-9
+# build_catalog_item が使う特徴量 (カタログ作成時はこれだけを計算する)
+CATALOG_FIELDS = ("acousticness", "energy", "loudness", "tempo", "duration_ms")
 
-    features = {}
-    features["duration_ms"] = int(duration * 1000)
-    features["rms"] = rms
-    features["loudness"] = rms * 100
-    features["onset_count"] = onset_count
-    features["spectral_flatness"] = spectral_flatness
-    features["low_band_ratio"] = low_band_energy / total_energy
-    features["mid_band_ratio"] = mid_band_energy / total_energy
-    features["high_band_ratio"] = high_band_energy / total_energy
 
-    # 環境音なのでキー等は None
-    features["key"] = None
-    features["mode"] = None
-    features["tempo"] = None
-    features["time_signature"] = None
-    features["valence"] = None
+def _select(specs, fields):
+    if fields is None:
+        return specs
+    return {name: spec for name, spec in {**specs, **OPTIONAL_FEATURES}.items() if name in fields}
 
-    return features
+
+def check_fields(fields, bands=DEFAULT_BANDS):
+    """
+    fields に未知の特徴量名があれば ValueError
+    """
+    known = (
+        set(MUSIC_FEATURES) | set(environment_feature_specs(bands)) | set(OPTIONAL_FEATURES)
+        | set(ANNOTATION_FIELDS)
+    )
+    unknown = [f for f in fields if f not in known]
+    if unknown:
+        raise ValueError(f"unknown feature fields: {', '.join(unknown)}")
+
+
+def required_intermediates(fields=None, audio_type=None, classify=True, bands=DEFAULT_BANDS):
+    """
+    fields (None なら全特徴量) を計算するのに必要な中間表現の集合を依存関係から求める。
+    audio_type ("music" / "environment") が None なら両方の分岐を合わせたもの。
+    """
+    specs = []
+    if audio_type in (None, "music"):
+        specs.extend(_select(MUSIC_FEATURES, fields).values())
+    if audio_type in (None, "environment"):
+        specs.extend(_select(environment_feature_specs(bands), fields).values())
+
+    pending = [dep for deps, _ in specs for dep in deps]
+    if classify:
+        pending.extend(CLASSIFY_DEPENDENCIES)
+    needed = set()
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(INTERMEDIATE_DEPENDENCIES[name])
+    return needed
+
+
+def preclassify_skippable(fields=None, bands=DEFAULT_BANDS):
+    """
+    抜粋で判定できたときに、ファイル全体で計算せずに済む中間表現を判定結果ごとに返す。
+    {"music": set, "environment": set}。どちらも空なら事前判定は抜粋の解析の分だけ遅くなる。
+    """
+    return {
+        audio_type: (
+            required_intermediates(fields, audio_type, classify=True, bands=bands)
+            - required_intermediates(fields, audio_type, classify=False, bands=bands)
+        )
+        for audio_type in ("music", "environment")
+    }
+
+
+def _dependency_order(names):
+    """
+    names とその依存する中間表現を、依存先が先に来る順に並べる
+    """
+    ordered = []
+
+    def visit(name):
+        if name in ordered:
+            return
+        for dep in INTERMEDIATE_DEPENDENCIES[name]:
+            visit(dep)
+        ordered.append(name)
+
+    for name in sorted(names):
+        visit(name)
+    return ordered
+
+
+def _timed_intermediates(ctx, names):
+    """
+    names (と依存する中間表現) のうち未計算のものを依存順に1つずつ計算し、
+    {名前: 計算時間 (秒、依存先の計算を含まない)} を返す
+    """
+    seconds = {}
+    for name in _dependency_order(names):
+        if name in ctx.__dict__:
+            continue
+        start = time.perf_counter()
+        getattr(ctx, name)
+        seconds[name] = time.perf_counter() - start
+    return seconds
+
+
+def extract_music_features(y, sr, tempo, ctx=None, fields=None):
+    """
+    音楽向けの特徴量を抽出
+    ctx (AnalysisContext) が渡された場合は共有スペクトル表現を使う
+    fields を渡すとその特徴量だけを計算する (不要な中間表現は作られない)
+    """
+    if ctx is None:
+        ctx = AnalysisContext(y, sr)
+    if tempo is not None:
+        ctx.tempo = tempo
+    return {name: compute(ctx) for name, (_, compute) in _select(MUSIC_FEATURES, fields).items()}
+
+def extract_environment_features(y, sr, ctx=None, bands=DEFAULT_BANDS, fields=None):
+    """
+    環境音向けの特徴量を抽出
+    ctx (AnalysisContext) が渡された場合は共有スペクトル表現を使う
+    bands で帯域比 ("<帯域名>_band_ratio") の帯域定義を変えられる
+    fields を渡すとその特徴量だけを計算する
+    """
+    if ctx is None:
+        ctx = AnalysisContext(y, sr)
+    specs = _select(environment_feature_specs(bands), fields)
+    return {name: compute(ctx) for name, (_, compute) in specs.items()}
 
 def extract_features(
     audio_path,
     genre=None,
     title=None,
     description=None,
-    environment_flag=None
+    environment_flag=None,
+    profile="full",
+    timeline_resolution=None,
+    fields=None,
+    preclassify=False
 ):
     """
     - audio_path: 音声ファイルのパス
@@ -143,25 +751,126 @@ def extract_features(
     - title: 曲のタイトル
     - description: 曲の説明
     - environment_flag: True なら環境音、False なら音楽、None なら自動判定
+    - profile: ANALYSIS_PROFILES のキー ("full" は全体をネイティブレートで、"fast" は間引いて解析)
+    - timeline_resolution: 秒数を指定すると、その間隔に間引いたフレーム単位の特徴量を
+      features["timeline"] に入れて返す (feature_timelines を参照、full プロファイルのみ)
+    - fields: 計算する特徴量名のリスト (None なら全て)。依存関係 (MUSIC_FEATURES /
+      environment_feature_specs) に従って必要な中間表現だけを計算する。
+      duration_ms と ANNOTATION_FIELDS は常に含まれる。例: fields=CATALOG_FIELDS
+      OPTIONAL_FEATURES ("embedding": 類似検索用の MFCC / クロマ平均) は指定したときだけ計算する
+    - preclassify: True なら音楽 / 環境音を先に抜粋から判定し (preclassify_audio_type)、
+      曖昧な場合だけ全体のテンポとオンセット強度で判定する。どちらで決めたかを
+      features["classified_by"] ("excerpt" / "full" / "flag") に、判定にかかった時間を
+      features["classify_seconds"] (_classify_seconds を参照) に入れる
     """
-    y, sr = librosa.load(audio_path, sr=None)
+    if timeline_resolution and ANALYSIS_PROFILES[profile]["window_seconds"]:
+        raise ValueError("timelines need the whole file; use profile='full'")
+    if fields is not None:
+        check_fields(fields)
+    if preclassify:
+        start = time.perf_counter()
+        environment_flag, classified_by = _preclassified_flag(audio_path, environment_flag)
+        excerpt_seconds = time.perf_counter() - start
+
+    y, sr, file_duration = load_audio(audio_path, profile)
+
+    # STFT・オンセット包絡などはこのコンテキストで一度だけ計算して共有する
+    ctx = AnalysisContext(y, sr)
+    features = features_from_context(
+        ctx, file_duration, genre, title, description, environment_flag, timeline_resolution, fields
+    )
+    if preclassify:
+        features["classified_by"] = classified_by
+        # 判定に使う中間表現でも特徴量の計算で使ったものは、判定を省いても時間は減っていない
+        classify_only = required_intermediates(fields=(), classify=True)
+        features["classify_seconds"] = _classify_seconds(
+            excerpt_seconds, classified_by, ctx.classify_seconds,
+            skipped=[name for name in classify_only if name not in ctx.__dict__],
+        )
+    return features
 
-    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-    mean_onset_strength = librosa.onset.onset_strength(y=y, sr=sr).mean()
+
+def features_from_context(
+    ctx,
+    file_duration,
+    genre=None,
+    title=None,
+    description=None,
+    environment_flag=None,
+    timeline_resolution=None,
+    fields=None
+):
+    """
+    読み込み済みの AnalysisContext から extract_features と同じ特徴量を作る。
+    ctx.tempo に推定済みのテンポを代入しておけば、それを使う。
+    """
+    y, sr = ctx.y, ctx.sr
 
     if environment_flag is True:
         audio_type = "environment"
     elif environment_flag is False:
         audio_type = "music"
     else:
-        audio_type = classify_audio_type(y, sr, tempo, mean_onset_strength)
+        ctx.classify_seconds = _timed_intermediates(ctx, CLASSIFY_DEPENDENCIES)
+        audio_type = classify_audio_type(y, sr, ctx.tempo, ctx.onset_envelope.mean())
+    if ctx.classify_seconds is None and "tempo" in required_intermediates(fields, audio_type, classify=False):
+        # テンポは特徴量でも使うので先に求め、判定に使う中間表現の計算時間の目安として測っておく
+        ctx.classify_seconds = _timed_intermediates(ctx, ("tempo",))
 
     if audio_type == "music":
-        base_features = extract_music_features(y, sr, tempo)
-        base_features["type"] = "music_features"
+        base_features = extract_music_features(y, sr, None, ctx=ctx, fields=fields)
     else:
-        base_features = extract_environment_features(y, sr)
-        base_features["type"] = "environment_features"
+        base_features = extract_environment_features(y, sr, ctx=ctx, fields=fields)
+
+    # 窓だけを解析した場合も長さはファイル全体のものを返す
+    base_features["duration_ms"] = int(file_duration * 1000)
+
+    if timeline_resolution:
+        with stage("timeline"):
+            base_features["timeline"] = feature_timelines(ctx, timeline_resolution)
+
+    return annotate_features(base_features, audio_type, genre, title, description)
+
+
+TIMELINE_FEATURES = ("rms", "onset_strength", "spectral_flatness") + tuple(
+    f"{name}_band_ratio" for name, _ in DEFAULT_BANDS
+)
+
+
+def feature_timelines(ctx, resolution_s=0.5):
+    """
+    フレーム単位の特徴量を resolution_s 秒ごとの平均に間引いて返す。
+    {"resolution_s": 実際の間隔, "duration_ms", "names": TIMELINE_FEATURES,
+     "values": (特徴量, ステップ) float16}
+    帯域エネルギーはフレームごとの比率にして float16 に収まる範囲にする。
+    """
+    bands = ctx.band_energy()
+    band_total = bands.sum(axis=0)
+    band_total[band_total == 0] = 1e-9
+    series = [ctx.rms[0], ctx.onset_envelope, ctx.spectral_flatness[0]] + list(bands / band_total)
+    n_frames = min(len(x) for x in series)
+    frames = np.vstack([x[:n_frames] for x in series])
+
+    frames_per_step = max(1, int(round(resolution_s * ctx.sr / ctx.hop_length)))
+    n_steps = -(-n_frames // frames_per_step)
+    # 最後の端数ステップは有効フレームだけで平均する
+    padded = np.full((frames.shape[0], n_steps * frames_per_step), np.nan, dtype=np.float64)
+    padded[:, :n_frames] = frames
+    values = np.nanmean(padded.reshape(frames.shape[0], n_steps, frames_per_step), axis=2)
+
+    return {
+        "resolution_s": frames_per_step * ctx.hop_length / ctx.sr,
+        "duration_ms": int(ctx.duration * 1000),
+        "names": TIMELINE_FEATURES,
+        "values": values.astype(np.float16),
+    }
+
+
+def annotate_features(base_features, audio_type, genre=None, title=None, description=None):
+    """
+    特徴量に type / id / genre / title / description を付与する
+    """
+    base_features["type"] = "music_features" if audio_type == "music" else "environment_features"
 
     uid = str(uuid.uuid4())
     base_features["id"] = uid
@@ -177,65 +886,914 @@ def extract_features(
     return base_features
 
 
-def main():
-    input_directory = "./music"
-    output_json_path = "./output.json"
+# ==============================================
+# ストリーミング解析（ファイル全体を読み込まない）
+# ==============================================
+# メルスペクトログラムの dB 化で残す最大値からの幅 (librosa.power_to_db の既定の top_db)
+TOP_DB = 80.0
 
-    files = sorted([f for f in os.listdir(input_directory) if f.lower().endswith(".wav")])
 
-    result_list = []
+class StreamingFeatureAccumulator:
+    """
+    audio_io.stream (librosa.stream と同じブロック) で読んだブロックごとに特徴量の和を積み上げる。
+    保持するのはフレーム数に比例するオンセット包絡 (float32、音声サンプルの 1/hop_length)
+    だけで、波形やスペクトログラムはブロック単位で捨てる。
+    ピークメモリ (tracemalloc) は 48kHz の 1分・10分のファイルともに約 40 MB で、
+    大半は最後のテンポグラム (mean_tempogram の max_elements 単位) とブロックの STFT。
 
-    for idx, filename in enumerate(files, start=1):
-        audio_path = os.path.join(input_directory, filename)
+    extract_features との差:
+    - フレーム位置・パディングを center=True に合わせているため、rms / energy / loudness /
+      spectral_flatness / バンド比 / オンセット包絡 / tempo / onset_count / liveness は
+      合成フィクスチャ (持続音・クリック・ノイズ・雨音) で相対誤差 2e-3 以内で一致する
+    - dB 化の下限 (最大値 - TOP_DB) は、それまでに読んだブロック全体の最大値から決める。
+      ファイル全体の最大値より前 (フェードインなど後半ほど大きい素材の前半) では下限が低くなり、
+      オンセット系 (liveness / onset_count / tempo / danceability) が大きくずれうる
+    - key / mode は CQT ではなく STFT クロマから推定するので、和音の曖昧な素材では変わりうる
+    """
+
+    def __init__(self, sr, total_samples=None, n_fft=2048, hop_length=512, bands=DEFAULT_BANDS, fields=None):
+        self.sr = sr
+        self.total_samples = total_samples
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.bands = tuple(bands)
+        self.fields = None if fields is None else set(fields)
+        self.mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft)
+
+        # 要求された特徴量に必要な集計だけをブロックごとに行う
+        self._want_zcr = self.wants("speechiness")
+        self._want_flatness = self.wants("valence", "spectral_flatness")
+        self._want_contrast = self.wants("instrumentalness")
+        self._want_bands = self.wants(*(f"{name}_band_ratio" for name, _ in self.bands))
+        self._want_tonnetz = self.wants("mode")
+        self._want_chroma = self._want_tonnetz or self.wants("key")
+        self._want_embedding = self.fields is not None and "embedding" in self.fields
+
+        self.n_frames = 0
+        self.peak = 0.0
+        self.rms_sum = 0.0
+        self.zcr_sum = 0.0
+        self.flatness_sum = 0.0
+        self.contrast_sum = 0.0
+        self.tonnetz_sum = 0.0
+        self.chroma_sum = np.zeros(12)
+        self.band_sums = np.zeros(len(self.bands))
+        self.mfcc_sum = np.zeros(EMBEDDING_MFCC)
+        self.embedding_chroma_sum = np.zeros(12)
+
+        self._block_start = 0
+        self._finished = False
+        self._max_mel_db = -np.inf
+        self._prev_mel_db = None
+        self._onset_blocks = []
+        self._beat_onset_blocks = []
+
+    def update(self, block):
+        """
+        block: audio_io.stream が返す1ブロック分の波形 (フレームが連続するよう重なりを含む)
+        """
+        if self._finished:
+            return
+        # extract_features (center=True) とフレーム位置を揃えるため、
+        # 信号の前後に n_fft // 2 サンプルの無音があるものとして扱う
+        pad = self.n_fft // 2
+        if self._block_start == 0:
+            block = np.concatenate([np.zeros(pad, dtype=block.dtype), block])
+        # 最後のブロックは fill_value で埋められているので実データ分に切り詰める
+        if self.total_samples is not None:
+            remaining = self.total_samples + pad - self._block_start
+            if block.size >= remaining:
+                block = np.concatenate([block[:max(remaining, 0)], np.zeros(pad, dtype=block.dtype)])
+                self._finished = True
+        if block.size < self.n_fft:
+            block = np.pad(block, (0, self.n_fft - block.size))
+        frames = 1 + (block.size - self.n_fft) // self.hop_length
+        self.n_frames += frames
+        # 次のブロックは frames * hop_length サンプル先から始まる (重なり部分は数えない)
+        self._block_start += frames * self.hop_length
+        self.peak = max(self.peak, float(np.max(np.abs(block))))
+
+        self.rms_sum += librosa.feature.rms(
+            y=block, frame_length=self.n_fft, hop_length=self.hop_length, center=False
+        ).sum()
+        if self._want_zcr:
+            self.zcr_sum += librosa.feature.zero_crossing_rate(
+                block, frame_length=self.n_fft, hop_length=self.hop_length, center=False
+            ).sum()
+
+        S = np.abs(librosa.stft(block, n_fft=self.n_fft, hop_length=self.hop_length, center=False))
+        power = S ** 2
+
+        if self._want_flatness:
+            self.flatness_sum += librosa.feature.spectral_flatness(S=S).sum()
+        if self._want_contrast:
+            self.contrast_sum += librosa.feature.spectral_contrast(S=S, sr=self.sr).mean(axis=0).sum()
 
-        # environment_flag を None にし、自動判定させる例
-        features = extract_features(
-            audio_path,
-            genre=None,
-            title=None,
-            description=None,
-            environment_flag=None
+        if self._want_bands:
+            self.band_sums += band_energy_series(S, self.sr, self.n_fft, self.bands).sum(axis=1)
+
+        if self._want_chroma:
+            chroma = librosa.feature.chroma_stft(S=power, sr=self.sr)
+            self.chroma_sum += chroma.sum(axis=1)
+            if self._want_tonnetz:
+                self.tonnetz_sum += librosa.feature.tonnetz(chroma=chroma, sr=self.sr).mean(axis=0).sum()
+
+        # dB 化の下限 (最大値 - 80 dB) はブロックごとの最大値ではなく、ここまでの全ブロックの
+        # 最大値から決める (ブロックごとに基準が変わるとオンセット包絡が大きくずれる)
+        mel_db = librosa.power_to_db(self.mel_basis @ power, top_db=None)
+        self._max_mel_db = max(self._max_mel_db, float(mel_db.max()))
+        floor = self._max_mel_db - TOP_DB
+        np.maximum(mel_db, floor, out=mel_db)
+        # オンセット包絡：前ブロック最後のメルフレームとの差分をつなげる
+        if self._prev_mel_db is not None:
+            mel_db_lag = np.concatenate([np.maximum(self._prev_mel_db, floor), mel_db], axis=1)
+        else:
+            mel_db_lag = np.concatenate([mel_db[:, :1], mel_db], axis=1)
+        if self._want_embedding:
+            self.mfcc_sum += librosa.feature.mfcc(S=mel_db, sr=self.sr, n_mfcc=EMBEDDING_MFCC).sum(axis=1)
+            self.embedding_chroma_sum += librosa.feature.chroma_stft(
+                S=power, sr=self.sr, n_fft=self.n_fft, tuning=0.0
+            ).sum(axis=1)
+        flux = np.maximum(0.0, np.diff(mel_db_lag, axis=1))
+        self._onset_blocks.append(flux.mean(axis=0).astype(np.float32))
+        self._beat_onset_blocks.append(np.median(flux, axis=0).astype(np.float32))
+        self._prev_mel_db = mel_db[:, -1:]
+
+    def wants(self, *names):
+        return self.fields is None or any(name in self.fields for name in names)
+
+    def _select(self, features):
+        # 値は呼び出し可能オブジェクトで受け取り、要求されたものだけ計算する
+        if self._want_embedding:
+            features["embedding"] = self._embedding
+        return {name: compute() for name, compute in features.items() if self.wants(name)}
+
+    def _embedding(self):
+        n = max(self.n_frames, 1)
+        return {"mfcc": (self.mfcc_sum / n).tolist(), "chroma": (self.embedding_chroma_sum / n).tolist()}
+
+    @property
+    def duration(self):
+        if self.total_samples is not None:
+            return self.total_samples / self.sr
+        return (self._block_start + self.n_fft - self.hop_length) / self.sr
+
+    def _envelope(self, blocks):
+        # onset_strength(center=True) と同じく先頭を lag + n_fft // (2 * hop) フレームずらす
+        shift = self.n_fft // (2 * self.hop_length)
+        env = np.concatenate([np.zeros(shift + 1, np.float32)] + blocks)
+        return np.delete(env, shift + 1)[:max(self.n_frames, 1)]
+
+    @property
+    def onset_envelope(self):
+        return self._envelope(self._onset_blocks)
+
+    @property
+    def beat_onset_envelope(self):
+        return self._envelope(self._beat_onset_blocks)
+
+    def tempo(self):
+        return estimate_tempo(self.beat_onset_envelope, self.sr, hop_length=self.hop_length)
+
+    def _danceability(self):
+        tempogram = mean_tempogram(self.onset_envelope, self.sr, hop_length=self.hop_length)
+        return np.mean(tempogram) if tempogram.size else 0.0
+
+    def music_features(self, tempo):
+        n = max(self.n_frames, 1)
+        rms = self.rms_sum / n
+        peak = self.peak if self.peak != 0 else 1.0
+        return self._select({
+            "acousticness": lambda: rms / peak,
+            "danceability": self._danceability,
+            "duration_ms": lambda: int(self.duration * 1000),
+            "energy": lambda: rms,
+            "instrumentalness": lambda: 1.0 if self.contrast_sum / n > 20 else 0.0,
+            "key": lambda: KEY_NAMES[int(np.argmax(self.chroma_sum))],
+            "liveness": lambda: self.onset_envelope.mean(),
+            "loudness": lambda: rms * 100,
+            "mode": lambda: 1 if self.tonnetz_sum / n > 0 else 0,
+            "speechiness": lambda: self.zcr_sum / n,
+            "tempo": lambda: tempo,
+            "time_signature": lambda: 4,
+            "valence": lambda: self.flatness_sum / n,
+        })
+
+    def environment_features(self):
+        n = max(self.n_frames, 1)
+        rms = self.rms_sum / n
+        features = {
+            "duration_ms": lambda: int(self.duration * 1000),
+            "rms": lambda: rms,
+            "loudness": lambda: rms * 100,
+            "onset_count": lambda: np.count_nonzero(
+                librosa.onset.onset_detect(
+                    onset_envelope=self.onset_envelope, sr=self.sr, hop_length=self.hop_length
+                )
+            ),
+            "spectral_flatness": lambda: self.flatness_sum / n,
+        }
+        ratios = band_ratios(self.band_sums, self.bands)
+        features.update({name: (lambda value=value: value) for name, value in ratios.items()})
+        features.update({
+            name: lambda: None for name in ("key", "mode", "tempo", "time_signature", "valence")
+        })
+        return self._select(features)
+
+
+def extract_features_streaming(
+    audio_path,
+    genre=None,
+    title=None,
+    description=None,
+    environment_flag=None,
+    block_length=256,
+    n_fft=2048,
+    hop_length=512,
+    fields=None,
+    preclassify=False
+):
+    """
+    extract_features と同じ形式の特徴量を、ファイルをブロック単位で読みながら計算する。
+    長時間のフィールド録音向け。block_length はブロックあたりのフレーム数。
+    fields / preclassify は extract_features と同じ (fields は不要なブロック単位の集計を省く)。
+    誤差の目安は StreamingFeatureAccumulator を参照。
+    """
+    if fields is not None:
+        check_fields(fields)
+        fields = set(fields) | {"duration_ms"}
+    if preclassify:
+        start = time.perf_counter()
+        environment_flag, classified_by = _preclassified_flag(audio_path, environment_flag)
+        excerpt_seconds = time.perf_counter() - start
+    sr = audio_io.get_samplerate(audio_path)
+    total_samples = int(round(audio_io.get_duration(audio_path) * sr))
+    acc = StreamingFeatureAccumulator(sr, total_samples, n_fft=n_fft, hop_length=hop_length, fields=fields)
+    stream = audio_io.stream(
+        audio_path,
+        block_length=block_length,
+        frame_length=n_fft,
+        hop_length=hop_length,
+        mono=True,
+        fill_value=0,
+    )
+    for block in stream:
+        with stage("stream_block"):
+            acc.update(block)
+
+    # 環境音と決まっていればテンポは使わない
+    tempo = None
+    tempo_seconds = None
+    if environment_flag is not True:
+        start = time.perf_counter()
+        with stage("tempo"):
+            tempo = acc.tempo()
+        tempo_seconds = time.perf_counter() - start
+    if environment_flag is True:
+        audio_type = "environment"
+    elif environment_flag is False:
+        audio_type = "music"
+    else:
+        audio_type = classify_audio_type(None, sr, tempo, acc.onset_envelope.mean())
+
+    if audio_type == "music":
+        base_features = acc.music_features(tempo)
+    else:
+        base_features = acc.environment_features()
+
+    features = annotate_features(base_features, audio_type, genre, title, description)
+    if preclassify:
+        features["classified_by"] = classified_by
+        # オンセット包絡はブロックごとに必ず集計するので、判定で省けるのはテンポ推定だけ
+        features["classify_seconds"] = _classify_seconds(
+            excerpt_seconds, classified_by,
+            None if tempo_seconds is None else {"tempo": tempo_seconds},
+            skipped=["tempo"] if tempo is None else [],
         )
+    return features
+
+
+def build_catalog_item(track_id, filename, features):
+    """
+    extract_features の結果からカタログ (output.json) の1要素を作る
+    """
+    duration_ms = features["duration_ms"]
+
+    if features["type"] == "music_features":
+        acousticness = features.get("acousticness", 0.0)
+        energy = features.get("energy", 0.0)
+    else:
+        acousticness = 0.0
+        energy = features.get("loudness", 0.0)  # 例
 
-        track_id = f"track-{idx:03d}"
-        duration_ms = features["duration_ms"]
+    tempo = features["tempo"] if features["tempo"] is not None else 0
+    lofi_flag = True if 40 <= tempo <= 80 else False
 
-        if features["type"] == "music_features":
-            acousticness = features.get("acousticness", 0.0)
-            energy = features.get("energy", 0.0)
+    instrumentation = "unknown"
+    mood = "neutral"
+
+    return {
+        "id": track_id,
+        "title": features["title"],
+        "description": features["description"],
+        "duration_ms": duration_ms,
+        "genre": features["genre"],
+        "instrumentation": instrumentation,
+        "mood": mood,
+        "acousticness": acousticness,
+        "energy": energy,
+        "lofi": lofi_flag,
+        "filename": filename
+    }
+
+
+# ==============================================
+# バッチ解析（複数プロセス）
+# ==============================================
+def _instrumented(instrument):
+    """
+    instrument が "time" / "memory" なら段階別計測を有効にする (それ以外は何もしない)
+    """
+    if not instrument:
+        return nullcontext()
+    return profile_stages(track_memory=instrument == "memory")
+
+
+def analyze_file(index, audio_path, streaming=False, instrument=None, **extract_options):
+    """
+    ワーカープロセスで1ファイルを解析する。
+    例外はここで捕まえて結果に詰めるため、壊れたファイルがあっても全体は止まらない。
+    streaming=True ならファイル全体を読み込まない extract_features_streaming を使う。
+    instrument が "time" / "memory" なら段階別の計測結果を result["stages"] に入れる。
+    extract_options は extract_features (profile など) にそのまま渡す。
+    """
+    start = time.perf_counter()
+    result = {"index": index, "path": audio_path, "features": None, "error": None}
+    extract = extract_features_streaming if streaming else extract_features
+    with _instrumented(instrument) as profiler:
+        try:
+            # environment_flag を None にし、自動判定させる例
+            result["features"] = extract(
+                audio_path,
+                genre=None,
+                title=None,
+                description=None,
+                environment_flag=None,
+                **extract_options
+            )
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+    if profiler is not None:
+        result["stages"] = profiler.records
+    result["elapsed"] = time.perf_counter() - start
+    if result["features"] is not None:
+        result["classified_by"] = result["features"].pop("classified_by", None)
+        result["classify_seconds"] = result["features"].pop("classify_seconds", None)
+        result["audio_seconds"] = result["features"]["duration_ms"] / 1000.0
+    else:
+        result["audio_seconds"] = 0.0
+    return result
+
+
+# バッチ解析でテンポ推定をまとめて行う短いクリップの長さ (秒)
+SHORT_CLIP_SECONDS = 30.0
+
+
+def _error_result(index, audio_path, error, elapsed=0.0):
+    return {
+        "index": index, "path": audio_path, "features": None,
+        "error": f"{type(error).__name__}: {error}", "elapsed": elapsed, "audio_seconds": 0.0,
+    }
+
+
+def analyze_group(items, streaming=False, instrument=None, **extract_options):
+    """
+    ワーカープロセスで複数ファイル [(index, path), ...] を解析し、結果のリストを返す。
+    2ファイル以上なら、全ファイルのオンセット包絡を batch_estimate_tempo にまとめて渡し、
+    テンポ推定を1回の NumPy 計算で済ませる (短いクリップ向け)。
+    まとめて行った部分の計測値はファイル数で按分して各結果の "stages" に加える。
+    streaming / preclassify のときは (事前判定の時間をファイルごとに測るため) 1ファイルずつ解析する。
+    """
+    if streaming or extract_options.get("preclassify") or len(items) == 1:
+        return [
+            analyze_file(index, path, streaming, instrument, **extract_options)
+            for index, path in items
+        ]
+
+    profile = extract_options.get("profile", "full")
+    timeline_resolution = extract_options.get("timeline_resolution")
+    fields = extract_options.get("fields")
+    results = []
+    loaded = []
+    for index, path in items:
+        start = time.perf_counter()
+        with _instrumented(instrument) as profiler:
+            try:
+                y, sr, file_duration = load_audio(path, profile)
+                ctx = AnalysisContext(y, sr)
+                # テンポ推定に使う包絡はファイルごとの処理として先に計算しておく
+                ctx.beat_onset_envelope
+            except Exception as e:
+                results.append(_error_result(index, path, e, time.perf_counter() - start))
+                continue
+        loaded.append({
+            "index": index, "path": path, "ctx": ctx, "file_duration": file_duration,
+            "elapsed": time.perf_counter() - start,
+            "stages": profiler.records if profiler is not None else None,
+        })
+
+    # sr / hop_length ごとにテンポをまとめて推定する
+    start = time.perf_counter()
+    by_rate = {}
+    for entry in loaded:
+        ctx = entry["ctx"]
+        by_rate.setdefault((ctx.sr, ctx.hop_length), []).append(ctx)
+    with _instrumented(instrument) as shared_profiler:
+        for (sr, hop_length), contexts in by_rate.items():
+            with stage("tempo_batch"):
+                tempos = batch_estimate_tempo(
+                    [ctx.beat_onset_envelope for ctx in contexts], sr, hop_length=hop_length
+                )
+            for ctx, tempo in zip(contexts, tempos):
+                ctx.tempo = float(tempo)
+    share = 1.0 / max(len(loaded), 1)
+    shared_elapsed = (time.perf_counter() - start) * share
+
+    for entry in loaded:
+        index, path = entry["index"], entry["path"]
+        start = time.perf_counter()
+        with _instrumented(instrument) as profiler:
+            try:
+                features = features_from_context(
+                    entry["ctx"], entry["file_duration"],
+                    timeline_resolution=timeline_resolution, fields=fields
+                )
+            except Exception as e:
+                results.append(_error_result(index, path, e, time.perf_counter() - start))
+                continue
+        result = {
+            "index": index, "path": path, "features": features, "error": None,
+            "elapsed": entry["elapsed"] + shared_elapsed + time.perf_counter() - start,
+            "audio_seconds": features["duration_ms"] / 1000.0,
+        }
+        if profiler is not None:
+            result["stages"] = merge_records(
+                merge_records(entry["stages"], scale_records(shared_profiler.records, share)),
+                profiler.records
+            )
+        results.append(result)
+    return sorted(results, key=lambda r: r["index"])
+
+
+def plan_tasks(audio_paths, tempo_batch_size=1):
+    """
+    ファイルをワーカーへ渡す単位に分ける。SHORT_CLIP_SECONDS 以下のファイルは
+    tempo_batch_size 個ずつまとめ、それ以外は1ファイルずつにする。
+    """
+    tasks = []
+    short = []
+    for index, path in enumerate(audio_paths):
+        is_short = False
+        if tempo_batch_size > 1:
+            try:
+                is_short = audio_io.get_duration(path) <= SHORT_CLIP_SECONDS
+            except Exception:
+                # 読めないファイルは単独で解析させて、そこでエラーとして記録する
+                is_short = False
+        if is_short:
+            short.append((index, path))
+            if len(short) == tempo_batch_size:
+                tasks.append(short)
+                short = []
         else:
-            acousticness = 0.0
-            energy = features.get("loudness", 0.0)  # 例
-
-        tempo = features["tempo"] if features["tempo"] is not None else 0
-        lofi_flag = True if 40 <= tempo <= 80 else False
-
-        instrumentation = "unknown"
-        mood = "neutral"
-
-        item_dict = {
-            "id": track_id,
-            "title": features["title"],
-            "description": features["description"],
-            "duration_ms": duration_ms,
-            "genre": features["genre"],
-            "instrumentation": instrumentation,
-            "mood": mood,
-            "acousticness": acousticness,
-            "energy": energy,
-            "lofi": lofi_flag,
-            "filename": filename
+            tasks.append([(index, path)])
+    if short:
+        tasks.append(short)
+    return tasks
+
+
+class BatchStats:
+    """
+    バッチ解析のスループット集計
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.failures = 0
+        self.audio_seconds = 0.0
+        self.preclassified = 0
+        self.fallbacks = 0
+        # 事前判定の時間: 抜粋の解析・判定に使う中間表現ごとのファイル全体での計算時間
+        # (とそれを計算したファイルの音声の長さ)・計算を省けた音声の長さ
+        self.excerpt_seconds = 0.0
+        self.full_classify_seconds = {}
+        self.full_classified_audio_seconds = {}
+        self.skipped_audio_seconds = {}
+
+    def add(self, result):
+        self.files += 1
+        if result["error"] is not None:
+            self.failures += 1
+        self.audio_seconds += result["audio_seconds"]
+        classified_by = result.get("classified_by")
+        if classified_by == "excerpt":
+            self.preclassified += 1
+        elif classified_by == "full":
+            self.fallbacks += 1
+        timing = result.get("classify_seconds")
+        if timing:
+            self.excerpt_seconds += timing["excerpt"]
+            for name, seconds in (timing["full"] or {}).items():
+                self.full_classify_seconds[name] = self.full_classify_seconds.get(name, 0.0) + seconds
+                self.full_classified_audio_seconds[name] = (
+                    self.full_classified_audio_seconds.get(name, 0.0) + result["audio_seconds"]
+                )
+            for name in timing["skipped"]:
+                self.skipped_audio_seconds[name] = self.skipped_audio_seconds.get(name, 0.0) + result["audio_seconds"]
+
+    def classify_saved_seconds(self):
+        """
+        事前判定で短縮できた時間の見積もり (秒)。判定に使う中間表現をファイル全体で計算した
+        ファイルが1つもなければ None。
+        中間表現ごとに、ファイル全体での計算の音声1秒あたりの時間 (このバッチのフォールバックした
+        ファイルと、テンポを求めた音楽のファイルで計測) に計算を省けた音声の長さを掛けて足し、
+        抜粋の解析にかかった時間を引く。このバッチで一度も計算しなかった中間表現は省けた分に
+        数えないので、短縮時間を少なめに見積もる。
+        """
+        if not self.full_classify_seconds:
+            return None
+        saved = 0.0
+        for name, audio_seconds in self.skipped_audio_seconds.items():
+            measured = self.full_classified_audio_seconds.get(name, 0.0)
+            if measured > 0:
+                saved += audio_seconds * self.full_classify_seconds[name] / measured
+        return saved - self.excerpt_seconds
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return {
+            "files": self.files,
+            "failures": self.failures,
+            "elapsed_s": elapsed,
+            "audio_seconds": self.audio_seconds,
+            "files_per_s": self.files / elapsed,
+            "audio_seconds_per_s": self.audio_seconds / elapsed,
+            "preclassified": self.preclassified,
+            "fallbacks": self.fallbacks,
+            "excerpt_seconds": self.excerpt_seconds,
+            "full_classify_seconds": sum(self.full_classify_seconds.values()),
+            # テンポ推定を省けた音声の長さ (抜粋で環境音と判定できたファイル)
+            "skipped_audio_seconds": self.skipped_audio_seconds.get("tempo", 0.0),
+            "classify_saved_seconds": self.classify_saved_seconds(),
         }
 
-        result_list.append(item_dict)
 
-    # =============================
-    # 修正：cls=NumpyEncoderを指定
-    # =============================
-    with open(output_json_path, "w", encoding="utf-8") as f:
-        json.dump(result_list, f, ensure_ascii=False, indent=2, cls=NumpyEncoder)
+def batch_extract_features(
+    audio_paths,
+    workers=None,
+    max_in_flight=None,
+    ordered=True,
+    streaming=False,
+    tempo_batch_size=1,
+    instrument=None,
+    **extract_options
+):
+    """
+    複数ファイルをプロセスプールで並列解析し、結果を1件ずつ yield する。
+    - workers: ワーカープロセス数 (None なら CPU コア数、1 ならプールを使わず逐次実行)
+    - max_in_flight: 同時に投入するタスク数の上限。audio_io.load はファイル全体を
+      メモリに載せるため、ここで同時に展開される波形の数を抑える (既定は workers * 2)
+    - ordered: True なら入力順、False なら完了順に返す
+    - streaming: True ならブロック単位で読み込む (長時間録音向け)
+    - tempo_batch_size: 2 以上なら短いクリップをこの数ずつ1タスクにまとめ、
+      テンポ推定を batch_estimate_tempo で一括計算する (既定の 1 ではファイルごとに推定する)
+    - instrument: "time" なら段階別の時間、"memory" なら加えてピーク割り当て量を
+      各結果の "stages" に入れる (StageSummary で集計する)
+    - extract_options: extract_features に渡す追加引数 (profile, timeline_resolution, fields,
+      preclassify など)
+    各結果は {"index", "path", "features", "error", "elapsed", "audio_seconds"} の辞書
+    (preclassify 時は判定方法 "classified_by" と判定の所要時間 "classify_seconds" も入る)。
+    """
+    audio_paths = list(audio_paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    tasks = plan_tasks(audio_paths, 1 if streaming else tempo_batch_size)
+
+    # 事前判定の時間にプロセスの初回の準備が乗らないよう、先に済ませておく
+    initializer = warm_up_preclassify if extract_options.get("preclassify") else None
+
+    if workers <= 1:
+        if initializer is not None:
+            initializer()
+        for task in tasks:
+            yield from analyze_group(task, streaming, instrument, **extract_options)
+        return
+
+    if max_in_flight is None:
+        max_in_flight = workers * 2
+    max_in_flight = max(max_in_flight, 1)
+
+    pending_tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        in_flight = {}
+
+        def submit_next():
+            try:
+                task = next(pending_tasks)
+            except StopIteration:
+                return False
+            in_flight[executor.submit(analyze_group, task, streaming, instrument, **extract_options)] = task
+            return True
+
+        for _ in range(max_in_flight):
+            if not submit_next():
+                break
+
+        # 入力順で返す場合、先に終わった結果はここで待たせる
+        buffered = {}
+        next_index = 0
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = in_flight.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # ワーカープロセス自体が落ちた場合
+                    results = [_error_result(index, path, e) for index, path in task]
+                submit_next()
+                if not ordered:
+                    yield from results
+                    continue
+                for result in results:
+                    buffered[result["index"]] = result
+                while next_index in buffered:
+                    yield buffered.pop(next_index)
+                    next_index += 1
+
+
+# ==============================================
+# 特徴量キャッシュのエントリ
+# ==============================================
+# FeatureStore の1エントリ (内容ハッシュ + ANALYSIS_VERSION) は解析方式ごとに
+#   {"<方式>": {"features": {...}, "classified_by": "excerpt" / "full" / "flag"}, ...}
+# を持つ。方式は値が変わる読み込み方 ("full" / "fast" のプロファイル、"stream")。
+# 計算した特徴量の範囲 (カタログ項目だけ・全特徴量・埋め込み) や事前判定の有無はキーにせず、
+# 同じ方式の特徴量に足していくので、オプションを切り替えても解析し直すのは足りない分だけになる。
+# 事前判定 (抜粋) で決めた音楽 / 環境音の判定もそのまま使う (全体で判定し直すなら --no-cache)。
+
+def cached_features(cached, fields=None):
+    """
+    エントリの1方式分 cached が fields (None なら全特徴量) を満たしていれば特徴量を返す (無ければ None)
+    """
+    if not cached:
+        return None
+    features = cached["features"]
+    specs = MUSIC_FEATURES if features.get("type") == "music_features" else environment_feature_specs()
+    wanted = set(specs) if fields is None else set(fields) & (set(specs) | set(OPTIONAL_FEATURES))
+    return features if wanted <= set(features) else None
+
+
+def merge_cached_features(cached, features, classified_by):
+    """
+    エントリの1方式分 cached に新しい解析結果を足したものを返す。
+    音楽 / 環境音の判定が前回と違えば置き換える。
+    """
+    if not cached or cached["features"].get("type") != features.get("type"):
+        return {"features": features, "classified_by": classified_by}
+    # 全体で判定した記録を、同じ判定になった抜粋での判定で上書きしない
+    if classified_by == "excerpt":
+        classified_by = cached.get("classified_by", classified_by)
+    return {"features": dict(cached["features"], **features), "classified_by": classified_by}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WAVファイルを解析してカタログ (output.json) を作成する")
+    parser.add_argument("--input-dir", default="./music")
+    parser.add_argument("--output", default="./output.json")
+    parser.add_argument(
+        "--format", default="json", choices=["json", "columnar", "both"],
+        help="カタログの出力形式 (columnar は列ごとの .npy をメモリマップで読める形式)"
+    )
+    parser.add_argument("--columnar-dir", default="./catalog", help="列指向カタログの出力先")
+    parser.add_argument("--workers", type=int, default=1, help="ワーカープロセス数 (0 で CPU コア数)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="同時に解析中にするファイル数の上限")
+    parser.add_argument("--unordered", action="store_true", help="完了順に結果を受け取る")
+    parser.add_argument(
+        "--tempo-batch-size", type=int, default=1,
+        help=f"{SHORT_CLIP_SECONDS:.0f} 秒以下のクリップをこの数ずつまとめてテンポ推定する (既定の 1 ではまとめない)"
+    )
+    parser.add_argument("--streaming", action="store_true", help="ファイル全体を読み込まずブロック単位で解析する")
+    parser.add_argument("--profile", default="full", choices=sorted(ANALYSIS_PROFILES), help="解析プロファイル")
+    parser.add_argument("--timelines", action="store_true", help="フレーム単位の特徴量タイムラインも保存する")
+    parser.add_argument("--timeline-dir", default="./timelines", help="タイムラインの保存先")
+    parser.add_argument("--timeline-resolution", type=float, default=0.5, help="タイムラインの間隔 (秒)")
+    parser.add_argument(
+        "--instrument", choices=["time", "memory"], default=None,
+        help="段階別の計測 (time: 経過/CPU時間, memory: 加えて tracemalloc によるピーク割り当て量)"
+    )
+    parser.add_argument("--instrument-json", default=None, help="段階別計測の結果を書き出す JSON ファイル")
+    parser.add_argument(
+        "--all-fields", action="store_true",
+        help="カタログに書く項目 (CATALOG_FIELDS) だけでなく全特徴量を計算してキャッシュに保存する"
+    )
+    parser.add_argument(
+        "--similarity-index", action="store_true",
+        help="MFCC / クロマの埋め込みも計算し、類似検索インデックスを作る"
+    )
+    parser.add_argument("--similarity-dir", default="./similarity", help="類似検索インデックスの保存先")
+    parser.add_argument(
+        "--similarity-method", default="auto", choices=["auto", "exact", "ivf"],
+        help="exact は全件比較、ivf は近似 (auto はトラック数で選ぶ)"
+    )
+    parser.add_argument(
+        "--preclassify", action="store_true",
+        help="音楽 / 環境音を短い抜粋で先に判定し、曖昧なファイルだけ全体で判定する"
+    )
+    parser.add_argument("--cache-dir", default="./.feature_cache", help="特徴量キャッシュの保存先")
+    parser.add_argument("--no-cache", action="store_true", help="キャッシュを使わず全ファイルを解析し直す")
+    args = parser.parse_args()
+    if args.streaming and args.profile != "full":
+        parser.error("--streaming はネイティブレートで全体を読むため --profile full とだけ併用できます")
+    if args.timelines and (args.streaming or args.profile != "full"):
+        parser.error("--timelines は --profile full (非ストリーミング) でのみ使えます")
+
+    input_directory = args.input_dir
+    output_json_path = args.output
+
+    files = sorted([f for f in os.listdir(input_directory) if f.lower().endswith(".wav")])
+
+    extract_options = {}
+    if not args.all_fields:
+        extract_options["fields"] = CATALOG_FIELDS
+    if args.similarity_index:
+        fields = extract_options.get("fields") or tuple(MUSIC_FEATURES) + tuple(environment_feature_specs())
+        extract_options["fields"] = tuple(fields) + ("embedding",)
+    if args.preclassify:
+        skippable = preclassify_skippable(extract_options.get("fields"))
+        if args.streaming:
+            # ストリーミング解析ではオンセット包絡をブロックごとに必ず集計するので、省けるのはテンポだけ
+            skippable = {audio_type: names & {"tempo"} for audio_type, names in skippable.items()}
+        if any(skippable.values()):
+            extract_options["preclassify"] = True
+        else:
+            print("warning: --preclassify ignored: the requested fields compute every intermediate it could skip")
+    if not args.streaming:
+        extract_options["profile"] = args.profile
+    if args.timelines:
+        extract_options["timeline_resolution"] = args.timeline_resolution
+
+    # ストリーミング解析・プロファイルは値が変わりうるので、キャッシュのエントリ内で方式ごとに分ける
+    method = "stream" if args.streaming else args.profile
+    store = None if args.no_cache else FeatureStore(args.cache_dir, ANALYSIS_VERSION)
+    timeline_store = TimelineStore(args.timeline_dir) if args.timelines else None
+
+    # キャッシュに無い（新規・変更された）ファイルだけを解析対象にする
+    features_by_name = {}
+    keys = {}
+    entries = {}
+    to_analyze = []
+    for filename in files:
+        audio_path = os.path.join(input_directory, filename)
+        if store is not None:
+            keys[filename] = store.content_key(filename, audio_path)
+            entries[filename] = store.get(keys[filename]) or {}
+            cached = cached_features(entries[filename].get(method), extract_options.get("fields"))
+            # キャッシュにあるファイルは以前に解析できているので、ここで ID を引いてよい
+            needs_timeline = (
+                cached is not None and timeline_store is not None
+                and not timeline_store.has(store.track_id(filename))
+            )
+            if cached is not None and not needs_timeline:
+                features_by_name[filename] = cached
+                continue
+        to_analyze.append(filename)
+
+    print(f"{len(files)} files: {len(files) - len(to_analyze)} cached, {len(to_analyze)} to analyze")
+
+    timelines = {}
+    stats = BatchStats()
+    stage_summary = StageSummary() if args.instrument else None
+    results = batch_extract_features(
+        [os.path.join(input_directory, f) for f in to_analyze],
+        workers=args.workers or None,
+        max_in_flight=args.max_in_flight,
+        ordered=not args.unordered,
+        streaming=args.streaming,
+        tempo_batch_size=args.tempo_batch_size,
+        instrument=args.instrument,
+        **extract_options
+    )
+    for result in results:
+        stats.add(result)
+        if stage_summary is not None and "stages" in result:
+            stage_summary.add(result["path"], result["stages"], result["audio_seconds"])
+        filename = to_analyze[result["index"]]
+        if result["error"] is not None:
+            print(f"[skip] {filename}: {result['error']}")
+            continue
+        timeline = result["features"].pop("timeline", None)
+        if timeline is not None:
+            timelines[filename] = timeline
+        features_by_name[filename] = result["features"]
+        if store is not None:
+            # 事前判定をしない解析は全体 (または指定) で判定している
+            entry = entries[filename]
+            entry[method] = merge_cached_features(
+                entry.get(method), result["features"], result.get("classified_by") or "full"
+            )
+            store.put(keys[filename], entry, encoder=NumpyEncoder)
+
+    if store is not None:
+        removed = store.evict_missing(files)
+        if removed:
+            print(f"{len(removed)} files removed from cache: {', '.join(removed)}")
+
+    # トラックIDは解析できたファイルにだけ振る (読めないファイルで番号を消費しない)。
+    # キャッシュ使用時はファイル名ごとに固定のIDを使う
+    analyzed = [filename for filename in files if filename in features_by_name]
+    if store is not None:
+        track_ids = {filename: store.track_id(filename) for filename in analyzed}
+    else:
+        track_ids = {filename: f"track-{idx:03d}" for idx, filename in enumerate(analyzed, start=1)}
+
+    result_list = [
+        build_catalog_item(track_ids[filename], filename, features_by_name[filename])
+        for filename in analyzed
+    ]
+
+    if store is not None:
+        store.save()
+    if timeline_store is not None:
+        for filename, timeline in timelines.items():
+            timeline_store.put(track_ids[filename], filename, timeline)
+        timeline_store.evict(track_ids.values())
+        timeline_store.save()
+
+    if args.format in ("json", "both"):
+        # =============================
+        # 修正：cls=NumpyEncoderを指定
+        # =============================
+        with open(output_json_path, "w", encoding="utf-8") as f:
+            json.dump(result_list, f, ensure_ascii=False, indent=2, cls=NumpyEncoder)
+    if args.format in ("columnar", "both"):
+        write_catalog_columnar(result_list, args.columnar_dir)
+    if args.similarity_index:
+        embeddings = [features_by_name[item["filename"]].get("embedding") or {} for item in result_list]
+        # カタログには tempo の列が無いので特徴量から加える
+        rows = [
+            dict(item, tempo=features_by_name[item["filename"]].get("tempo") or 0.0)
+            for item in result_list
+        ]
+        write_similarity_index(
+            [item["id"] for item in result_list],
+            rows,
+            args.similarity_dir,
+            embeddings={
+                "mfcc": [e.get("mfcc") for e in embeddings],
+                "chroma": [e.get("chroma") for e in embeddings],
+            },
+            method=args.similarity_method,
+        )
+
+    summary = stats.summary()
+    print(
+        f"{summary['files']} files analyzed ({summary['failures']} failed), "
+        f"{summary['audio_seconds']:.1f} s of audio in {summary['elapsed_s']:.1f} s: "
+        f"{summary['files_per_s']:.2f} files/s, {summary['audio_seconds_per_s']:.1f} audio-s/s"
+    )
+    if extract_options.get("preclassify"):
+        classified = summary["preclassified"] + summary["fallbacks"]
+        print(
+            f"pre-classification: {summary['preclassified']} decided from excerpts, "
+            f"{summary['fallbacks']} fell back to full analysis "
+            f"({summary['fallbacks'] / max(classified, 1):.0%})"
+        )
+        saved = summary["classify_saved_seconds"]
+        saved_text = (
+            f"estimated {saved:.2f} s saved" if saved is not None
+            else "time saved unknown (no file computed tempo on the whole file)"
+        )
+        print(
+            f"  excerpts took {summary['excerpt_seconds']:.2f} s; tempo estimation skipped for "
+            f"{summary['skipped_audio_seconds']:.1f} s of audio: {saved_text}"
+        )
+    if stage_summary is not None:
+        print(stage_summary.table())
+        if args.instrument_json:
+            stage_summary.write_json(args.instrument_json)
 
-    print(f"処理が完了しました。結果は {os.path.basename(output_json_path)} に保存されました。")
+    saved = [os.path.basename(output_json_path)] if args.format in ("json", "both") else []
+    if args.format in ("columnar", "both"):
+        saved.append(os.path.basename(os.path.normpath(args.columnar_dir)))
+    if args.similarity_index:
+        saved.append(os.path.basename(os.path.normpath(args.similarity_dir)))
+    print(f"処理が完了しました。結果は {', '.join(saved)} に保存されました。")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,251 @@
+import os
+import struct
+
+import numpy as np
+
+
+# ==============================================
+# 音声ファイルの読み込み (解析と再生で共有)
+# ==============================================
+# WAV (PCM 8/16/24/32bit・IEEE float) はヘッダを直接読み、サンプル部分を np.memmap で
+# マップする。float への変換は要求された区間にだけ行うので、曲の一部だけを読む
+# (抜粋の解析・区間再生) ときはファイル全体を展開しない。
+# それ以外の形式 (FLAC / OGG / MP3 など) や読めない WAV は librosa (soundfile / audioread)
+# に任せる。load / stream の戻り値は librosa.load / librosa.stream と同じ。
+# librosa は import が重いので、再生側からも使えるよう WAV 以外・再サンプリング時にだけ読み込む。
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class UnsupportedWavError(ValueError):
+    """
+    WavFile で直接読めない形式 (圧縮 WAV・RF64 など)。load / stream はこの場合 librosa で読む。
+    """
+
+
+class WavFile:
+    """
+    WAV ファイルのヘッダを解析し、サンプルをメモリマップで参照する。
+
+        wav = WavFile("./music/rain.wav")
+        wav.sr, wav.channels, wav.frames, wav.duration
+        wav.pcm(0, wav.sr)            # 先頭1秒の生サンプル (frames, channels)。コピーしない
+        wav.read(offset=30.0, duration=5.0)   # float32 に変換したモノラル波形
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+            if riff != b"RIFF" or wave != b"WAVE":
+                raise UnsupportedWavError(f"not a RIFF/WAVE file: {path}")
+            fmt = None
+            data_offset = data_size = None
+            file_size = os.fstat(f.fileno()).st_size
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    break
+                chunk_id, chunk_size = struct.unpack("<4sI", header)
+                if chunk_id == b"fmt ":
+                    fmt = f.read(chunk_size)
+                elif chunk_id == b"data":
+                    data_offset = f.tell()
+                    # 書き込み途中などでサイズが実際より大きい場合はファイル末尾までとする
+                    data_size = min(chunk_size, file_size - data_offset)
+                    break
+                else:
+                    f.seek(chunk_size, os.SEEK_CUR)
+                # チャンクは偶数バイト境界に揃えられている
+                if chunk_size % 2:
+                    f.seek(1, os.SEEK_CUR)
+
+        if fmt is None or data_offset is None:
+            raise UnsupportedWavError(f"missing fmt or data chunk: {path}")
+        format_tag, channels, sr, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+        if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            # サブフォーマット GUID の先頭2バイトが実際の形式
+            format_tag = struct.unpack("<H", fmt[24:26])[0]
+        if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT) or channels == 0:
+            raise UnsupportedWavError(f"unsupported WAV format tag {format_tag:#06x}: {path}")
+
+        sample_width = bits // 8
+        if format_tag == WAVE_FORMAT_IEEE_FLOAT:
+            dtypes = {4: "<f4", 8: "<f8"}
+        else:
+            dtypes = {1: "u1", 2: "<i2", 3: "u1", 4: "<i4"}
+        if sample_width not in dtypes or block_align != sample_width * channels:
+            raise UnsupportedWavError(f"unsupported sample layout ({bits} bit, {channels} ch): {path}")
+
+        self.sr = sr
+        self.channels = channels
+        self.sample_width = sample_width
+        self.is_float = format_tag == WAVE_FORMAT_IEEE_FLOAT
+        self.frames = data_size // block_align
+        self.data_offset = data_offset
+        self._dtype = np.dtype(dtypes[sample_width])
+        self._samples = None
+
+    @property
+    def duration(self):
+        return self.frames / self.sr
+
+    @property
+    def samples(self):
+        """
+        ファイル全体の生サンプル (frames, channels)。24bit は (frames, channels * 3) の uint8。
+        最初に参照されたときにメモリマップする。
+        """
+        if self._samples is None:
+            width = self.channels * 3 if self.sample_width == 3 else self.channels
+            if self.frames == 0:
+                self._samples = np.zeros((0, width), dtype=self._dtype)
+            else:
+                self._samples = np.memmap(
+                    self.path, dtype=self._dtype, mode="r", offset=self.data_offset,
+                    shape=(self.frames, width)
+                )
+        return self._samples
+
+    def pcm(self, start=0, stop=None):
+        """
+        フレーム start から stop までの生サンプル (メモリマップのビュー、コピーしない)
+        """
+        return self.samples[max(start, 0):self.frames if stop is None else min(stop, self.frames)]
+
+    def to_float(self, pcm):
+        """
+        生サンプルを float32 (frames, channels) に変換する。スケールは soundfile と同じ。
+        """
+        if self.is_float:
+            return np.asarray(pcm, dtype=np.float32)
+        if self.sample_width == 3:
+            b = np.asarray(pcm, dtype=np.int32).reshape(len(pcm), self.channels, 3)
+            # 24bit リトルエンディアンを上位に詰めた 32bit 整数として組み立てる
+            x = (b[..., 0] << 8) | (b[..., 1] << 16) | (b[..., 2] << 24)
+            return (x / float(1 << 31)).astype(np.float32)
+        # 変換先の配列は1つだけ作り、以降はその場で計算する (スケールは2の冪なので誤差なし)
+        y = np.array(pcm, dtype=np.float32)
+        if self.sample_width == 1:
+            y -= 128.0
+            y /= 128.0
+        else:
+            y /= np.float32(1 << (8 * self.sample_width - 1))
+        return y
+
+    def ms_to_frame(self, ms):
+        return min(max(int(ms * self.sr // 1000), 0), self.frames)
+
+    def playable_pcm(self, start_ms=0, end_ms=None):
+        """
+        再生用に start_ms から end_ms までの整数 PCM (frames, channels) とサンプル幅を返す。
+        整数 PCM はメモリマップのビューのまま返し、float WAV だけ 16bit に変換する。
+        """
+        stop = None if end_ms is None else self.ms_to_frame(end_ms)
+        return self.playable(self.ms_to_frame(start_ms), stop), self.playable_sample_width
+
+    def playable(self, start=0, stop=None):
+        """
+        フレーム start から stop までの再生用の整数 PCM。整数 PCM はメモリマップのビュー
+        (C 連続) のまま、float WAV だけ 16bit に変換する。
+        """
+        pcm = self.pcm(start, stop)
+        if self.is_float:
+            pcm = (np.clip(self.to_float(pcm), -1.0, 1.0) * 32767.0).astype("<i2")
+        return pcm
+
+    @property
+    def playable_sample_width(self):
+        return 2 if self.is_float else self.sample_width
+
+    def read(self, offset=0.0, duration=None, mono=True):
+        """
+        librosa.load(sr=None) と同じ位置・値の波形を返す (mono=False なら (channels, n))。
+        変換するのは指定区間だけ。
+        """
+        start = int(offset * self.sr) if offset else 0
+        stop = None if duration is None else start + int(duration * self.sr)
+        y = self.to_float(self.pcm(start, stop)).T
+        if mono or self.channels == 1:
+            return _to_mono(y)
+        return y
+
+
+def _to_mono(y):
+    # librosa.to_mono と同じくチャンネル平均 (1チャンネルならそのまま)
+    if y.ndim > 1:
+        y = y[0] if y.shape[0] == 1 else np.mean(y, axis=0)
+    return np.ascontiguousarray(y, dtype=np.float32)
+
+
+def open_wav(path):
+    """
+    path が直接読める WAV なら WavFile、そうでなければ None
+    """
+    try:
+        return WavFile(path)
+    except (UnsupportedWavError, struct.error, OSError):
+        return None
+
+
+def get_samplerate(path):
+    wav = open_wav(path)
+    if wav is not None:
+        return wav.sr
+    import librosa
+    return librosa.get_samplerate(path)
+
+
+def get_duration(path):
+    wav = open_wav(path)
+    if wav is not None:
+        return wav.duration
+    import librosa
+    return librosa.get_duration(path=path)
+
+
+def load(path, sr=None, offset=0.0, duration=None, mono=True, res_type="soxr_hq"):
+    """
+    librosa.load と同じ (y, sr) を返す。WAV はメモリマップから指定区間だけ変換し、
+    sr を指定したときの再サンプリングは librosa.resample で行う。
+    """
+    wav = open_wav(path)
+    if wav is None:
+        import librosa
+        return librosa.load(path, sr=sr, offset=offset, duration=duration, mono=mono, res_type=res_type)
+    y = wav.read(offset, duration, mono=mono)
+    if sr is not None and sr != wav.sr:
+        import librosa
+        y = librosa.resample(y, orig_sr=wav.sr, target_sr=sr, res_type=res_type)
+        return y, sr
+    return y, wav.sr
+
+
+def stream(path, block_length, frame_length, hop_length, mono=True, fill_value=None):
+    """
+    librosa.stream と同じブロックを返すジェネレータ。WAV はメモリマップからブロックごとに変換する。
+    各ブロックは frame_length + (block_length - 1) * hop_length サンプルで、
+    frame_length - hop_length サンプルずつ前のブロックと重なる。
+    """
+    wav = open_wav(path)
+    if wav is None:
+        import librosa
+        yield from librosa.stream(
+            path, block_length=block_length, frame_length=frame_length, hop_length=hop_length,
+            mono=mono, fill_value=fill_value
+        )
+        return
+
+    block_size = frame_length + (block_length - 1) * hop_length
+    step = block_length * hop_length
+    start = 0
+    # soundfile.blocks と同じく、前のブロックとの重なり以外に新しいフレームがある限り続ける
+    while start == 0 and wav.frames > 0 or start + block_size - step < wav.frames:
+        y = wav.to_float(wav.pcm(start, start + block_size))
+        if fill_value is not None and len(y) < block_size:
+            y = np.concatenate([y, np.full((block_size - len(y), y.shape[1]), fill_value, dtype=y.dtype)])
+        y = y.T
+        yield _to_mono(y) if mono or wav.channels == 1 else y
+        start += step
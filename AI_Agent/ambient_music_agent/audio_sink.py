@@ -0,0 +1,257 @@
+import os
+import time
+import wave
+
+
+# ==============================================
+# 再生エンジンの出力先 (シンク)
+# ==============================================
+# PlaybackEngine は sink.write(block, fmt) で整数 PCM (frames, channels) を書き込み、
+# 曲 (と曲間の無音) を書き終えるたびに sink.flush()、最後に sink.close() を呼ぶ。
+# fmt は (サンプリングレート, チャンネル数, サンプル幅)。
+#   - DeviceSink: 音声デバイス (PyAudio。無ければ曲ごとにまとめて pydub の play)
+#   - WavFileSink: WAV ファイルに書き出す (出力の確認用)
+#   - NullSink: 書き込まれた音声を実時間 (または speed 倍速) で消費して捨てる。
+#     音声デバイスの無いサーバーでの負荷試験用
+# どのシンクも書き込み量とアンダーラン (次の書き込みが間に合わずバッファが空になった回数・時間) を
+# stats() で返す。
+
+# デバイスのバッファの長さ (この分だけ先に書き込める)
+BUFFER_MS = 200
+
+
+class AudioSink:
+    """
+    シンクの共通部分。書き込んだフレーム数とアンダーランを数える。
+    """
+
+    def __init__(self):
+        self.writes = 0
+        self.frames = 0
+        self.seconds = 0.0
+        self.underruns = 0
+        self.underrun_seconds = 0.0
+
+    def write(self, block, fmt):
+        self.writes += 1
+        self.frames += len(block)
+        self.seconds += len(block) / fmt[0]
+
+    def idle(self):
+        """
+        再生するものが無くなったときに呼ばれる。次の書き込みまでの空白をアンダーランとして数えない。
+        """
+
+    def flush(self):
+        """
+        曲 (と曲間の無音) を書き終えたときに呼ばれる。書き込みをためて再生するシンクはここで再生する。
+        """
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {
+            "writes": self.writes,
+            "frames": self.frames,
+            "audio_seconds": self.seconds,
+            "underruns": self.underruns,
+            "underrun_ms": self.underrun_seconds * 1000.0,
+        }
+
+
+class NullSink(AudioSink):
+    """
+    書き込まれた音声を捨てるシンク。実際のデバイスと同じく buffer_ms 分のバッファを持ち、
+    それを speed 倍速で消費する (バッファが一杯なら write が待つ)。
+    バッファが空になってから次の書き込みが来たらアンダーランとして数える。
+    speed=None なら待たずにすぐ返す (アンダーランは数えない)。
+    """
+
+    def __init__(self, speed=1.0, buffer_ms=BUFFER_MS):
+        super().__init__()
+        self.speed = speed
+        self.buffer_seconds = buffer_ms / 1000.0
+        # バッファの音声を消費し終わる時刻
+        self._drained_at = None
+
+    def write(self, block, fmt):
+        super().write(block, fmt)
+        if self.speed is None:
+            return
+        now = time.perf_counter()
+        if self._drained_at is None:
+            self._drained_at = now
+        elif now > self._drained_at:
+            self.underruns += 1
+            self.underrun_seconds += (now - self._drained_at) * self.speed
+            self._drained_at = now
+        self._drained_at += len(block) / fmt[0] / self.speed
+        # バッファに入りきらない分は消費されるまで待つ
+        wait = self._drained_at - now - self.buffer_seconds / self.speed
+        if wait > 0:
+            time.sleep(wait)
+
+    def idle(self):
+        self._drained_at = None
+
+
+class WavFileSink(NullSink):
+    """
+    書き込まれた音声を WAV ファイルに書き出すシンク。フォーマットが変わったら
+    path の拡張子の前に番号を付けた新しいファイルに切り替える。
+    speed を指定すると NullSink と同じく消費の速さを模擬する (既定は待たない)。
+    """
+
+    def __init__(self, path, speed=None, buffer_ms=BUFFER_MS):
+        super().__init__(speed=speed, buffer_ms=buffer_ms)
+        self.path = path
+        self.paths = []
+        self.format = None
+        self._wav = None
+
+    def write(self, block, fmt):
+        if fmt != self.format:
+            self._close_file()
+            path = self.path
+            if self.paths:
+                root, ext = os.path.splitext(self.path)
+                path = f"{root}.{len(self.paths)}{ext or '.wav'}"
+            sr, channels, sample_width = fmt
+            self._wav = wave.open(path, "wb")
+            self._wav.setnchannels(channels)
+            self._wav.setsampwidth(sample_width)
+            self._wav.setframerate(sr)
+            self.paths.append(path)
+            self.format = fmt
+        self._wav.writeframesraw(block.data)
+        super().write(block, fmt)
+
+    def _close_file(self):
+        if self._wav is not None:
+            self._wav.close()
+            self._wav = None
+            self.format = None
+
+    def close(self):
+        self._close_file()
+
+
+def _open_pyaudio():
+    try:
+        import pyaudio
+    except ImportError:
+        return None
+    return pyaudio
+
+
+def pyaudio_format(pyaudio, sample_width):
+    """
+    整数 PCM のサンプル幅に対応する PyAudio のフォーマット。
+    get_format_from_width は 4 バイトを paFloat32 にしてしまうので、32bit 整数は paInt32 にする。
+    8bit (符号なし)・24bit (3バイト詰め) は PyAudio がそのまま受け付ける。
+    """
+    if sample_width == 4:
+        return pyaudio.paInt32
+    return pyaudio.get_format_from_width(sample_width, unsigned=True)
+
+
+class DeviceSink(AudioSink):
+    """
+    音声デバイス。同じフォーマットが続く間は出力ストリームを開いたままにするので、
+    曲間でストリームを開き直す途切れが出ない。アンダーランは PyAudio の出力アンダーフローを数える。
+    PyAudio が無い環境では書き込まれたブロックをためておき、flush (曲の終わり)・フォーマットの
+    切り替わり・close のときに pydub の play 1回でまとめて再生する。ブロックごとに再生を
+    始め直さないので曲の途中で途切れないが、再生が終わるまで flush が返らないため、
+    スキップや停止は次の曲から反映される。
+    """
+
+    def __init__(self, buffer_ms=BUFFER_MS):
+        super().__init__()
+        self.buffer_ms = buffer_ms
+        self._pyaudio = _open_pyaudio()
+        self._pa = None
+        self._stream = None
+        self._idle = False
+        self.format = None
+        # PyAudio が無いときにためている書き込み
+        self._pending = []
+
+    def write(self, block, fmt):
+        super().write(block, fmt)
+        if self._pyaudio is None:
+            if fmt != self.format:
+                self.flush()
+                self.format = fmt
+            self._pending.append(block.tobytes())
+            return
+        if fmt != self.format:
+            self._close_stream()
+            if self._pa is None:
+                self._pa = self._pyaudio.PyAudio()
+            sr, channels, sample_width = fmt
+            self._stream = self._pa.open(
+                format=pyaudio_format(self._pyaudio, sample_width),
+                channels=channels,
+                rate=sr,
+                output=True,
+                frames_per_buffer=max(int(sr * self.buffer_ms / 2000), 1),
+            )
+            self.format = fmt
+        try:
+            self._stream.write(block.data, len(block), exception_on_underflow=True)
+        except IOError as e:
+            # アンダーフローは書き込み後に報告されるので、数えるだけでよい
+            if getattr(e, "errno", None) != self._pyaudio.paOutputUnderflowed:
+                raise
+            if not self._idle:
+                self.underruns += 1
+        self._idle = False
+
+    def idle(self):
+        self._idle = True
+
+    def flush(self):
+        if not self._pending:
+            return
+        from pydub import AudioSegment
+        from pydub.playback import play
+        sr, channels, sample_width = self.format
+        data = b"".join(self._pending)
+        self._pending = []
+        play(AudioSegment(data=data, sample_width=sample_width, frame_rate=sr, channels=channels))
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+            self.format = None
+
+    def close(self):
+        self.flush()
+        self._close_stream()
+        if self._pa is not None:
+            self._pa.terminate()
+            self._pa = None
+
+
+def sink_factory(spec="device"):
+    """
+    文字列からシンクを作る関数を返す (環境変数やコマンドライン引数での指定用)
+      "device"            音声デバイス
+      "null"              実時間で消費して捨てる
+      "null:8"            8倍速で消費して捨てる ("null:0" なら待たない)
+      "wav:./out.wav"     WAV ファイルに書き出す
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "device":
+        return DeviceSink
+    if kind == "null":
+        speed = float(arg) if arg else 1.0
+        return lambda: NullSink(speed=speed or None)
+    if kind == "wav":
+        if not arg:
+            raise ValueError("wav sink needs a path: wav:<path>")
+        return lambda: WavFileSink(arg)
+    raise ValueError(f"unknown audio sink: {spec}")
@@ -0,0 +1,930 @@
+"""
+audio_analysis の性能計測スクリプト
+
+使い方:
+    python benchmark.py features --music-dir ./music
+    python benchmark.py profiles --music-dir ./music
+    python benchmark.py catalog --tracks 100000
+    python benchmark.py tempo --music-dir ./music
+    python benchmark.py preclassify --music-dir ./music
+    python benchmark.py similarity --tracks 100000
+    python benchmark.py decode [--music-dir ./music]
+    python benchmark.py transition [--crossfade-ms 3000]
+    python benchmark.py sessions [--sessions 1 50 200]
+    python benchmark.py regression [--update-golden]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+import audio_analysis
+import audio_io
+import audio_sink
+import catalog_store
+import fixtures
+import playback
+import similarity_index
+
+
+# ==============================================
+# 比較用：共有キャッシュ導入前の計算手順
+# ==============================================
+def legacy_extract_features(y, sr):
+    """
+    各特徴量が y から個別にスペクトログラムを作り直していた従来の手順を再現する。
+    音楽・環境音の両ブランチを通すので、最悪ケースの比較になる。
+    """
+    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+    librosa.onset.onset_strength(y=y, sr=sr).mean()
+
+    librosa.feature.rms(y=y)
+    librosa.feature.tempogram(y=y, sr=sr)
+    librosa.feature.spectral_contrast(y=y, sr=sr)
+    librosa.feature.chroma_cqt(y=y, sr=sr)
+    librosa.onset.onset_strength(y=y, sr=sr).mean()
+    librosa.feature.tonnetz(y=y, sr=sr)
+    librosa.feature.zero_crossing_rate(y=y)
+    librosa.feature.spectral_flatness(y=y)
+
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+    librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr)
+    librosa.feature.spectral_flatness(y=y)
+    np.abs(librosa.stft(y))
+
+
+def shared_extract_features(y, sr):
+    """
+    AnalysisContext を使った現在の手順（両ブランチ）
+    """
+    ctx = audio_analysis.AnalysisContext(y, sr)
+    tempo = ctx.tempo
+    audio_analysis.extract_music_features(y, sr, tempo, ctx=ctx)
+    audio_analysis.extract_environment_features(y, sr, ctx=ctx)
+
+
+def list_wavs(music_dir):
+    return sorted(
+        os.path.join(music_dir, f) for f in os.listdir(music_dir) if f.lower().endswith(".wav")
+    )
+
+
+def bench_features(args):
+    files = list_wavs(args.music_dir)
+    if not files:
+        print(f"{args.music_dir} に WAV ファイルがありません。")
+        return
+
+    totals = {"legacy": 0.0, "shared": 0.0}
+    audio_seconds = 0.0
+
+    print(f"{'file':40s} {'min':>6s} {'legacy s/min':>13s} {'shared s/min':>13s} {'speedup':>8s}")
+    for path in files:
+        y, sr = librosa.load(path, sr=None)
+        minutes = len(y) / sr / 60.0
+        audio_seconds += len(y) / sr
+
+        timings = {}
+        for name, fn in (("legacy", legacy_extract_features), ("shared", shared_extract_features)):
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                fn(y, sr)
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best
+            totals[name] += best
+
+        print(
+            f"{os.path.basename(path)[:40]:40s} {minutes:6.2f} "
+            f"{timings['legacy'] / minutes:13.3f} {timings['shared'] / minutes:13.3f} "
+            f"{timings['legacy'] / timings['shared']:7.2f}x"
+        )
+
+    total_minutes = audio_seconds / 60.0
+    print(
+        f"{'TOTAL':40s} {total_minutes:6.2f} "
+        f"{totals['legacy'] / total_minutes:13.3f} {totals['shared'] / total_minutes:13.3f} "
+        f"{totals['legacy'] / totals['shared']:7.2f}x"
+    )
+
+
+def bench_profiles(args):
+    """
+    各解析プロファイルの所要時間と、full プロファイルとの結果の一致度を比べる
+    """
+    files = list_wavs(args.music_dir)
+    if not files:
+        print(f"{args.music_dir} に WAV ファイルがありません。")
+        return
+
+    profiles = [p for p in audio_analysis.ANALYSIS_PROFILES if p != "full"]
+    totals = {name: 0.0 for name in ["full"] + profiles}
+    agree = {name: {"type": 0, "lofi": 0} for name in profiles}
+    rel_err = {name: {"acousticness": [], "energy": [], "tempo": []} for name in profiles}
+
+    for path in files:
+        items = {}
+        for name in ["full"] + profiles:
+            start = time.perf_counter()
+            features = audio_analysis.extract_features(path, profile=name)
+            totals[name] += time.perf_counter() - start
+            item = audio_analysis.build_catalog_item("-", os.path.basename(path), features)
+            item["type"] = features["type"]
+            item["tempo"] = features["tempo"] or 0.0
+            items[name] = item
+
+        reference = items["full"]
+        for name in profiles:
+            item = items[name]
+            agree[name]["type"] += item["type"] == reference["type"]
+            agree[name]["lofi"] += item["lofi"] == reference["lofi"]
+            for key in rel_err[name]:
+                denom = max(abs(float(reference[key])), 1e-9)
+                rel_err[name][key].append(abs(float(item[key]) - float(reference[key])) / denom)
+            print(
+                f"{os.path.basename(path)[:32]:32s} {name:6s} type {item['type'][:5]}/{reference['type'][:5]} "
+                f"lofi {item['lofi']!s:5s}/{reference['lofi']!s:5s} "
+                f"tempo {item['tempo']:6.1f}/{reference['tempo']:6.1f}"
+            )
+
+    n = len(files)
+    print()
+    print(f"{'profile':8s} {'time s':>8s} {'speedup':>8s} {'type':>6s} {'lofi':>6s} "
+          f"{'acoust err':>10s} {'energy err':>10s} {'tempo err':>10s}")
+    print(f"{'full':8s} {totals['full']:8.2f} {1.0:7.2f}x {'-':>6s} {'-':>6s}")
+    for name in profiles:
+        print(
+            f"{name:8s} {totals[name]:8.2f} {totals['full'] / max(totals[name], 1e-9):7.2f}x "
+            f"{agree[name]['type'] / n:6.0%} {agree[name]['lofi'] / n:6.0%} "
+            f"{np.median(rel_err[name]['acousticness']):10.3f} "
+            f"{np.median(rel_err[name]['energy']):10.3f} "
+            f"{np.median(rel_err[name]['tempo']):10.3f}"
+        )
+
+
+def synthetic_catalog(n_tracks, seed=0):
+    """
+    output.json と同じ形式のダミーカタログを n_tracks 件作る
+    """
+    rng = np.random.default_rng(seed)
+    genres = ["music", "environment", "piano", "lofi", "ambient"]
+    moods = ["neutral", "calm", "bright", "dark"]
+    return [
+        {
+            "id": f"track-{i + 1:06d}",
+            "title": "Untitled",
+            "description": "",
+            "duration_ms": int(rng.integers(10_000, 600_000)),
+            "genre": genres[int(rng.integers(len(genres)))],
+            "instrumentation": "unknown",
+            "mood": moods[int(rng.integers(len(moods)))],
+            "acousticness": float(rng.random()),
+            "energy": float(rng.random() * 0.3),
+            "lofi": bool(rng.random() < 0.3),
+            "filename": f"track-{i + 1:06d}.wav",
+        }
+        for i in range(n_tracks)
+    ]
+
+
+def dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files
+    )
+
+
+def bench_catalog(args):
+    """
+    JSON (indent=2, NumpyEncoder) と列指向形式の書き込み・読み込み・絞り込みを比べる
+    """
+    items = synthetic_catalog(args.tracks)
+    work_dir = tempfile.mkdtemp(prefix="catalog_bench_")
+    try:
+        json_path = os.path.join(work_dir, "output.json")
+        columnar_dir = os.path.join(work_dir, "catalog")
+
+        start = time.perf_counter()
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(items, f, ensure_ascii=False, indent=2, cls=audio_analysis.NumpyEncoder)
+        json_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(json_path, "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+        json_read = time.perf_counter() - start
+
+        start = time.perf_counter()
+        json_hits = [t for t in loaded if t["genre"] == "music" and t["lofi"] and 0.05 <= t["energy"] <= 0.2]
+        json_filter = time.perf_counter() - start
+
+        start = time.perf_counter()
+        catalog_store.write_catalog_columnar(items, columnar_dir)
+        columnar_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        table = catalog_store.CatalogTable(columnar_dir)
+        columnar_open = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rows = table.where(genre="music", lofi=True, energy=(0.05, 0.2))
+        hits = table.records(rows[:10])
+        columnar_filter = time.perf_counter() - start
+        assert len(rows) == len(json_hits)
+
+        start = time.perf_counter()
+        table.records()
+        columnar_full = time.perf_counter() - start
+
+        print(f"{args.tracks} tracks, {len(rows)} matches for genre=music & lofi & 0.05<=energy<=0.2")
+        print(f"{'format':10s} {'size MB':>8s} {'write s':>8s} {'open s':>8s} {'filter s':>9s} {'full read s':>11s}")
+        print(f"{'json':10s} {os.path.getsize(json_path) / 1e6:8.2f} {json_write:8.3f} "
+              f"{json_read:8.3f} {json_filter:9.4f} {json_read:11.3f}")
+        print(f"{'columnar':10s} {dir_size(columnar_dir) / 1e6:8.2f} {columnar_write:8.3f} "
+              f"{columnar_open:8.4f} {columnar_filter:9.4f} {columnar_full:11.3f}")
+        print(f"first match: {hits[0] if hits else None}")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def bench_tempo(args):
+    """
+    ファイルごとの beat_track・estimate_tempo と、batch_estimate_tempo の一括推定を、
+    時間と一致率で比べる。オンセット包絡は共通なので、その計算時間は含めない。
+    beat_track は初回に numba のコンパイルが走るので、先に1回ずつ呼んでから --repeat 回の最良値を測る。
+    """
+    files = list_wavs(args.music_dir)
+    if not files:
+        print(f"{args.music_dir} に WAV ファイルがありません。")
+        return
+
+    envelopes = []
+    for path in files:
+        y, sr = librosa.load(path, sr=None)
+        ctx = audio_analysis.AnalysisContext(y, sr)
+        envelopes.append((path, sr, ctx.beat_onset_envelope))
+
+    def beat_track(entries):
+        return [
+            float(np.atleast_1d(librosa.beat.beat_track(onset_envelope=env, sr=sr)[0])[0])
+            for _, sr, env in entries
+        ]
+
+    def estimate_tempo(entries):
+        return [audio_analysis.estimate_tempo(env, sr) for _, sr, env in entries]
+
+    def batch(entries):
+        # sr ごとにまとめて推定し、入力順に並べ直す
+        by_rate = {}
+        for i, (_, sr, env) in enumerate(entries):
+            by_rate.setdefault(sr, []).append((i, env))
+        tempos = [0.0] * len(entries)
+        for sr, group in by_rate.items():
+            estimates = audio_analysis.batch_estimate_tempo([env for _, env in group], sr)
+            for (i, _), bpm in zip(group, estimates):
+                tempos[i] = float(bpm)
+        return tempos
+
+    methods = {"beat_track": beat_track, "estimate_tempo": estimate_tempo, "batch": batch}
+    for method in methods.values():
+        method(envelopes[:1])
+
+    times = {}
+    tempos = {}
+    for name, method in methods.items():
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            tempos[name] = method(envelopes)
+            best = min(best, time.perf_counter() - start)
+        times[name] = best
+
+    agree = {"estimate_tempo": 0, "batch": 0}
+    print(f"{'file':40s} {'beat_track':>10s} {'estimate':>9s} {'batch':>8s}")
+    for i, (path, _, _) in enumerate(envelopes):
+        bpm = tempos["beat_track"][i]
+        for name in agree:
+            agree[name] += abs(bpm - tempos[name][i]) <= args.tolerance_bpm
+        print(
+            f"{os.path.basename(path)[:40]:40s} {bpm:10.2f} "
+            f"{tempos['estimate_tempo'][i]:9.2f} {tempos['batch'][i]:8.2f}"
+        )
+
+    print()
+    print(
+        f"agreement with beat_track within {args.tolerance_bpm} BPM: "
+        f"estimate_tempo {agree['estimate_tempo']}/{len(files)}, batch {agree['batch']}/{len(files)}"
+    )
+    print(
+        f"best of {args.repeat} (warm): beat_track {times['beat_track']:.3f} s, "
+        f"estimate_tempo {times['estimate_tempo']:.3f} s "
+        f"({times['beat_track'] / max(times['estimate_tempo'], 1e-9):.1f}x), "
+        f"batch {times['batch']:.3f} s ({times['beat_track'] / max(times['batch'], 1e-9):.1f}x)"
+    )
+
+
+def bench_preclassify(args):
+    """
+    抜粋による事前判定ありとなしで extract_features を比べ、判定の一致率・
+    全体判定へのフォールバック率・ライブラリ全体で短縮された時間を出す。
+    初回の呼び出しは numba のコンパイルなどを含むので先に1回ずつ捨てて実行し、
+    さらにファイルごとに実行順を入れ替えて、順番による偏り (キャッシュの温まり方など) を打ち消す。
+    """
+    files = list_wavs(args.music_dir)
+    if not files:
+        print(f"{args.music_dir} に WAV ファイルがありません。")
+        return
+    fields = None if args.all_fields else audio_analysis.CATALOG_FIELDS
+
+    def run(path, preclassify):
+        start = time.perf_counter()
+        features = audio_analysis.extract_features(path, fields=fields, preclassify=preclassify)
+        return features, time.perf_counter() - start
+
+    run(files[0], False)
+    run(files[0], True)
+
+    totals = {"full": 0.0, "pre": 0.0}
+    saved_by_type = {}
+    agree = 0
+    fallbacks = 0
+    print(f"{'file':36s} {'full s':>7s} {'pre s':>7s} {'type (pre/full)':>24s} {'by':>8s}")
+    for i, path in enumerate(files):
+        if i % 2:
+            features, pre_time = run(path, True)
+            reference, full_time = run(path, False)
+        else:
+            reference, full_time = run(path, False)
+            features, pre_time = run(path, True)
+
+        totals["full"] += full_time
+        totals["pre"] += pre_time
+        verdict = features["type"] if features["classified_by"] == "excerpt" else "fallback"
+        saved_by_type[verdict] = saved_by_type.get(verdict, 0.0) + full_time - pre_time
+        agree += features["type"] == reference["type"]
+        fallbacks += features["classified_by"] == "full"
+        types = f"{features['type'][:5]}/{reference['type'][:5]}"
+        print(
+            f"{os.path.basename(path)[:36]:36s} {full_time:7.3f} {pre_time:7.3f} "
+            f"{types:>24s} {features['classified_by']:>8s}"
+        )
+
+    n = len(files)
+    print()
+    print(f"type agreement: {agree}/{n}, fallback to full analysis: {fallbacks}/{n} ({fallbacks / n:.0%})")
+    print(
+        f"total: {totals['full']:.2f} s without, {totals['pre']:.2f} s with pre-classification "
+        f"(saved {totals['full'] - totals['pre']:.2f} s, {1 - totals['pre'] / max(totals['full'], 1e-9):.0%})"
+    )
+    # 音楽と判定してもテンポ (カタログ項目) は全体で求めるので、短縮できるのは主に環境音
+    print("saved by verdict: " + ", ".join(
+        f"{verdict.split('_')[0]} {seconds:.2f} s" for verdict, seconds in sorted(saved_by_type.items())
+    ))
+
+
+def _decode_paths(args):
+    """
+    (ファイル一覧, 後始末する一時ディレクトリ)。--music-dir が無ければ合成フィクスチャを使う。
+    """
+    if args.music_dir:
+        return list_wavs(args.music_dir), None
+    tmp_dir = tempfile.mkdtemp(prefix="decode-fixtures-")
+    return sorted(fixtures.write_fixtures(tmp_dir).values()), tmp_dir
+
+
+def _pydub_segment(path, start_ms, end_ms):
+    from pydub import AudioSegment
+    return AudioSegment.from_wav(path)[start_ms:end_ms].raw_data
+
+
+def _audio_io_segment(path, start_ms, end_ms):
+    pcm, _ = audio_io.WavFile(path).playable_pcm(start_ms, end_ms)
+    return pcm.tobytes()
+
+
+def bench_decode(args):
+    """
+    librosa (soundfile) / pydub と audio_io の読み込み速度を、音声秒/秒で比べる。
+    - full: ファイル全体を float32 で読む (解析)
+    - excerpt: 5 秒の抜粋を3か所読む (事前判定)
+    - segment: 30 秒の区間を再生用の PCM バイト列として切り出す (再生ツール)
+    値が一致しない組み合わせがあれば表示する。
+    """
+    files, tmp_dir = _decode_paths(args)
+    if not files:
+        print(f"{args.music_dir} に WAV ファイルがありません。")
+        return
+    try:
+        import pydub  # noqa: F401
+        has_pydub = True
+    except ImportError:
+        has_pydub = False
+        print("pydub がインストールされていないので segment の比較は audio_io だけ計測します。")
+
+    times = {}
+    audio_seconds = {"full": 0.0, "excerpt": 0.0, "segment": 0.0}
+    mismatches = []
+
+    def timed(key, func, *a, **kw):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            out = func(*a, **kw)
+        times[key] = times.get(key, 0.0) + (time.perf_counter() - start) / args.repeat
+        return out
+
+    try:
+        for path in files:
+            duration = audio_io.get_duration(path)
+            name = os.path.basename(path)
+
+            ref, _ = timed(("full", "librosa"), librosa.load, path, sr=None)
+            y, _ = timed(("full", "audio_io"), audio_io.load, path, sr=None)
+            if not np.array_equal(ref, y):
+                mismatches.append((name, "full"))
+            audio_seconds["full"] += duration
+
+            excerpt = min(5.0, duration)
+            for offset in np.linspace(0.0, max(duration - excerpt, 0.0), 3):
+                ref, _ = timed(("excerpt", "librosa"), librosa.load, path, sr=None, offset=offset,
+                               duration=excerpt)
+                y, _ = timed(("excerpt", "audio_io"), audio_io.load, path, sr=None, offset=offset,
+                             duration=excerpt)
+                if not np.array_equal(ref, y):
+                    mismatches.append((name, f"excerpt@{offset:.1f}"))
+                audio_seconds["excerpt"] += excerpt
+
+            start_ms = int(max(duration - 30.0, 0.0) * 500)
+            end_ms = start_ms + int(min(30.0, duration) * 1000)
+            data = timed(("segment", "audio_io"), _audio_io_segment, path, start_ms, end_ms)
+            if has_pydub:
+                ref = timed(("segment", "pydub"), _pydub_segment, path, start_ms, end_ms)
+                if ref != data:
+                    mismatches.append((name, "segment"))
+            audio_seconds["segment"] += (end_ms - start_ms) / 1000.0
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"{len(files)} files, {audio_seconds['full']:.1f} s of audio, repeat {args.repeat}")
+    print(f"{'case':10s} {'reader':10s} {'time s':>9s} {'audio-s/s':>11s} {'speedup':>8s}")
+    for case in ("full", "excerpt", "segment"):
+        baseline = times.get((case, "librosa"), times.get((case, "pydub")))
+        for (c, reader), elapsed in times.items():
+            if c != case:
+                continue
+            speedup = f"{baseline / max(elapsed, 1e-9):7.1f}x" if baseline else ""
+            print(f"{case:10s} {reader:10s} {elapsed:9.3f} {audio_seconds[case] / max(elapsed, 1e-9):11.0f} "
+                  f"{speedup:>8s}")
+    if mismatches:
+        print("mismatches: " + ", ".join(f"{n} ({c})" for n, c in mismatches))
+    else:
+        print("all outputs identical")
+
+
+def synthetic_embeddings(n_tracks, n_clusters=64, seed=0):
+    """
+    クラスタ構造を持つダミーの MFCC / クロマ埋め込み (実際の曲のように似た曲のまとまりがある)
+    """
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(n_clusters, size=n_tracks)
+    mfcc_centers = rng.normal(0.0, 20.0, (n_clusters, audio_analysis.EMBEDDING_MFCC))
+    chroma_centers = rng.random((n_clusters, 12))
+    return {
+        "mfcc": mfcc_centers[labels] + rng.normal(0.0, 5.0, (n_tracks, audio_analysis.EMBEDDING_MFCC)),
+        "chroma": np.clip(chroma_centers[labels] + rng.normal(0.0, 0.1, (n_tracks, 12)), 0.0, 1.0),
+    }
+
+
+def bench_similarity(args):
+    """
+    類似検索インデックス (exact / ivf) の構築時間・検索時間と、ivf の exact に対する再現率
+    """
+    items = synthetic_catalog(args.tracks)
+    rng = np.random.default_rng(1)
+    for item in items:
+        item["tempo"] = float(rng.uniform(40, 160))
+    embeddings = synthetic_embeddings(args.tracks)
+    track_ids = [item["id"] for item in items]
+    queries = [track_ids[i] for i in rng.choice(args.tracks, args.queries, replace=False)]
+
+    work_dir = tempfile.mkdtemp(prefix="similarity_bench_")
+    try:
+        indexes = {}
+        print(f"{args.tracks} tracks, {args.queries} queries, k={args.k}")
+        print(f"{'method':14s} {'build s':>8s} {'size MB':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'recall@k':>9s}")
+        exact_hits = None
+        for method, nprobe in [("exact", None)] + [("ivf", n) for n in args.nprobe]:
+            index_dir = os.path.join(work_dir, method)
+            if method not in indexes:
+                start = time.perf_counter()
+                similarity_index.write_similarity_index(
+                    track_ids, items, index_dir, embeddings=embeddings, method=method
+                )
+                build = time.perf_counter() - start
+                indexes[method] = similarity_index.SimilarityIndex(index_dir)
+            else:
+                build = None
+            index = indexes[method]
+
+            latencies = []
+            hits = []
+            for track_id in queries:
+                start = time.perf_counter()
+                result = index.similar_to(track_id, k=args.k, nprobe=nprobe or 1)
+                latencies.append(time.perf_counter() - start)
+                hits.append({t for t, _ in result})
+            if exact_hits is None:
+                exact_hits = hits
+            recall = np.mean([len(h & e) / max(len(e), 1) for h, e in zip(hits, exact_hits)])
+            label = method if nprobe is None else f"ivf nprobe={nprobe}"
+            print(
+                f"{label:14s} {'-' if build is None else f'{build:.2f}':>8s} {dir_size(index_dir) / 1e6:8.1f} "
+                f"{np.percentile(latencies, 50) * 1e3:8.2f} {np.percentile(latencies, 95) * 1e3:8.2f} "
+                f"{recall:9.3f}"
+            )
+
+        latencies = []
+        for _ in range(args.queries):
+            profile = {"energy": float(rng.random() * 0.3), "tempo": float(rng.uniform(40, 160))}
+            start = time.perf_counter()
+            indexes["exact"].near_profile(profile, k=args.k)
+            latencies.append(time.perf_counter() - start)
+        print(
+            f"near_profile (energy, tempo): p50 {np.percentile(latencies, 50) * 1e3:.2f} ms, "
+            f"p95 {np.percentile(latencies, 95) * 1e3:.2f} ms"
+        )
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def write_playback_tracks(work_dir, n_tracks, seconds, ext="wav"):
+    """
+    再生ベンチマーク用の 44.1 kHz ステレオ 16bit の曲を n_tracks 個書き出してパスを返す
+    """
+    paths = []
+    for i in range(n_tracks):
+        y, _ = fixtures.generate(list(fixtures.FIXTURES)[i % len(fixtures.FIXTURES)])
+        y = np.resize(y, int(seconds * 44100))
+        path = os.path.join(work_dir, f"track{i}.{ext}")
+        sf.write(path, np.stack([y, y[::-1]], axis=1), 44100, subtype="PCM_16")
+        paths.append(path)
+    return paths
+
+
+class TimedSink(audio_sink.NullSink):
+    """
+    書き込みの時刻を記録する NullSink。書き込んだ長さを speed 倍速で消費するので、
+    書き込みと書き込みの間隔がそのまま再生エンジンの処理時間になる。
+    """
+
+    def __init__(self, engine_ref, speed):
+        # バッファを持たせず、1ブロックごとに消費を待つ
+        super().__init__(speed=speed, buffer_ms=0)
+        self.engine_ref = engine_ref
+        self.timeline = []
+
+    def write(self, block, fmt):
+        entered = time.perf_counter()
+        engine = self.engine_ref[0]
+        super().write(block, fmt)
+        # (書き込み開始, 書き込み終了, 再生中の曲, 状態)
+        self.timeline.append((entered, time.perf_counter(), id(engine.current), engine.state))
+
+
+def transition_latencies(writes):
+    """
+    曲が切り替わった (またはクロスフェードが始まった) 最初の書き込みについて、
+    直前の書き込みが終わってからの時間 (無音・音の途切れになる時間) を返す
+    """
+    latencies = []
+    for prev, cur in zip(writes, writes[1:]):
+        if cur[2] != prev[2] or (cur[3] == "crossfade" and prev[3] != "crossfade"):
+            latencies.append(cur[0] - prev[1])
+    return latencies
+
+
+def bench_transition(args):
+    """
+    曲の切り替わりで出力が途切れる時間 (前の書き込みの終わりから次の曲の最初の書き込みまで) を、
+    先読み・クロスフェードの有無、WAV / FLAC で比べる。
+    出力はデバイスの代わりに speed 倍速で消費する TimedSink を使う。
+    """
+    work_dir = tempfile.mkdtemp(prefix="transition_bench_")
+    try:
+        paths = {ext: write_playback_tracks(work_dir, args.tracks, args.track_seconds, ext) for ext in ("wav", "flac")}
+
+        print(f"{args.tracks} tracks x {args.track_seconds:.0f} s, 44.1 kHz stereo, output at {args.speed:.0f}x")
+        print(f"{'format':7s} {'prebuffer':>9s} {'crossfade':>9s} {'p50 ms':>8s} {'max ms':>8s} "
+              f"{'steady p99 ms':>13s}")
+        for ext, files in paths.items():
+            for prebuffer_ms in (0, playback.PREBUFFER_MS):
+                for crossfade_ms in (0, args.crossfade_ms):
+                    engine_ref = [None]
+                    engine = playback.PlaybackEngine(
+                        sink_factory=lambda: TimedSink(engine_ref, args.speed), crossfade_ms=crossfade_ms,
+                        prebuffer_ms=prebuffer_ms
+                    )
+                    engine_ref[0] = engine
+                    for i, path in enumerate(files):
+                        engine.enqueue(f"track{i}", path, 0, int(args.track_seconds * 1000), gap_ms=0)
+                    engine.wait_idle()
+                    engine.close()
+
+                    writes = engine.sink.timeline
+                    latencies = np.array(transition_latencies(writes)) * 1e3
+                    steady = np.array([cur[0] - prev[1] for prev, cur in zip(writes, writes[1:])]) * 1e3
+                    print(
+                        f"{ext:7s} {prebuffer_ms:9d} {crossfade_ms:9d} {np.percentile(latencies, 50):8.2f} "
+                        f"{latencies.max():8.2f} {np.percentile(steady, 99):13.2f}"
+                    )
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def bench_sessions(args):
+    """
+    同時に動かす再生エンジン (セッション) の数を変えて、NullSink で実時間 (speed 倍速) 再生したときの
+    アンダーラン・CPU 時間を測る。音声デバイスの無いサーバーでの同時セッション数の目安にする。
+    """
+    work_dir = tempfile.mkdtemp(prefix="sessions_bench_")
+    try:
+        files = write_playback_tracks(work_dir, args.tracks, args.track_seconds)
+        print(
+            f"{args.tracks_per_session} tracks x {args.track_seconds:.0f} s per session, "
+            f"crossfade {args.crossfade_ms} ms, sink at {args.speed:g}x, {os.cpu_count()} CPUs"
+        )
+        print(f"{'sessions':>8s} {'wall s':>7s} {'cpu s':>7s} {'cpu %/session':>13s} {'underruns':>9s} "
+              f"{'sessions w/ underrun':>20s} {'max underrun ms':>15s} {'sessions/core':>13s}")
+        for n_sessions in args.sessions:
+            engines = [
+                playback.PlaybackEngine(
+                    sink_factory=lambda: audio_sink.NullSink(speed=args.speed), crossfade_ms=args.crossfade_ms
+                )
+                for _ in range(n_sessions)
+            ]
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            for i, engine in enumerate(engines):
+                for j in range(args.tracks_per_session):
+                    path = files[(i + j) % len(files)]
+                    engine.enqueue(os.path.basename(path), path, 0, int(args.track_seconds * 1000), gap_ms=500)
+            for engine in engines:
+                engine.wait_idle()
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            stats = [engine.sink.stats() for engine in engines]
+            for engine in engines:
+                engine.close()
+
+            underruns = sum(st["underruns"] for st in stats)
+            with_underrun = sum(st["underruns"] > 0 for st in stats)
+            max_underrun = max(st["underrun_ms"] for st in stats)
+            cpu_per_session = cpu / wall / n_sessions
+            print(
+                f"{n_sessions:8d} {wall:7.2f} {cpu:7.2f} {cpu_per_session:13.2%} {underruns:9d} "
+                f"{with_underrun:20d} {max_underrun:15.1f} {1.0 / max(cpu_per_session * args.speed, 1e-9):13.0f}"
+            )
+    finally:
+        shutil.rmtree(work_dir)
+
+
+# ==============================================
+# 回帰ベンチマーク (合成フィクスチャ + ゴールデン値)
+# ==============================================
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_golden.json")
+
+# 計測・照合する関数。ゴールデン値は関数ごとに持つ。
+REGRESSION_FUNCTIONS = {
+    "load_audio": lambda path: audio_analysis.load_audio(path),
+    "extract_features": lambda path: audio_analysis.extract_features(path),
+    "extract_features_fast": lambda path: audio_analysis.extract_features(path, profile="fast"),
+    "extract_features_streaming": lambda path: audio_analysis.extract_features_streaming(path),
+    # audio_analysis.main (カタログ作成) が実際に行う呼び出し
+    "extract_features_catalog": lambda path: audio_analysis.extract_features(
+        path, fields=audio_analysis.CATALOG_FIELDS
+    ),
+    "extract_features_preclassify": lambda path: audio_analysis.extract_features(
+        path, fields=audio_analysis.CATALOG_FIELDS, preclassify=True
+    ),
+}
+
+# 数値の許容誤差 (特徴量名 -> (相対, 絶対))。それ以外の値 (type / key / lofi など) は完全一致。
+# 同じ環境なら結果は決定的なので、許容幅は BLAS / librosa のバージョン差を吸収する程度にする。
+DEFAULT_TOLERANCE = (1e-3, 1e-6)
+FEATURE_TOLERANCES = {
+    "tempo": (0.0, 0.5),
+    "danceability": (1e-2, 1e-6),
+    "onset_count": (0.0, 1.0),
+    "duration_ms": (0.0, 1.0),
+}
+# 呼び出しごとに変わる値
+UNCHECKED_FEATURES = {"id", "classify_seconds"}
+
+
+def regression_outputs(features):
+    """
+    extract_features の結果から照合対象の値 (カタログに書く lofi / energy なども含む) を取り出す
+    """
+    item = audio_analysis.build_catalog_item("-", "-", features)
+    values = {k: v for k, v in features.items() if k not in UNCHECKED_FEATURES}
+    values.update({f"catalog.{k}": item[k] for k in ("acousticness", "energy", "lofi", "genre")})
+    return json.loads(json.dumps(values, cls=audio_analysis.NumpyEncoder))
+
+
+def compare_outputs(actual, expected):
+    """
+    ゴールデン値との差分を [(特徴量名, 実際の値, 期待値), ...] で返す
+    """
+    mismatches = []
+    for key in sorted(set(actual) | set(expected)):
+        a, e = actual.get(key), expected.get(key)
+        numeric = all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) for v in (a, e)
+        )
+        if numeric:
+            rel, abs_tol = FEATURE_TOLERANCES.get(key.split(".")[-1], DEFAULT_TOLERANCE)
+            ok = abs(a - e) <= max(abs_tol, rel * abs(e))
+        else:
+            ok = a == e
+        if not ok:
+            mismatches.append((key, a, e))
+    return mismatches
+
+
+def measure(func, path, repeat, track_memory):
+    """
+    (最良の経過時間[秒], ピーク割り当て量[バイト], 戻り値) を返す。
+    tracemalloc は処理を遅くするので、時間とは別の実行で測る。
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(path)
+        best = min(best, time.perf_counter() - start)
+
+    peak = 0
+    if track_memory:
+        tracemalloc.start()
+        try:
+            func(path)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return best, peak, result
+
+
+def bench_regression(args):
+    """
+    合成フィクスチャで各関数の速度 (音声秒/秒) とピークメモリを測り、
+    特徴量をゴールデン値と照合する。不一致があれば終了コード 1。
+    """
+    names = args.fixtures or list(fixtures.FIXTURES)
+    functions = args.functions or list(REGRESSION_FUNCTIONS)
+
+    golden = {}
+    if os.path.exists(args.golden):
+        with open(args.golden, "r", encoding="utf-8") as f:
+            golden = json.load(f)
+
+    work_dir = args.fixtures_dir or tempfile.mkdtemp(prefix="regression_fixtures_")
+    failures = []
+    missing = []
+    timings = {name: [0.0, 0.0, 0] for name in functions}  # 時間, 音声秒, 最大ピーク
+    try:
+        paths = fixtures.write_fixtures(work_dir, names)
+        print(f"{'fixture':20s} {'function':28s} {'time s':>8s} {'x realtime':>10s} {'peak MB':>8s} {'check':>6s}")
+        for name in names:
+            _, _, duration, _ = fixtures.FIXTURES[name]
+            for func_name in functions:
+                elapsed, peak, result = measure(
+                    REGRESSION_FUNCTIONS[func_name], paths[name], args.repeat, not args.skip_memory
+                )
+                totals = timings[func_name]
+                totals[0] += elapsed
+                totals[1] += duration
+                totals[2] = max(totals[2], peak)
+
+                check = "-"
+                if func_name != "load_audio":
+                    outputs = regression_outputs(result)
+                    expected = golden.get(name, {}).get(func_name)
+                    if args.update_golden:
+                        golden.setdefault(name, {})[func_name] = outputs
+                        check = "saved"
+                    elif expected is None:
+                        missing.append((name, func_name))
+                        check = "none"
+                    else:
+                        mismatches = compare_outputs(outputs, expected)
+                        failures.extend((name, func_name) + m for m in mismatches)
+                        check = "FAIL" if mismatches else "ok"
+                print(
+                    f"{name:20s} {func_name:28s} {elapsed:8.3f} {duration / elapsed:10.1f} "
+                    f"{peak / 1e6:8.1f} {check:>6s}"
+                )
+    finally:
+        if not args.fixtures_dir:
+            shutil.rmtree(work_dir)
+
+    print()
+    print(f"{'function':28s} {'time s':>8s} {'x realtime':>10s} {'max peak MB':>11s}")
+    for func_name, (elapsed, audio_seconds, peak) in timings.items():
+        print(f"{func_name:28s} {elapsed:8.3f} {audio_seconds / max(elapsed, 1e-9):10.1f} {peak / 1e6:11.1f}")
+
+    if args.update_golden:
+        with open(args.golden, "w", encoding="utf-8") as f:
+            json.dump(golden, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\ngolden values written to {args.golden}")
+        return
+
+    print()
+    for name, func_name, key, actual, expected in failures:
+        print(f"MISMATCH {name} {func_name} {key}: {actual!r} (golden {expected!r})")
+    for name, func_name in missing:
+        print(f"NO GOLDEN {name} {func_name} (run with --update-golden)")
+    if failures or missing:
+        print(f"{len(failures)} mismatches, {len(missing)} missing")
+        sys.exit(1)
+    print("all outputs match golden values")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="audio_analysis benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("features", help="共有キャッシュ導入前後の extract_features の時間 (秒/音声1分)")
+    p.add_argument("--music-dir", default="./music")
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_features)
+
+    p = subparsers.add_parser("profiles", help="解析プロファイル間の速度と lofi / type 判定の一致率")
+    p.add_argument("--music-dir", default="./music")
+    p.set_defaults(func=bench_profiles)
+
+    p = subparsers.add_parser("catalog", help="JSON と列指向カタログの書き込み・読み込み・サイズ")
+    p.add_argument("--tracks", type=int, default=100_000)
+    p.set_defaults(func=bench_catalog)
+
+    p = subparsers.add_parser("tempo", help="beat_track と estimate_tempo / 一括テンポ推定の一致率と時間")
+    p.add_argument("--music-dir", default="./music")
+    p.add_argument("--tolerance-bpm", type=float, default=1.0)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_tempo)
+
+    p = subparsers.add_parser("preclassify", help="抜粋による音楽 / 環境音の事前判定の一致率・フォールバック率・短縮時間")
+    p.add_argument("--music-dir", default="./music")
+    p.add_argument("--all-fields", action="store_true", help="カタログ項目だけでなく全特徴量を計算して比べる")
+    p.set_defaults(func=bench_preclassify)
+
+    p = subparsers.add_parser("similarity", help="類似検索インデックス (exact / ivf) の構築・検索時間と再現率")
+    p.add_argument("--tracks", type=int, default=100_000)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    p.set_defaults(func=bench_similarity)
+
+    p = subparsers.add_parser("decode", help="librosa / pydub と audio_io の読み込み速度 (音声秒/秒) と出力の一致")
+    p.add_argument("--music-dir", default=None, help="計測する WAV のディレクトリ (省略時は合成フィクスチャ)")
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_decode)
+
+    p = subparsers.add_parser("transition", help="曲の切り替わりで出力が途切れる時間 (先読み・クロスフェードの有無)")
+    p.add_argument("--tracks", type=int, default=6)
+    p.add_argument("--track-seconds", type=float, default=10.0)
+    p.add_argument("--crossfade-ms", type=int, default=3000)
+    p.add_argument("--speed", type=float, default=20.0, help="出力が音声を消費する速さ (実時間の何倍か)")
+    p.set_defaults(func=bench_transition)
+
+    p = subparsers.add_parser("sessions", help="同時再生セッション数ごとのアンダーランと CPU 時間 (NullSink)")
+    p.add_argument("--sessions", type=int, nargs="+", default=[1, 50, 200])
+    p.add_argument("--tracks", type=int, default=6, help="使い回す曲の数")
+    p.add_argument("--tracks-per-session", type=int, default=3)
+    p.add_argument("--track-seconds", type=float, default=10.0)
+    p.add_argument("--crossfade-ms", type=int, default=2000)
+    p.add_argument("--speed", type=float, default=1.0, help="シンクが音声を消費する速さ (実時間の何倍か)")
+    p.set_defaults(func=bench_sessions)
+
+    p = subparsers.add_parser("regression", help="合成フィクスチャでの速度・ピークメモリとゴールデン値の照合")
+    p.add_argument("--golden", default=GOLDEN_PATH)
+    p.add_argument("--update-golden", action="store_true", help="照合せずに現在の出力をゴールデン値として保存する")
+    p.add_argument("--fixtures", nargs="+", choices=list(fixtures.FIXTURES), help="対象のフィクスチャ (省略時は全て)")
+    p.add_argument("--functions", nargs="+", choices=list(REGRESSION_FUNCTIONS), help="対象の関数 (省略時は全て)")
+    p.add_argument("--fixtures-dir", default=None, help="フィクスチャの書き出し先 (省略時は一時ディレクトリ)")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--skip-memory", action="store_true", help="ピークメモリの計測を省く")
+    p.set_defaults(func=bench_regression)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import os
+import re
+import json
+
+import numpy as np
+
+from catalog_store import CatalogTable
+
+
+# ==============================================
+# エージェント用のカタログ検索
+# ==============================================
+# カタログ (output.json または列指向カタログ) を起動時に1回だけ読み、数値・真偽値の列を
+# NumPy 配列に、文字列の項目を単語 -> 行番号の転置インデックスにしておく。
+# 検索は条件をまとめたマスクで絞り込み、テキストが一致した単語数の多い順に上位 k 件だけを返すので、
+# システムプロンプトに全曲を埋め込む必要がない。
+
+# テキスト検索の対象にする項目
+SEARCH_TEXT_FIELDS = ("title", "description", "genre", "instrumentation", "mood", "filename")
+
+# 検索結果として返す項目 (エージェントが曲を選び再生するのに必要なもの)
+RESULT_FIELDS = (
+    "id", "title", "genre", "mood", "duration_ms", "acousticness", "energy", "lofi", "filename"
+)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text).lower()) if text else []
+
+
+def _float_column(items, name):
+    return np.array([np.nan if item.get(name) is None else float(item[name]) for item in items])
+
+
+class CatalogSearch:
+    """
+    カタログの検索インデックス。
+
+        catalog = CatalogSearch.load("./output.json")      # 列指向カタログのディレクトリも可
+        catalog.search(text="piano", lofi=True, energy=(None, 0.1), k=5)
+        # -> {"total": 一致した曲数, "tracks": [{"id": ..., "filename": ...}, ...]}
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self._row_of = {item.get("id"): i for i, item in enumerate(items)}
+        self.duration_ms = _float_column(items, "duration_ms")
+        self.acousticness = _float_column(items, "acousticness")
+        self.energy = _float_column(items, "energy")
+        self.lofi = np.array([bool(item.get("lofi")) for item in items], dtype=bool)
+        genres = [str(item.get("genre") or "").lower() for item in items]
+        self.genres = sorted(set(genres))
+        codes = {g: i for i, g in enumerate(self.genres)}
+        self.genre_codes = np.array([codes[g] for g in genres], dtype=np.int32)
+
+        postings = {}
+        for i, item in enumerate(items):
+            for token in {t for field in SEARCH_TEXT_FIELDS for t in tokenize(item.get(field))}:
+                postings.setdefault(token, []).append(i)
+        self.postings = {token: np.array(rows, dtype=np.int64) for token, rows in postings.items()}
+
+    @classmethod
+    def load(cls, path):
+        """
+        path がディレクトリなら列指向カタログ、そうでなければ output.json として読む
+        """
+        if os.path.isdir(path):
+            return cls(CatalogTable(path).records())
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, track_id):
+        row = self._row_of.get(track_id)
+        return None if row is None else self.items[row]
+
+    def _token_rows(self, token):
+        rows = self.postings.get(token)
+        if rows is not None:
+            return rows
+        # 完全一致する単語が無ければ、その文字列を含む単語 ("noct" -> "nocturne") で探す
+        matches = [self.postings[t] for t in self.postings if token in t]
+        return np.unique(np.concatenate(matches)) if matches else np.zeros(0, dtype=np.int64)
+
+    def search(self, text=None, genre=None, lofi=None, energy=None, acousticness=None, duration_ms=None,
+               k=10, fields=RESULT_FIELDS):
+        """
+        条件に合う曲を k 件返す。
+        - text: 単語のどれかが SEARCH_TEXT_FIELDS に含まれる曲 (一致した単語の多い順)
+        - genre: ジャンル (大文字小文字は区別しない)、lofi: True / False
+        - energy / acousticness / duration_ms: (下限, 上限) のタプル (None は無制限)
+        """
+        mask = np.ones(len(self.items), dtype=bool)
+        if genre is not None:
+            genre = genre.lower()
+            if genre not in self.genres:
+                return {"total": 0, "tracks": []}
+            mask &= self.genre_codes == self.genres.index(genre)
+        if lofi is not None:
+            mask &= self.lofi == bool(lofi)
+        for column, bounds in ((self.energy, energy), (self.acousticness, acousticness),
+                               (self.duration_ms, duration_ms)):
+            if bounds is None:
+                continue
+            low, high = bounds
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+
+        score = np.zeros(len(self.items), dtype=np.float32)
+        tokens = tokenize(text)
+        if tokens:
+            for token in set(tokens):
+                score[self._token_rows(token)] += 1.0
+            mask &= score > 0
+
+        rows = np.flatnonzero(mask)
+        total = len(rows)
+        if tokens:
+            # 点数の高い順 (同点なら行順)
+            rows = rows[np.lexsort((rows, -score[rows]))]
+        rows = rows[:k]
+        tracks = [{name: self.items[i].get(name) for name in fields} for i in rows.tolist()]
+        return {"total": total, "tracks": tracks}
+
+    def summary(self):
+        """
+        システムプロンプトに載せるカタログの概要 (曲数・ジャンル・値の範囲)
+        """
+        def value_range(column):
+            valid = column[~np.isnan(column)]
+            return [float(valid.min()), float(valid.max())] if len(valid) else None
+
+        return {
+            "tracks": len(self.items),
+            "genres": self.genres,
+            "lofi_tracks": int(self.lofi.sum()),
+            "energy_range": value_range(self.energy),
+            "acousticness_range": value_range(self.acousticness),
+            "duration_ms_range": value_range(self.duration_ms),
+        }
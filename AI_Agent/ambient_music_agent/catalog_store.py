@@ -0,0 +1,241 @@
+import os
+import json
+import shutil
+
+import numpy as np
+
+
+# ==============================================
+# カタログの列指向バイナリ形式
+# ==============================================
+# catalog_dir/
+#     schema.json            列名 -> 種類 ("float" / "int" / "bool" / "string") と行数
+#     <列名>.npy             数値列・真偽値列、文字列列の場合は辞書コード (int32)
+#     <列名>.dict.bytes.npy  文字列列の辞書 (UTF-8 を連結した uint8)
+#     <列名>.dict.offsets.npy 辞書の各文字列の開始位置 (int64, 要素数+1)
+#
+# 各 .npy は np.load(mmap_mode="r") で開けるため、必要な列だけをメモリマップして
+# JSON 全体をパースせずに絞り込みができる。
+
+SCHEMA_FILENAME = "schema.json"
+
+
+def _column_kind(values):
+    kinds = set()
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, (bool, np.bool_)):
+            kinds.add("bool")
+        elif isinstance(v, (int, np.integer)):
+            kinds.add("int")
+        elif isinstance(v, (float, np.floating)):
+            kinds.add("float")
+        else:
+            kinds.add("string")
+    if "string" in kinds or not kinds:
+        return "string"
+    # None を含む整数・真偽値の列は NaN を表せるよう float にする
+    has_none = any(v is None for v in values)
+    if kinds == {"bool"} and not has_none:
+        return "bool"
+    if kinds <= {"bool", "int"} and not has_none:
+        return "int"
+    return "float"
+
+
+def _encode_strings(values):
+    """
+    文字列列を辞書エンコードし (codes, 辞書バイト列, オフセット) を返す。None はコード -1。
+    """
+    dictionary = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, v in enumerate(values):
+        if v is None:
+            codes[i] = -1
+            continue
+        v = str(v)
+        code = dictionary.get(v)
+        if code is None:
+            code = dictionary[v] = len(dictionary)
+        codes[i] = code
+    encoded = [s.encode("utf-8") for s in dictionary]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return codes, data, offsets
+
+
+def write_catalog_columnar(items, catalog_dir):
+    """
+    カタログ (dict のリスト) を列指向形式で catalog_dir に書き出す。
+    一時ディレクトリに書いてから置き換えるので、読み手が途中状態を見ることはない。
+    """
+    columns = []
+    for item in items:
+        for key in item:
+            if key not in columns:
+                columns.append(key)
+
+    tmp_dir = catalog_dir.rstrip(os.sep) + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    schema = {"rows": len(items), "columns": {}}
+    for name in columns:
+        values = [item.get(name) for item in items]
+        kind = _column_kind(values)
+        schema["columns"][name] = kind
+        path = os.path.join(tmp_dir, name)
+        if kind == "string":
+            codes, data, offsets = _encode_strings(values)
+            np.save(path + ".npy", codes)
+            np.save(path + ".dict.bytes.npy", data)
+            np.save(path + ".dict.offsets.npy", offsets)
+        elif kind == "bool":
+            np.save(path + ".npy", np.array(values, dtype=np.bool_))
+        elif kind == "int":
+            np.save(path + ".npy", np.array(values, dtype=np.int64))
+        else:
+            np.save(path + ".npy", np.array([np.nan if v is None else v for v in values], dtype=np.float64))
+
+    with open(os.path.join(tmp_dir, SCHEMA_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(schema, f, ensure_ascii=False, indent=2)
+
+    if os.path.exists(catalog_dir):
+        shutil.rmtree(catalog_dir)
+    os.replace(tmp_dir, catalog_dir)
+
+
+class StringColumn:
+    """
+    辞書エンコードされた文字列列。コードはメモリマップのまま持ち、必要な行だけ復号する。
+    """
+
+    def __init__(self, codes, data, offsets):
+        self.codes = codes
+        self._data = data
+        self._offsets = offsets
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def value(self, code):
+        if code < 0:
+            return None
+        start, stop = self._offsets[code], self._offsets[code + 1]
+        return bytes(self._data[start:stop]).decode("utf-8")
+
+    def dictionary(self):
+        """
+        辞書全体を復号した文字列のリスト (多数の行をまとめて読むとき用)
+        """
+        data = bytes(self._data)
+        offsets = self._offsets.tolist()
+        return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+    def code_of(self, value):
+        """
+        文字列に対応する辞書コード (無ければ None)。初回に辞書を引けるようにする。
+        """
+        if self._lookup is None:
+            self._lookup = {v: i for i, v in enumerate(self.dictionary())}
+        return self._lookup.get(value)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.value(int(self.codes[index]))
+        codes = np.asarray(self.codes[index])
+        if codes.size > len(self._offsets):
+            values = self.dictionary() + [None]
+            return [values[c] for c in codes.tolist()]
+        return [self.value(int(c)) for c in codes]
+
+    def equals(self, value):
+        code = self.code_of(value)
+        if code is None:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == code
+
+
+class CatalogTable:
+    """
+    write_catalog_columnar で書いたカタログを読む。列は最初に参照されたときにメモリマップする。
+
+        table = CatalogTable("./catalog")
+        rows = table.where(genre="music", lofi=True, energy=(0.05, 0.2))
+        table.records(rows)
+    """
+
+    def __init__(self, catalog_dir, mmap_mode="r"):
+        self.catalog_dir = catalog_dir
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(catalog_dir, SCHEMA_FILENAME), "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        self.num_rows = schema["rows"]
+        self.schema = schema["columns"]
+        self._columns = {}
+
+    def __len__(self):
+        return self.num_rows
+
+    def _load(self, filename):
+        return np.load(os.path.join(self.catalog_dir, filename), mmap_mode=self.mmap_mode)
+
+    def column(self, name):
+        if name not in self._columns:
+            if self.schema[name] == "string":
+                self._columns[name] = StringColumn(
+                    self._load(f"{name}.npy"),
+                    self._load(f"{name}.dict.bytes.npy"),
+                    self._load(f"{name}.dict.offsets.npy"),
+                )
+            else:
+                self._columns[name] = self._load(f"{name}.npy")
+        return self._columns[name]
+
+    def where(self, **conditions):
+        """
+        条件に合う行番号の配列を返す。
+        - 値を渡すと等しい行 (文字列列は辞書コードで比較)
+        - (下限, 上限) のタプルを渡すと範囲内 (None は無制限) の行
+        """
+        mask = np.ones(self.num_rows, dtype=bool)
+        for name, cond in conditions.items():
+            col = self.column(name)
+            if isinstance(cond, tuple):
+                low, high = cond
+                if low is not None:
+                    mask &= col >= low
+                if high is not None:
+                    mask &= col <= high
+            elif isinstance(col, StringColumn):
+                mask &= col.equals(cond)
+            else:
+                mask &= col == cond
+        return np.flatnonzero(mask)
+
+    def record(self, index):
+        return self.records([index])[0]
+
+    def records(self, indices=None):
+        """
+        指定した行 (省略時は全行) を dict のリストにして返す。列ごとにまとめて復号する。
+        """
+        if indices is None:
+            indices = np.arange(self.num_rows)
+        indices = np.asarray(indices, dtype=np.int64)
+        columns = {}
+        for name, kind in self.schema.items():
+            col = self.column(name)
+            if kind == "string":
+                columns[name] = col[indices]
+            elif kind == "float":
+                values = np.asarray(col[indices])
+                columns[name] = [None if v != v else v for v in values.tolist()]
+            else:
+                columns[name] = np.asarray(col[indices]).tolist()
+        names = list(columns)
+        return [dict(zip(names, row)) for row in zip(*(columns[n] for n in names))]
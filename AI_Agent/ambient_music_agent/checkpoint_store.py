@@ -0,0 +1,415 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+from langchain_core.messages import BaseMessage
+from langgraph.checkpoint.base import WRITES_IDX_MAP, BaseCheckpointSaver, CheckpointTuple, get_checkpoint_id
+
+
+# ==============================================
+# SQLite に保存する LangGraph のチェックポインタ
+# ==============================================
+# MemorySaver はプロセスのメモリにしか残らず、ステップごとに会話の全メッセージを保存する。
+# SqliteCheckpointSaver は
+#   - チェックポイント本体 (値を除く) と、そのステップで変わったチャンネルの値だけを保存する
+#   - メッセージのリストは各メッセージを内容ハッシュをキーに1回だけ保存し、チャンネルの値としては
+#     キーの並びだけを持つ (新しいステップで増えるのは追加されたメッセージとキーの並びだけ)
+#   - 値はすべて zlib で圧縮する
+#   - スレッドごとに直近 keep 個のチェックポイントだけを残し、参照されなくなった値とメッセージを消す
+# 最新のチェックポイントの復元は主キーの索引を引くだけなので、スレッド数や会話の長さによらない
+# (読むのは上限付きの履歴の分だけ)。
+#
+#   saver = SqliteCheckpointSaver("./checkpoints.sqlite")
+#   graph = graph_builder.compile(checkpointer=saver)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    key TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, key)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+# blobs.type の特別な値
+EMPTY = "empty"                 # チャンネルに値が無い
+MESSAGE_KEYS = "message_keys"   # メッセージのキーの並び (JSON)
+
+# SQLite の IN (...) に1回で渡すキーの数
+_IN_CHUNK = 500
+
+
+def _is_message_list(value):
+    return isinstance(value, list) and len(value) > 0 and all(isinstance(m, BaseMessage) for m in value)
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver):
+    """
+    - path: SQLite のファイル (":memory:" ならメモリ上)。最初に読み書きするときに (親ディレクトリごと) 作る
+    - keep: スレッドごとに残すチェックポイントの数
+    - prune_slack: 古いチェックポイントがこの数だけたまったらまとめて消す (毎ステップ消すより安い)
+    - keep_metadata_writes: metadata の "writes" (各ノードの出力。メッセージの複製になる) も保存するか
+    """
+
+    def __init__(self, path=":memory:", keep=4, prune_slack=4, compress_level=6, keep_metadata_writes=False,
+                 serde=None):
+        super().__init__(serde=serde)
+        self.path = path
+        self.keep = keep
+        self.prune_slack = max(prune_slack, 1)
+        self.compress_level = compress_level
+        self.keep_metadata_writes = keep_metadata_writes
+        self._conn = None
+        self.lock = threading.Lock()
+
+    @property
+    def conn(self):
+        """
+        SQLite の接続。最初に使うときに開いてスキーマを作る (self.lock を取ってから使う)。
+        import やグラフのコンパイルだけではファイルを作らない。
+        """
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if self.path != ":memory:" and directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------- 直列化 ----------
+    def _dumps(self, obj):
+        type_, data = self.serde.dumps_typed(obj)
+        return type_, zlib.compress(data, self.compress_level)
+
+    def _loads(self, type_, blob):
+        return self.serde.loads_typed((type_, zlib.decompress(blob)))
+
+    def _put_value(self, cur, thread_id, checkpoint_ns, channel, version, values):
+        if channel not in values:
+            row = (EMPTY, None)
+        elif _is_message_list(values[channel]):
+            keys = []
+            rows = []
+            for message in values[channel]:
+                type_, data = self.serde.dumps_typed(message)
+                key = hashlib.blake2b(type_.encode() + data, digest_size=16).hexdigest()
+                keys.append(key)
+                rows.append((thread_id, checkpoint_ns, key, type_, data))
+            # 前のステップまでに保存したメッセージは書かない (圧縮もしない)
+            existing = self._existing_keys(cur, thread_id, checkpoint_ns, keys)
+            cur.executemany(
+                "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?)",
+                [(t, ns, k, ty, zlib.compress(d, self.compress_level))
+                 for t, ns, k, ty, d in rows if k not in existing],
+            )
+            row = (MESSAGE_KEYS, zlib.compress(json.dumps(keys).encode(), self.compress_level))
+        else:
+            row = self._dumps(values[channel])
+        cur.execute(
+            "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+            (thread_id, checkpoint_ns, channel, str(version), *row),
+        )
+
+    def _existing_keys(self, cur, thread_id, checkpoint_ns, keys):
+        found = set()
+        for i in range(0, len(keys), _IN_CHUNK):
+            chunk = keys[i:i + _IN_CHUNK]
+            found.update(r[0] for r in cur.execute(
+                f"SELECT key FROM messages WHERE thread_id = ? AND checkpoint_ns = ? "
+                f"AND key IN ({','.join('?' * len(chunk))})",
+                (thread_id, checkpoint_ns, *chunk),
+            ))
+        return found
+
+    def _load_values(self, cur, thread_id, checkpoint_ns, versions):
+        values = {}
+        message_keys = {}
+        for channel, version in versions.items():
+            row = cur.execute(
+                "SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            ).fetchone()
+            if row is None or row[0] == EMPTY:
+                continue
+            if row[0] == MESSAGE_KEYS:
+                message_keys[channel] = json.loads(zlib.decompress(row[1]))
+            else:
+                values[channel] = self._loads(*row)
+        if message_keys:
+            keys = sorted({k for ks in message_keys.values() for k in ks})
+            messages = {}
+            for i in range(0, len(keys), _IN_CHUNK):
+                chunk = keys[i:i + _IN_CHUNK]
+                for key, type_, blob in cur.execute(
+                    f"SELECT key, type, blob FROM messages WHERE thread_id = ? AND checkpoint_ns = ? "
+                    f"AND key IN ({','.join('?' * len(chunk))})",
+                    (thread_id, checkpoint_ns, *chunk),
+                ):
+                    messages[key] = self._loads(type_, blob)
+            for channel, ks in message_keys.items():
+                values[channel] = [messages[k] for k in ks]
+        return values
+
+    # ---------- BaseCheckpointSaver ----------
+    def _tuple(self, cur, thread_id, checkpoint_ns, row):
+        checkpoint_id, parent_id, type_, checkpoint_blob, metadata_type, metadata_blob = row
+        checkpoint = self._loads(type_, checkpoint_blob)
+        checkpoint["channel_values"] = self._load_values(
+            cur, thread_id, checkpoint_ns, checkpoint["channel_versions"]
+        )
+        writes = cur.execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        parent_config = None
+        if parent_id:
+            parent_config = {"configurable": {
+                "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id,
+            }}
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id,
+            }},
+            checkpoint=checkpoint,
+            metadata=self._loads(metadata_type, metadata_blob),
+            parent_config=parent_config,
+            pending_writes=[(task_id, channel, self._loads(t, v)) for task_id, channel, t, v in writes],
+        )
+
+    _COLUMNS = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+
+    def get_tuple(self, config):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        with self.lock:
+            cur = self.conn.cursor()
+            if checkpoint_id:
+                row = cur.execute(
+                    f"SELECT {self._COLUMNS} FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                # チェックポイント ID は時刻順に並ぶので、最新は主キーの索引を逆にたどった先頭
+                row = cur.execute(
+                    f"SELECT {self._COLUMNS} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            if row is None:
+                return None
+            return self._tuple(cur, thread_id, checkpoint_ns, row)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        where, params = [], []
+        if config is not None:
+            configurable = config["configurable"]
+            where.append("thread_id = ?")
+            params.append(configurable["thread_id"])
+            if configurable.get("checkpoint_ns") is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(configurable["checkpoint_ns"])
+            if get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(get_checkpoint_id(config))
+        if before is not None:
+            where.append("checkpoint_id < ?")
+            params.append(get_checkpoint_id(before))
+        query = f"SELECT thread_id, checkpoint_ns, {self._COLUMNS} FROM checkpoints"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY checkpoint_id DESC"
+        if limit is not None and not filter:
+            query += f" LIMIT {int(limit)}"
+        with self.lock:
+            cur = self.conn.cursor()
+            rows = cur.execute(query, params).fetchall()
+            results = []
+            for thread_id, checkpoint_ns, *row in rows:
+                item = self._tuple(cur, thread_id, checkpoint_ns, row)
+                if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                results.append(item)
+                if limit is not None and len(results) >= limit:
+                    break
+        yield from results
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        stored = checkpoint.copy()
+        values = stored.pop("channel_values")
+        if not self.keep_metadata_writes and "writes" in metadata:
+            metadata = {k: v for k, v in metadata.items() if k != "writes"}
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                # 値を保存するのはこのステップで変わったチャンネルだけ
+                for channel, version in new_versions.items():
+                    self._put_value(cur, thread_id, checkpoint_ns, channel, version, values)
+                cur.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, checkpoint["id"], configurable.get("checkpoint_id"),
+                     *self._dumps(stored), *self._dumps(metadata)),
+                )
+                self._prune(cur, thread_id, checkpoint_ns)
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+        return {"configurable": {
+            "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"],
+        }}
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = configurable["checkpoint_id"]
+        # エラー・割り込みなどの特別な書き込みは上書き、通常の書き込みは最初のものを残す
+        verb = "INSERT OR REPLACE" if all(channel in WRITES_IDX_MAP for channel, _ in writes) else "INSERT OR IGNORE"
+        rows = [
+            (thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel,
+             *self._dumps(value))
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        with self.lock:
+            self.conn.executemany(f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    # ---------- 保持数の上限 ----------
+    def _prune(self, cur, thread_id, checkpoint_ns):
+        old = [r[0] for r in cur.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.keep),
+        )]
+        if len(old) < self.prune_slack:
+            return
+        key = (thread_id, checkpoint_ns)
+        cur.executemany(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            [(*key, checkpoint_id) for checkpoint_id in old],
+        )
+        cur.executemany(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            [(*key, checkpoint_id) for checkpoint_id in old],
+        )
+
+        # 残ったチェックポイントが参照する値とメッセージ以外を消す
+        referenced = set()
+        for type_, blob in cur.execute(
+            "SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?", key
+        ).fetchall():
+            referenced.update((c, str(v)) for c, v in self._loads(type_, blob)["channel_versions"].items())
+        unreferenced = []
+        message_keys = set()
+        for channel, version, type_, blob in cur.execute(
+            "SELECT channel, version, type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?", key
+        ).fetchall():
+            if (channel, version) not in referenced:
+                unreferenced.append((*key, channel, version))
+            elif type_ == MESSAGE_KEYS:
+                message_keys.update(json.loads(zlib.decompress(blob)))
+        cur.executemany(
+            "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+            unreferenced,
+        )
+        cur.executemany(
+            "DELETE FROM messages WHERE thread_id = ? AND checkpoint_ns = ? AND key = ?",
+            [(*key, k) for (k,) in cur.execute(
+                "SELECT key FROM messages WHERE thread_id = ? AND checkpoint_ns = ?", key
+            ).fetchall() if k not in message_keys],
+        )
+
+    def delete_thread(self, thread_id):
+        """
+        スレッドのチェックポイントをすべて消す (聞き手が履歴を消すよう求めたとき用)
+        """
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN")
+            for table in ("checkpoints", "blobs", "messages", "writes"):
+                cur.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            cur.execute("COMMIT")
+
+    async def adelete_thread(self, thread_id):
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def stats(self):
+        """
+        保存している行数とデータベースの大きさ (バイト)
+        """
+        with self.lock:
+            counts = {
+                table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("checkpoints", "blobs", "messages", "writes")
+            }
+            page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        counts["db_bytes"] = page_count * page_size
+        return counts
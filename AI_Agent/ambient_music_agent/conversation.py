@@ -0,0 +1,213 @@
+import json
+
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+from token_count import count_tokens
+
+
+# ==============================================
+# 会話履歴の上限管理
+# ==============================================
+# 会話の状態はチェックポイント (グラフの State) だけに持ち、システムプロンプトは State に入れず
+# LLM を呼ぶ直前に build_prompt で先頭に付ける。
+# ターンの始めに compact_history で履歴のトークン数を見て、予算を超えていれば
+#   1. 直近 KEEP_RECENT_TURNS ターンより古いツール結果を TOOL_RESULT_TOKENS 程度に切り詰め
+#   2. それでも超えていれば古いターンから削除し、その内容を要約 (summary) に1行ずつ追記する
+# 要約も SUMMARY_TOKEN_BUDGET を超えたら古い行から捨てるので、LLM に送る入力は
+# システムプロンプト + 要約 + 履歴予算 で頭打ちになる。
+
+# 履歴 (要約とシステムプロンプトを除く) のトークン数の上限
+HISTORY_TOKEN_BUDGET = 4000
+# このターン数までは削除・切り詰めをしない
+KEEP_RECENT_TURNS = 3
+# 古いターンのツール結果はこのトークン数程度に切り詰める
+TOOL_RESULT_TOKENS = 120
+# 要約のトークン数の上限
+SUMMARY_TOKEN_BUDGET = 600
+# 要約の1行に残す発話の文字数
+SUMMARY_LINE_CHARS = 80
+
+# 1メッセージあたりの役割・区切りの分
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_text(message):
+    content = message.content
+    if isinstance(content, str):
+        return content
+    # マルチパートの content はテキスト部分だけを数える
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+def message_tokens(message):
+    tokens = count_tokens(message_text(message)) + MESSAGE_OVERHEAD_TOKENS
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(call["name"]) + count_tokens(json.dumps(call["args"], ensure_ascii=False))
+    return tokens
+
+
+def split_turns(messages):
+    """
+    履歴を HumanMessage で始まるターンに分ける。ツール呼び出しとその結果は同じターンに入るので、
+    ターン単位で削除すれば tool_call_id の対応が崩れない。
+    """
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _clip(text, limit_tokens):
+    # トークン数はおおよそでよいので、文字数で比例配分して切る
+    tokens = count_tokens(text)
+    if tokens <= limit_tokens:
+        return None
+    keep = max(int(len(text) * limit_tokens / tokens), 0)
+    return f"{text[:keep]} …[省略: {len(text) - keep} 文字]"
+
+
+def _line(message):
+    text = " ".join(message_text(message).split())
+    if len(text) > SUMMARY_LINE_CHARS:
+        text = text[:SUMMARY_LINE_CHARS] + "…"
+    if isinstance(message, HumanMessage):
+        return f"ユーザー: {text}"
+    if isinstance(message, AIMessage):
+        calls = getattr(message, "tool_calls", None) or []
+        if calls:
+            return "ツール: " + ", ".join(
+                f"{c['name']}({json.dumps(c['args'], ensure_ascii=False)[:SUMMARY_LINE_CHARS]})" for c in calls
+            )
+        return f"アシスタント: {text}" if text else None
+    # ツール結果は呼び出しの行で十分なので要約に入れない
+    return None
+
+
+def extractive_summary(summary, removed):
+    """
+    削除したメッセージを1行ずつ要約に追記し、SUMMARY_TOKEN_BUDGET に収まるよう古い行から捨てる。
+    LLM を呼ばないので、要約のためにターンの時間やトークンは増えない。
+    """
+    lines = summary.splitlines() if summary else []
+    lines.extend(line for line in map(_line, removed) if line)
+    total = sum(count_tokens(line) + 1 for line in lines)
+    start = 0
+    while total > SUMMARY_TOKEN_BUDGET and start < len(lines):
+        total -= count_tokens(lines[start]) + 1
+        start += 1
+    return "\n".join(lines[start:])
+
+
+def compact_history(messages, summary="", budget=HISTORY_TOKEN_BUDGET, keep_turns=KEEP_RECENT_TURNS,
+                    summarize=extractive_summary):
+    """
+    履歴が budget を超えていれば縮める。
+    (State に渡す messages の更新 (RemoveMessage と切り詰めたツール結果), 新しい要約) を返す。
+    予算内なら ([], summary)。
+    """
+    if budget is None:
+        return [], summary
+    tokens = [message_tokens(m) for m in messages]
+    total = sum(tokens)
+    if total <= budget:
+        return [], summary
+
+    turns = split_turns(messages)
+    old = [m for turn in turns[:-keep_turns] for m in turn] if len(turns) > keep_turns else []
+    cost = dict(zip((id(m) for m in messages), tokens))
+
+    # 1. 古いツール結果の切り詰め
+    replaced = {}
+    for message in old:
+        if isinstance(message, ToolMessage):
+            clipped = _clip(message_text(message), TOOL_RESULT_TOKENS)
+            if clipped is not None:
+                replaced[message.id] = ToolMessage(
+                    content=clipped, id=message.id, tool_call_id=message.tool_call_id, name=message.name
+                )
+                total += message_tokens(replaced[message.id]) - cost[id(message)]
+
+    # 2. 古いターンの削除
+    removed = []
+    for turn in turns[:-keep_turns] if len(turns) > keep_turns else []:
+        if total <= budget:
+            break
+        for message in turn:
+            removed.append(message)
+            total -= message_tokens(replaced[message.id]) if message.id in replaced else cost[id(message)]
+
+    removed_ids = {m.id for m in removed}
+    updates = [RemoveMessage(id=m.id) for m in removed]
+    updates.extend(m for message_id, m in replaced.items() if message_id not in removed_ids)
+    if removed:
+        summary = summarize(summary, removed)
+    return updates, summary
+
+
+def build_prompt(system_prompt, summary, messages):
+    """
+    LLM に渡すメッセージ列 (システムプロンプト + 要約 + 履歴)
+    """
+    content = system_prompt
+    if summary:
+        content += f"\n【これまでの会話の要約 (古い順)】\n{summary}\n"
+    return [SystemMessage(content=content)] + list(messages)
+
+
+# ==============================================
+# チェックポイントの保持数の上限
+# ==============================================
+class BoundedMemorySaver(MemorySaver):
+    """
+    スレッドごとに直近 keep 個のチェックポイントだけを残す MemorySaver。
+    MemorySaver はグラフの各ステップのチェックポイントをすべて保持するため、
+    State を上限管理しても長い会話ではメモリが増え続ける。
+    公開 API に個別のチェックポイントを消す手段が無いので、MemorySaver (langgraph 0.2) の内部の
+    辞書を直接消す。前提にしている形 (変わったら tests/test_conversation.py が失敗する):
+    - storage[thread_id][checkpoint_ns][checkpoint_id] = (checkpoint, metadata, parent_checkpoint_id)
+      (checkpoint は serde.dumps_typed の結果)
+    - writes[(thread_id, checkpoint_ns, checkpoint_id)] = そのチェックポイントの書き込み
+    - blobs[(thread_id, checkpoint_ns, channel, version)] = チャンネルの値
+    """
+
+    def __init__(self, keep=4, **kwargs):
+        super().__init__(**kwargs)
+        self.keep = keep
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        self._prune(thread_id, checkpoint_ns)
+        return result
+
+    def delete_thread(self, thread_id):
+        """
+        スレッドのチェックポイントをすべて消す (聞き手が履歴を消すよう求めたとき用)
+        """
+        self.storage.pop(thread_id, None)
+        for key in [k for k in self.writes if k[0] == thread_id]:
+            del self.writes[key]
+        for key in [k for k in self.blobs if k[0] == thread_id]:
+            del self.blobs[key]
+
+    def _prune(self, thread_id, checkpoint_ns):
+        saved = self.storage[thread_id][checkpoint_ns]
+        if len(saved) <= self.keep:
+            return
+        # チェックポイント ID は時刻順に並ぶ
+        for checkpoint_id in sorted(saved)[:-self.keep]:
+            del saved[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        # 残ったチェックポイントから参照されていない値 (blob) を消す
+        referenced = set()
+        for checkpoint, _, _ in saved.values():
+            versions = self.serde.loads_typed(checkpoint)["channel_versions"]
+            referenced.update(versions.items())
+        for key in [k for k in self.blobs if k[0] == thread_id and k[1] == checkpoint_ns]:
+            if (key[2], key[3]) not in referenced:
+                del self.blobs[key]
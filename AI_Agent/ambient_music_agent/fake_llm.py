@@ -0,0 +1,158 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Any, Callable, List, Optional
+
+import pydantic
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# langchain_core 0.2 までのモデルは pydantic v1 (langchain_core.pydantic_v1)、0.3 からは pydantic v2。
+# モデルと違う版の Field / PrivateAttr を使うと既定値がそのまま属性になってしまう
+if issubclass(BaseChatModel, pydantic.BaseModel):
+    from pydantic import Field, PrivateAttr
+else:
+    from langchain_core.pydantic_v1 import Field, PrivateAttr
+
+
+# ==============================================
+# API を呼ばない決まった応答の LLM
+# ==============================================
+# グラフの実行そのものの時間を OpenAI などの応答時間と切り離して測るためのチャットモデル。
+# ユーザーの発話ごとに script (または route) が決めたツール呼び出しを返し、ツールの結果を受けたら
+# (またはツールを呼ばないターンなら) output_tokens 語の文章で応答する。
+# 応答までの時間は latency_ms + 出力トークン数 * token_ms で、stream では1語ずつ返す。
+# 同じ順序で呼べば毎回同じ応答 (ツール呼び出しの ID も) を返す。
+#
+#   llm = ScriptedChatModel(script=[[], [{"name": "music_status_tool", "args": {}}]], latency_ms=300)
+
+REPLY_WORD = "ambient"
+
+
+def _approx_tokens(message):
+    # 文字数 / 4 の概算 (token_counter を指定しなかったとき)
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    calls = getattr(message, "tool_calls", None) or []
+    return (len(content) + (len(json.dumps(calls)) if calls else 0)) // 4 + 4
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    - script: ターンごとのツール呼び出し ({"name", "args"} のリスト) の並び。ターン数が超えたら先頭に戻る
+    - route: 発話の文字列からツール呼び出しのリストを返す関数 (指定すれば script より優先)
+    - output_tokens: 文章で応答するときの語数 (usage_metadata の出力トークン数)
+    - latency_ms: 1呼び出しの最初のトークンまでの時間
+    - token_ms: 出力1トークンあたりの時間
+    - token_counter: メッセージ1つのトークン数を返す関数 (既定は文字数 / 4 の概算)
+    呼び出しごとの入力トークン数は input_tokens に残る。
+    """
+
+    script: List[List[dict]] = Field(default_factory=list)
+    route: Optional[Callable[[str], List[dict]]] = None
+    output_tokens: int = 40
+    latency_ms: float = 0.0
+    token_ms: float = 0.0
+    token_counter: Optional[Callable[[Any], int]] = None
+
+    _turns: Any = PrivateAttr(default_factory=itertools.count)
+    _call_ids: Any = PrivateAttr(default_factory=lambda: itertools.count(1))
+    _input_tokens: list = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def from_env(cls, prefix, **kwargs):
+        """
+        環境変数 {prefix}_SCRIPT (JSON) / {prefix}_LATENCY_MS / {prefix}_TOKEN_MS / {prefix}_OUTPUT_TOKENS から作る
+        (それ以外の引数は kwargs で渡す)
+        """
+        script = os.environ.get(f"{prefix}_SCRIPT")
+        return cls(
+            script=json.loads(script) if script else [],
+            latency_ms=float(os.environ.get(f"{prefix}_LATENCY_MS", 0)),
+            token_ms=float(os.environ.get(f"{prefix}_TOKEN_MS", 0)),
+            output_tokens=int(os.environ.get(f"{prefix}_OUTPUT_TOKENS", 40)),
+            **kwargs,
+        )
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    @property
+    def input_tokens(self):
+        return self._input_tokens
+
+    def bind_tools(self, tools, **kwargs):
+        # ツールの定義は使わない (呼び出しは script が決める)
+        return self
+
+    def _message(self, messages):
+        tokens = sum((self.token_counter or _approx_tokens)(m) for m in messages)
+        self._input_tokens.append(tokens)
+        calls = []
+        if isinstance(messages[-1], HumanMessage):
+            turn = next(self._turns)
+            if self.route is not None:
+                calls = self.route(messages[-1].content)
+            elif self.script:
+                calls = self.script[turn % len(self.script)]
+        calls = [dict(call, id=f"call_{next(self._call_ids)}") for call in calls]
+        output = len(json.dumps(calls)) // 4 if calls else self.output_tokens
+        usage = {"input_tokens": tokens, "output_tokens": output, "total_tokens": tokens + output}
+        if calls:
+            return AIMessage(content="", tool_calls=calls, usage_metadata=usage)
+        return AIMessage(content=" ".join([REPLY_WORD] * self.output_tokens), usage_metadata=usage)
+
+    def _seconds(self, message):
+        return (self.latency_ms + message.usage_metadata["output_tokens"] * self.token_ms) / 1000.0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._message(messages)
+        time.sleep(self._seconds(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._message(messages)
+        await asyncio.sleep(self._seconds(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, message):
+        if message.tool_calls:
+            yield AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": i}
+                    for i, c in enumerate(message.tool_calls)
+                ],
+                usage_metadata=message.usage_metadata,
+            )
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            yield AIMessageChunk(
+                content=word if i == 0 else " " + word,
+                usage_metadata=message.usage_metadata if i == len(words) - 1 else None,
+            )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._message(messages)
+        # ツール呼び出しは最後にまとめて1チャンクで返す
+        time.sleep(self._seconds(message) if message.tool_calls else self.latency_ms / 1000.0)
+        for i, chunk in enumerate(self._chunks(message)):
+            if i:
+                time.sleep(self.token_ms / 1000.0)
+            if run_manager and chunk.content:
+                run_manager.on_llm_new_token(chunk.content)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._message(messages)
+        await asyncio.sleep(self._seconds(message) if message.tool_calls else self.latency_ms / 1000.0)
+        for i, chunk in enumerate(self._chunks(message)):
+            if i:
+                await asyncio.sleep(self.token_ms / 1000.0)
+            if run_manager and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content)
+            yield ChatGenerationChunk(message=chunk)
@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+
+
+# ==============================================
+# ファイル内容ハッシュをキーにした特徴量キャッシュ
+# ==============================================
+def file_content_hash(path, chunk_size=1 << 20):
+    """
+    ファイル内容の BLAKE2b ハッシュ (16進) を返す。大きなWAVでも少しずつ読む。
+    """
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FeatureStore:
+    """
+    解析済み特徴量をディスクに保存し、再インデックス時に未変更ファイルの解析を省く。
+
+    cache_dir/
+        index.json              ファイル名 -> {hash, size, mtime_ns, track_id} と採番状態
+        features/ab/abcd....json 内容ハッシュ + 解析バージョンごとのエントリ (JSON オブジェクト)
+
+    - サイズと更新時刻が前回と同じファイルはハッシュ計算も省く
+    - 解析バージョンが変わると別キーになるため、古い特徴量は自動的に使われなくなる
+    - エントリの中身 (解析方式ごとの特徴量など) は呼び出し側が決める。
+      実行時のオプションはキーに含めないので、オプションを変えてもキャッシュは消えない
+    - トラックIDはファイル名ごとに一度だけ採番し、以後の実行でも変わらない
+    """
+
+    INDEX_FILENAME = "index.json"
+
+    def __init__(self, cache_dir, analysis_version):
+        self.cache_dir = cache_dir
+        self.analysis_version = str(analysis_version)
+        self.features_dir = os.path.join(cache_dir, "features")
+        os.makedirs(self.features_dir, exist_ok=True)
+
+        self.index_path = os.path.join(cache_dir, self.INDEX_FILENAME)
+        self.files = {}
+        self.next_track_number = 1
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.next_track_number = data.get("next_track_number", 1)
+
+    # ---------- キー計算 ----------
+    def content_key(self, filename, path):
+        """
+        ファイルの内容キーを返す。stat が前回と一致すれば保存済みのハッシュを再利用する。
+        """
+        st = os.stat(path)
+        entry = self.files.get(filename)
+        if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+            content_hash = entry["hash"]
+        else:
+            content_hash = file_content_hash(path)
+        entry = self.files.setdefault(filename, {})
+        entry.update({"hash": content_hash, "size": st.st_size, "mtime_ns": st.st_mtime_ns})
+        return f"{content_hash}-v{self.analysis_version}"
+
+    def _feature_path(self, key):
+        return os.path.join(self.features_dir, key[:2], f"{key}.json")
+
+    # ---------- 特徴量の読み書き ----------
+    def get(self, key):
+        path = self._feature_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def put(self, key, entry, encoder=None):
+        path = self._feature_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, cls=encoder)
+        os.replace(tmp_path, path)
+
+    # ---------- トラックID ----------
+    def track_id(self, filename):
+        """
+        ファイル名に対応する安定したトラックIDを返す (未採番なら新しく振る)
+        """
+        entry = self.files.setdefault(filename, {})
+        if "track_id" not in entry:
+            entry["track_id"] = f"track-{self.next_track_number:03d}"
+            self.next_track_number += 1
+        return entry["track_id"]
+
+    # ---------- 掃除と保存 ----------
+    def evict_missing(self, present_filenames):
+        """
+        ディスクから消えたファイルのエントリと、その内容 (消えたファイル・内容が変わる前のファイル)
+        の特徴量を削除する。今あるファイルの特徴量は解析バージョンが違っても消さない。
+        消えたファイルのトラックIDは再利用しない。削除したファイル名のリストを返す。
+        """
+        present = set(present_filenames)
+        removed = [name for name in self.files if name not in present]
+        for name in removed:
+            del self.files[name]
+
+        live_hashes = {entry["hash"] for entry in self.files.values() if "hash" in entry}
+        for root, _, names in os.walk(self.features_dir):
+            for name in names:
+                # キーは "<内容ハッシュ>-v<解析バージョン>"
+                if name.endswith(".json") and name.split("-", 1)[0] not in live_hashes:
+                    os.remove(os.path.join(root, name))
+        return removed
+
+    def save(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"next_track_number": self.next_track_number, "files": self.files},
+                f, ensure_ascii=False, indent=2
+            )
+        os.replace(tmp_path, self.index_path)
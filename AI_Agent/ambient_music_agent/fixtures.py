@@ -0,0 +1,164 @@
+"""
+回帰ベンチマーク用の合成音声フィクスチャ
+
+乱数は名前ごとに固定したシードの np.random.default_rng から作るので、
+同じ環境なら毎回ビット単位で同じ WAV (16bit PCM) が生成される。
+
+使い方:
+    python fixtures.py --output-dir ./fixtures
+"""
+import argparse
+import os
+
+import numpy as np
+import soundfile as sf
+
+
+# ==============================================
+# 信号の生成
+# ==============================================
+def _time_axis(sr, duration):
+    return np.arange(int(round(sr * duration))) / sr
+
+
+def tone(sr, duration, freqs=(220.0, 277.2, 329.6), seed=0):
+    """
+    和音の持続音。ゆっくりした音量の揺れ (0.1 Hz) を付ける。
+    """
+    t = _time_axis(sr, duration)
+    y = sum(np.sin(2 * np.pi * f * t) for f in freqs) / len(freqs)
+    y *= 0.6 + 0.4 * np.sin(2 * np.pi * 0.1 * t)
+    return 0.5 * y
+
+
+def click_track(sr, duration, bpm=120.0, seed=0):
+    """
+    既知の BPM で鳴るクリック (減衰するノイズバースト + 1 kHz)
+    """
+    n = int(round(sr * duration))
+    y = np.zeros(n)
+    rng = np.random.default_rng(seed)
+    click_len = int(0.03 * sr)
+    envelope = np.exp(-np.arange(click_len) / (0.005 * sr))
+    click = envelope * (
+        0.5 * rng.standard_normal(click_len) + np.sin(2 * np.pi * 1000.0 * np.arange(click_len) / sr)
+    )
+    period = 60.0 / bpm
+    for start in np.arange(0.0, duration, period):
+        i = int(round(start * sr))
+        stop = min(i + click_len, n)
+        y[i:stop] += click[:stop - i]
+    return 0.8 * y / max(np.abs(y).max(), 1e-9)
+
+
+def pink_noise(sr, duration, seed=0):
+    """
+    1/f ノイズ (白色ノイズのスペクトルを 1/sqrt(f) で整形)
+    """
+    n = int(round(sr * duration))
+    rng = np.random.default_rng(seed)
+    spectrum = np.fft.rfft(rng.standard_normal(n))
+    freqs = np.fft.rfftfreq(n, 1.0 / sr)
+    freqs[0] = freqs[1]
+    y = np.fft.irfft(spectrum / np.sqrt(freqs), n)
+    return 0.3 * y / np.abs(y).max()
+
+
+def rain(sr, duration, seed=0, drops_per_second=40.0):
+    """
+    雨音風のノイズ: 弱いピンクノイズの上に、ランダムな時刻の短い高域バースト (雨粒) を重ねる
+    """
+    n = int(round(sr * duration))
+    rng = np.random.default_rng(seed)
+    y = 0.3 * pink_noise(sr, duration, seed=seed + 1)
+
+    n_drops = rng.poisson(drops_per_second * duration)
+    drop_len = int(0.01 * sr)
+    decay = np.exp(-np.arange(drop_len) / (0.002 * sr))
+    # 高域寄りにするため差分をとった白色ノイズを使う
+    for start, gain in zip(rng.integers(0, n, n_drops), rng.uniform(0.05, 0.4, n_drops)):
+        burst = np.diff(rng.standard_normal(drop_len + 1)) * decay * gain
+        stop = min(start + drop_len, n)
+        y[start:stop] += burst[:stop - start]
+    return 0.5 * y / np.abs(y).max()
+
+
+def mixed(sr, duration, seed=0, bpm=90.0):
+    """
+    クリック + 和音 + 雨音を重ねた素材 (音楽 / 環境音の境界付近の例)
+    """
+    y = (
+        0.5 * click_track(sr, duration, bpm=bpm, seed=seed)
+        + 0.3 * tone(sr, duration, freqs=(196.0, 246.9, 293.7))
+        + 0.4 * rain(sr, duration, seed=seed + 2)
+    )
+    return 0.8 * y / np.abs(y).max()
+
+
+GENERATORS = {
+    "tone": tone,
+    "click": click_track,
+    "pink": pink_noise,
+    "rain": rain,
+    "mixed": mixed,
+}
+
+
+# ==============================================
+# フィクスチャ一覧
+# ==============================================
+# name -> (生成関数名, サンプリングレート, 秒数, 追加引数)
+FIXTURES = {
+    "tone_22k_10s": ("tone", 22050, 10.0, {}),
+    "tone_48k_45s": ("tone", 48000, 45.0, {}),
+    "click60_44k_20s": ("click", 44100, 20.0, {"bpm": 60.0}),
+    "click120_22k_30s": ("click", 22050, 30.0, {"bpm": 120.0}),
+    "click150_48k_10s": ("click", 48000, 10.0, {"bpm": 150.0}),
+    "pink_44k_30s": ("pink", 44100, 30.0, {}),
+    "pink_16k_90s": ("pink", 16000, 90.0, {}),
+    "rain_44k_30s": ("rain", 44100, 30.0, {}),
+    "rain_22k_120s": ("rain", 22050, 120.0, {"drops_per_second": 15.0}),
+    "mixed_44k_30s": ("mixed", 44100, 30.0, {}),
+    "mixed_48k_75s": ("mixed", 48000, 75.0, {"bpm": 72.0}),
+}
+
+
+def generate(name):
+    """
+    フィクスチャ名から (y, sr) を作る。シードは名前から決まる。
+    """
+    kind, sr, duration, options = FIXTURES[name]
+    seed = sum(name.encode("utf-8"))
+    generator = GENERATORS[kind]
+    if kind == "tone":
+        y = generator(sr, duration, **options)
+    else:
+        y = generator(sr, duration, seed=seed, **options)
+    return y.astype(np.float32), sr
+
+
+def write_fixtures(output_dir, names=None):
+    """
+    フィクスチャを output_dir/<name>.wav に書き出し、{name: path} を返す
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    for name in names or FIXTURES:
+        y, sr = generate(name)
+        path = os.path.join(output_dir, f"{name}.wav")
+        sf.write(path, y, sr, subtype="PCM_16")
+        paths[name] = path
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic audio fixtures")
+    parser.add_argument("--output-dir", default="./fixtures")
+    args = parser.parse_args()
+    for name, path in write_fixtures(args.output_dir).items():
+        kind, sr, duration, _ = FIXTURES[name]
+        print(f"{path}  ({kind}, {sr} Hz, {duration:.0f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,530 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import audio_io
+import audio_sink
+
+
+# ==============================================
+# WAV の区間再生
+# ==============================================
+# WAV はヘッダから PCM の位置を求めてメモリマップし、指定区間だけを小さなブロックに分けて
+# 出力先のシンク (既定は PyAudio の出力デバイス) へ順に書き込む。ファイル全体を読み込まないので、再生開始までの
+# 時間とメモリは区間 (実際にはブロック) の大きさにしか比例しない。
+# WAV 以外の形式は指定区間だけを audio_io.load でデコードして 16bit にする。
+
+# 出力 (audio_sink のシンク) に1回で書き込む長さ
+BLOCK_MS = 100
+
+# 次の曲として先読みしておく先頭の長さ
+PREBUFFER_MS = 5000
+
+
+class Segment:
+    """
+    再生する区間。format は (サンプリングレート, チャンネル数, サンプル幅) で、
+    pcm() / blocks() が出力デバイスにそのまま書ける整数 PCM (frames, channels) を返す。
+    フレーム番号は区間の先頭を 0 とする。
+    """
+
+    def __init__(self, path, start_ms=0, end_ms=60000):
+        self.path = path
+        self.start_ms = max(start_ms, 0)
+        self.end_ms = end_ms
+        self.wav = audio_io.open_wav(path)
+        self._pcm = None
+        self._head = None
+        if self.wav is not None:
+            self.end_ms = min(end_ms, int(self.wav.duration * 1000))
+            self.format = (self.wav.sr, self.wav.channels, self.wav.playable_sample_width)
+            self._first = self.wav.ms_to_frame(self.start_ms)
+            self.n_frames = max(self.wav.ms_to_frame(self.end_ms) - self._first, 0)
+        else:
+            self.format = None
+            self.n_frames = None
+
+    def _decode(self):
+        # WAV 以外は区間だけをデコードして 16bit にする (最初に必要になったときに1回だけ)
+        if self._pcm is None:
+            y, sr = audio_io.load(
+                self.path, sr=None, offset=self.start_ms / 1000.0,
+                duration=max(self.end_ms - self.start_ms, 0) / 1000.0, mono=False
+            )
+            y = np.atleast_2d(y).T
+            self._pcm = (np.clip(y, -1.0, 1.0) * 32767.0).astype("<i2")
+            self.format = (sr, y.shape[1], 2)
+            self.n_frames = len(self._pcm)
+            self.end_ms = self.start_ms + len(y) * 1000 // sr
+        return self._pcm
+
+    def prepare(self):
+        """
+        フォーマットと長さを確定させる (WAV 以外はここでデコードする)
+        """
+        if self.wav is None:
+            self._decode()
+        return self
+
+    def preload(self, ms=PREBUFFER_MS):
+        """
+        先頭 ms ミリ秒をメモリに読み込んでおく (次の曲の先読み)。WAV 以外は区間全体をデコードする。
+        """
+        self.prepare()
+        if self.wav is not None and self._head is None:
+            n = min(self.format[0] * ms // 1000, self.n_frames)
+            self._head = np.array(self.wav.playable(self._first, self._first + n))
+        return self
+
+    def pcm(self, start, stop):
+        stop = min(stop, self.n_frames)
+        if self.wav is None:
+            return self._decode()[start:stop]
+        if self._head is not None and stop <= len(self._head):
+            return self._head[start:stop]
+        return self.wav.playable(self._first + start, self._first + stop)
+
+    def blocks(self, block_ms=BLOCK_MS):
+        self.prepare()
+        block_frames = max(int(self.format[0] * block_ms / 1000), 1)
+        for i in range(0, self.n_frames, block_frames):
+            yield self.pcm(i, i + block_frames)
+
+
+def pcm_to_float(pcm, sample_width):
+    """
+    再生用の整数 PCM を float32 (-1..1) にする
+    """
+    if sample_width == 3:
+        b = pcm.reshape(len(pcm), -1, 3).astype(np.int32)
+        x = (b[..., 0] << 8) | (b[..., 1] << 16) | (b[..., 2] << 24)
+        return (x / float(1 << 31)).astype(np.float32)
+    y = pcm.astype(np.float32)
+    if sample_width == 1:
+        return (y - 128.0) / 128.0
+    return y / float(1 << (8 * sample_width - 1))
+
+
+def float_to_pcm(y, sample_width):
+    """
+    pcm_to_float の逆変換 (範囲外は切り詰める)
+    """
+    scale = float(1 << (8 * sample_width - 1))
+    x = np.clip(np.rint(y * scale), -scale, scale - 1)
+    if sample_width == 1:
+        return (x + 128.0).astype(np.uint8)
+    if sample_width == 3:
+        x = x.astype("<i4").view(np.uint8).reshape(len(y), -1, 4)[..., :3]
+        return np.ascontiguousarray(x).reshape(len(y), -1)
+    return x.astype({2: "<i2", 4: "<i4"}[sample_width])
+
+
+def equal_power_crossfade(a, b, t, sample_width):
+    """
+    a (前の曲) と b (次の曲) を等パワーで重ねる。t はフェード内の位置 (0..1, フレームごと)。
+    cos / sin の重みの二乗和が 1 なので、相関のない2曲を重ねても音量が落ち込まない。
+    """
+    angle = (t * (np.pi / 2)).astype(np.float32)[:, np.newaxis]
+    y = pcm_to_float(a, sample_width) * np.cos(angle) + pcm_to_float(b, sample_width) * np.sin(angle)
+    return float_to_pcm(y, sample_width)
+
+
+def silence(fmt, frames):
+    """
+    fmt の無音 (8bit PCM は符号なしなので 128)
+    """
+    sr, channels, sample_width = fmt
+    if sample_width == 3:
+        return np.zeros((frames, channels * 3), dtype=np.uint8)
+    dtype = {1: "u1", 2: "<i2", 4: "<i4"}[sample_width]
+    return np.full((frames, channels), 128 if sample_width == 1 else 0, dtype=dtype)
+
+
+def segment_bounds(path, start_ms, end_ms):
+    """
+    ファイルの長さに合わせた (開始ミリ秒, 終了ミリ秒) を返す。WAV 以外は区間をデコードして確かめる。
+    """
+    segment = Segment(path, start_ms, end_ms).prepare()
+    return segment.start_ms, segment.end_ms
+
+
+def play_segment(path, start_ms=0, end_ms=60000, block_ms=BLOCK_MS, sink=None):
+    """
+    path の start_ms から end_ms までを sink (既定は音声デバイス) で再生し、再生が終わるまで待つ。
+    実際に再生した (開始ミリ秒, 終了ミリ秒) を返す。
+    """
+    segment = Segment(path, start_ms, end_ms)
+    sink = sink or audio_sink.DeviceSink()
+    try:
+        for block in segment.blocks(block_ms):
+            sink.write(block, segment.format)
+    finally:
+        sink.close()
+    return segment.start_ms, segment.end_ms
+
+
+# ==============================================
+# バックグラウンド再生エンジン
+# ==============================================
+# 再生は専用スレッドが行い、エージェント側 (ツール) はキューへの追加・停止・スキップ・
+# 状態確認をすぐに返す操作として呼ぶ。停止とスキップはブロック (BLOCK_MS) 単位で反映される。
+# 曲間の待ち時間は sleep ではなく同じ出力ストリームに無音を書き込むので、
+# 指定したギャップ以上の途切れは入らない。
+#
+# 曲間の処理:
+#   - 再生中に次の曲の先頭 (PREBUFFER_MS) を別スレッドで先読みしておくので、
+#     曲の切り替わりでファイルを開いたりデコードしたりする待ちが出ない
+#   - crossfade_ms > 0 で次の曲とフォーマットが同じなら、曲の終わりと次の曲の始まりを
+#     等パワーで重ねる (待ち時間の無音は入れない)。フォーマットが違えば gap_ms の無音を入れる
+#   - キューの最後の曲の後には無音を入れない (曲を書き終えた時点でキューが空なら最後の曲とみなす)
+
+class QueuedTrack:
+    __slots__ = ("track_id", "segment", "gap_ms", "crossfade_ms", "prefetched")
+
+    def __init__(self, track_id, segment, gap_ms, crossfade_ms=0):
+        self.track_id = track_id
+        self.segment = segment
+        self.gap_ms = gap_ms
+        self.crossfade_ms = crossfade_ms
+        self.prefetched = None
+
+    def to_dict(self):
+        return {
+            "track_id": self.track_id,
+            "start_ms": self.segment.start_ms,
+            "end_ms": self.segment.end_ms,
+            "gap_ms": self.gap_ms,
+            "crossfade_ms": self.crossfade_ms,
+        }
+
+
+class PlaybackEngine:
+    """
+    キューに入れた曲を順に再生するエンジン。
+
+        engine = PlaybackEngine(crossfade_ms=3000)   # 負荷試験なら sink_factory=audio_sink.NullSink
+        engine.enqueue("rain.wav", "./music/rain.wav", 0, 60000, gap_ms=1000)
+        engine.status()    # {"state": "playing", "current": {...}, "position_ms": ..., "queue": [...]}
+        engine.skip()      # 今の曲を止めて次の曲へ
+        engine.stop()      # 今の曲を止めてキューを空にする
+
+    - sink_factory: 出力先のシンクを作る関数 (再生スレッドの中で1回呼ぶ)
+    - crossfade_ms: enqueue で指定しなかった曲の、次の曲へのクロスフェードの長さ (0 なら無音を挟む)
+    - prebuffer_ms: 次の曲を先読みする長さ (0 なら先読みしない)
+    - on_event: 再生の進み具合を受け取る関数。再生スレッドから dict で呼ばれる
+        {"event": "now_playing", "track_id": ..., ...} 曲の再生を始めた
+        {"event": "track_finished", "track_id": ..., "completed": bool, ...}
+        {"event": "queue_finished"} キューの曲をすべて再生し終えた
+        {"event": "playback_error", "track_id": ..., "error": "..."}
+    """
+
+    def __init__(self, sink_factory=audio_sink.DeviceSink, block_ms=BLOCK_MS, crossfade_ms=0,
+                 prebuffer_ms=PREBUFFER_MS, on_event=None):
+        self.sink_factory = sink_factory
+        self.on_event = on_event
+        self.sink = None
+        self.block_ms = block_ms
+        self.crossfade_ms = crossfade_ms
+        self.prebuffer_ms = prebuffer_ms
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._closed = False
+        # 再生中の曲を止めるときに進める番号 (スキップ・停止)
+        self._interrupt = 0
+        # クロスフェードで再生を始めた次の曲 (曲, 出力済みフレーム数)
+        self._handoff = None
+        self.state = "idle"
+        self.current = None
+        self.position_ms = 0
+        self.played = []
+
+    def _emit(self, event, **fields):
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(dict(fields, event=event))
+        except Exception as e:
+            # 受け取り側の不具合で再生を止めない
+            print(f"[PlaybackEngine] イベント {event} の通知に失敗しました: {e}")
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._worker, name="playback", daemon=True)
+            self._thread.start()
+
+    def _prefetch(self, track):
+        # 呼び出し側で self._cond を持っていること
+        if self.prebuffer_ms and track.prefetched is None:
+            track.prefetched = self._prefetcher.submit(track.segment.preload, self.prebuffer_ms)
+
+    def enqueue(self, track_id, path, start_ms=0, end_ms=60000, gap_ms=1000, crossfade_ms=None):
+        """
+        曲をキューの末尾に追加し、再生待ちの曲数 (この曲を含む) を返す
+        """
+        if crossfade_ms is None:
+            crossfade_ms = self.crossfade_ms
+        track = QueuedTrack(track_id, Segment(path, start_ms, end_ms), gap_ms, crossfade_ms)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("playback engine is closed")
+            self._queue.append(track)
+            # 再生中の曲の次になる曲なら先読みを始める
+            if len(self._queue) == 1 and self.current is not None:
+                self._prefetch(track)
+            self._ensure_thread()
+            self._cond.notify_all()
+            return len(self._queue)
+
+    def skip(self):
+        """
+        再生中の曲 (曲間の待ち時間を含む) を止めて次の曲へ進む。止めた曲の dict か None を返す。
+        クロスフェード中なら次の曲をそのまま続ける。
+        """
+        with self._cond:
+            current = self.current
+            if current is not None:
+                self._interrupt += 1
+                self._cond.notify_all()
+            return current.to_dict() if current else None
+
+    def stop(self):
+        """
+        再生中の曲を止めてキューを空にする。取り消した曲数を返す。
+        """
+        with self._cond:
+            cancelled = len(self._queue)
+            self._queue.clear()
+            if self._handoff is not None:
+                self._handoff = None
+                cancelled += 1
+            if self.current is not None:
+                self._interrupt += 1
+                cancelled += 1
+            self._cond.notify_all()
+            return cancelled
+
+    def status(self):
+        with self._cond:
+            return {
+                "state": self.state,
+                "current": self.current.to_dict() if self.current else None,
+                "position_ms": self.position_ms,
+                "queue": [track.to_dict() for track in self._queue],
+                "played": len(self.played),
+                "sink": self.sink.stats() if self.sink is not None else None,
+            }
+
+    def wait_idle(self, timeout=None):
+        """
+        キューが空になり再生が終わるまで待つ。timeout 内に終われば True。
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self.current is None and self._handoff is None and not self._queue, timeout
+            )
+
+    def close(self):
+        self.stop()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self._prefetcher.shutdown(wait=True)
+
+    def _worker(self):
+        output = self.sink = self.sink_factory()
+        try:
+            while True:
+                with self._cond:
+                    if not (self._handoff or self._queue):
+                        output.idle()
+                    self._cond.wait_for(lambda: self._handoff or self._queue or self._closed)
+                    if self._closed:
+                        return
+                    if self._handoff is not None:
+                        track, start_frame = self._handoff
+                        self._handoff = None
+                    else:
+                        track, start_frame = self._queue.popleft(), 0
+                    self.current = track
+                    self.position_ms = track.segment.start_ms
+                    self.state = "playing"
+                    interrupt = self._interrupt
+                    if self._queue:
+                        self._prefetch(self._queue[0])
+                self._emit("now_playing", **track.to_dict())
+                try:
+                    completed = self._play(output, track, interrupt, start_frame)
+                    output.flush()
+                except Exception as e:
+                    print(f"[PlaybackEngine] {track.track_id} の再生中にエラーが発生しました: {e}")
+                    self._emit("playback_error", track_id=track.track_id, error=str(e))
+                    completed = False
+                with self._cond:
+                    self.played.append(dict(track.to_dict(), completed=completed))
+                    self.current = None
+                    self.state = "idle"
+                    finished = not (self._handoff or self._queue)
+                    self._cond.notify_all()
+                self._emit("track_finished", completed=completed, **track.to_dict())
+                if finished:
+                    self._emit("queue_finished")
+        finally:
+            output.close()
+
+    def _write(self, output, segment, fmt, start, stop, interrupt):
+        """
+        segment のフレーム start..stop をブロックごとに書き込む。途中で止められたら False。
+        """
+        block_frames = max(int(fmt[0] * self.block_ms / 1000), 1)
+        for i in range(start, stop, block_frames):
+            if self._interrupt != interrupt:
+                return False
+            output.write(segment.pcm(i, min(i + block_frames, stop)), fmt)
+            self.position_ms = segment.start_ms + min(i + block_frames, stop) * 1000 // fmt[0]
+        return True
+
+    def _next_for_crossfade(self, fmt):
+        """
+        クロスフェードできる次の曲をキューから取り出す (できなければ None)
+        """
+        with self._cond:
+            upcoming = self._queue[0] if self._queue else None
+        if upcoming is None:
+            return None
+        # 先読みが終わっていなければ待つ (WAV 以外はここでフォーマットが確定する)
+        if upcoming.prefetched is not None:
+            try:
+                upcoming.prefetched.result()
+            except Exception:
+                # 読めない曲はその曲の番になったときにエラーとして扱う
+                return None
+        with self._cond:
+            if not self._queue or self._queue[0] is not upcoming:
+                return None
+            if upcoming.segment.format != fmt or not upcoming.segment.n_frames:
+                return None
+            return self._queue.popleft()
+
+    def _play(self, output, track, interrupt, start_frame=0):
+        segment = track.segment
+        if track.prefetched is not None:
+            track.prefetched.result()
+        segment.prepare()
+        fmt = segment.format
+        sr, _, sample_width = fmt
+        n = segment.n_frames
+        fade_frames = min(sr * track.crossfade_ms // 1000, n - start_frame)
+
+        # クロスフェードの手前まで (フェードしないなら最後まで) 再生する
+        if not self._write(output, segment, fmt, start_frame, n - fade_frames, interrupt):
+            return False
+
+        nxt = self._next_for_crossfade(fmt) if fade_frames > 0 else None
+        if nxt is None:
+            if not self._write(output, segment, fmt, n - fade_frames, n, interrupt):
+                return False
+            # 曲間の待ち時間は無音として書き込む (次の曲のフォーマットが違えばストリームは開き直される)
+            with self._cond:
+                if not self._queue:
+                    return True
+                self.state = "gap"
+            gap_frames = sr * track.gap_ms // 1000
+            block_frames = max(int(sr * self.block_ms / 1000), 1)
+            for i in range(0, gap_frames, block_frames):
+                if self._interrupt != interrupt:
+                    break
+                output.write(silence(fmt, min(block_frames, gap_frames - i)), fmt)
+            return True
+
+        # 次の曲が短ければフェードを短くする (余った前の曲はそのまま鳴らす)
+        fade = min(fade_frames, nxt.segment.n_frames)
+        if not self._write(output, segment, fmt, n - fade_frames, n - fade, interrupt):
+            with self._cond:
+                self._queue.appendleft(nxt)
+            return False
+        with self._cond:
+            self.state = "crossfade"
+            self._handoff = (nxt, 0)
+            if self._queue:
+                self._prefetch(self._queue[0])
+
+        block_frames = max(int(sr * self.block_ms / 1000), 1)
+        tail = n - fade
+        for i in range(0, fade, block_frames):
+            j = min(i + block_frames, fade)
+            if self._interrupt != interrupt:
+                break
+            t = (np.arange(i, j) + 0.5) / fade
+            output.write(
+                equal_power_crossfade(segment.pcm(tail + i, tail + j), nxt.segment.pcm(i, j), t, sample_width), fmt
+            )
+            self.position_ms = segment.start_ms + (tail + j) * 1000 // sr
+            with self._cond:
+                if self._handoff is None:
+                    # クロスフェード中に停止された
+                    return False
+                self._handoff = (nxt, j)
+        return self._interrupt == interrupt
+
+
+class PlaybackSessions:
+    """
+    セッション (会話のスレッド) ごとの再生エンジン。エンジンは最初に使うときに作る。
+
+        sessions = PlaybackSessions(sink_factory=audio_sink.NullSink)
+        sessions.subscribe(lambda key, event: print(key, event))   # 全エンジンの on_event
+        sessions.get("listener-1").enqueue(...)
+        sessions.get("listener-2", create=False)   # まだ使っていなければ None
+        sessions.close("listener-1")
+    """
+
+    def __init__(self, sink_factory=audio_sink.DeviceSink, **engine_kwargs):
+        self.sink_factory = sink_factory
+        self.engine_kwargs = engine_kwargs
+        self.listeners = []
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        """
+        listener(key, event) を全セッションの再生イベントで呼ぶようにする
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _emit(self, key, event):
+        for listener in list(self.listeners):
+            listener(key, event)
+
+    def __len__(self):
+        return len(self._engines)
+
+    def get(self, key, create=True):
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None and create:
+                engine = self._engines[key] = PlaybackEngine(
+                    sink_factory=self.sink_factory, on_event=lambda event: self._emit(key, event), **self.engine_kwargs
+                )
+            return engine
+
+    def close(self, key):
+        with self._lock:
+            engine = self._engines.pop(key, None)
+        if engine is not None:
+            engine.close()
+
+    def close_all(self):
+        with self._lock:
+            engines, self._engines = list(self._engines.values()), {}
+        for engine in engines:
+            engine.close()
@@ -0,0 +1,251 @@
+import os
+import json
+import shutil
+
+import numpy as np
+
+
+# ==============================================
+# カタログの類似検索インデックス
+# ==============================================
+# index_dir/
+#     meta.json         ID (行順)・次元名・標準化パラメータ・方式 ("exact" / "ivf")
+#     vectors.npy       単位ベクトル (トラック数, 次元) float32。ivf ではリスト順に並べる
+#     standardized.npy  正規化前の標準化済みベクトル (near_profile の距離計算用、行順は同じ)
+#     centroids.npy     ivf のみ: クラスタ中心 (リスト数, 次元)
+#     list_offsets.npy  ivf のみ: リスト i の行は vectors[offsets[i]:offsets[i + 1]]
+#
+# ベクトルは次元ごとに標準化 (平均 0・分散 1) したあと、グループ (カタログ値 / MFCC /
+# クロマ) ごとに sqrt(次元数) で割って各グループの重みを揃え、長さ 1 に正規化する。
+# similar_to の類似度はコサイン類似度 (単位ベクトルの内積)、near_profile は
+# 指定した次元だけの標準化空間でのユークリッド距離。
+
+META_FILENAME = "meta.json"
+
+# 各トラックの dict (カタログの要素に tempo を加えたもの) から取るベクトルの次元
+CATALOG_VECTOR_FEATURES = ("acousticness", "energy", "tempo", "lofi")
+
+# このトラック数以上なら "auto" で IVF (転置ファイル) を使う
+IVF_MIN_TRACKS = 50_000
+
+
+def catalog_vectors(items, embeddings=None):
+    """
+    各トラックの dict (CATALOG_VECTOR_FEATURES の値を持つ。無い値・None は 0) と
+    任意の埋め込みから生の特徴量行列を作る。
+    embeddings: {"mfcc": (トラック数, n), "chroma": (トラック数, 12)} のような dict
+    (None の行は列平均で埋める)。(行列, 次元名, グループ名のリスト) を返す。
+    """
+    columns = []
+    names = []
+    groups = []
+    for name in CATALOG_VECTOR_FEATURES:
+        columns.append(np.array([float(item.get(name) or 0.0) for item in items])[:, np.newaxis])
+        names.append(name)
+        groups.append("catalog")
+    for group, values in (embeddings or {}).items():
+        rows = [None if v is None else np.asarray(v, dtype=np.float64) for v in values]
+        width = max((len(r) for r in rows if r is not None), default=0)
+        if not width:
+            continue
+        matrix = np.full((len(rows), width), np.nan)
+        for i, r in enumerate(rows):
+            if r is not None:
+                matrix[i] = r
+        # 埋め込みの無い行は平均で埋めて類似度に影響させない
+        col_mean = np.nanmean(matrix, axis=0)
+        matrix = np.where(np.isnan(matrix), col_mean, matrix)
+        columns.append(matrix)
+        names.extend(f"{group}_{i}" for i in range(width))
+        groups.extend([group] * width)
+    return np.hstack(columns), names, groups
+
+
+def _normalize_rows(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms == 0, 1.0, norms)
+
+
+def _spherical_kmeans(vectors, n_lists, n_iter=10, sample_size=20_000, seed=0):
+    """
+    単位ベクトルのクラスタ中心を求める (内積で割り当てる k-means)。
+    学習は sample_size 行の標本で行う。
+    """
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > sample_size:
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=n_lists)
+        # 空になったクラスタは標本から選び直す
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        centroids = _normalize_rows(sums)
+    return centroids.astype(np.float32)
+
+
+def _assign(vectors, centroids, chunk=65_536):
+    return np.concatenate([
+        np.argmax(vectors[i:i + chunk] @ centroids.T, axis=1) for i in range(0, len(vectors), chunk)
+    ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+
+def write_similarity_index(track_ids, items, index_dir, embeddings=None, method="auto", n_lists=None, seed=0):
+    """
+    カタログから類似検索インデックスを作り index_dir に書き出す。
+    - method: "exact" (全件の内積)、"ivf" (クラスタごとのリストを近い順に数個だけ調べる近似)、
+      "auto" (IVF_MIN_TRACKS 未満なら exact)
+    - n_lists: ivf のリスト数 (既定は sqrt(トラック数))
+    """
+    raw, names, groups = catalog_vectors(items, embeddings)
+    mean = raw.mean(axis=0) if len(raw) else np.zeros(len(names))
+    std = raw.std(axis=0) if len(raw) else np.ones(len(names))
+    std[std == 0] = 1.0
+    group_sizes = {g: groups.count(g) for g in groups}
+    scale = np.array([1.0 / np.sqrt(group_sizes[g]) for g in groups])
+    standardized = ((raw - mean) / std * scale).astype(np.float32)
+    vectors = _normalize_rows(standardized).astype(np.float32)
+
+    if method == "auto":
+        method = "ivf" if len(vectors) >= IVF_MIN_TRACKS else "exact"
+    track_ids = list(track_ids)
+
+    tmp_dir = index_dir.rstrip(os.sep) + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    if method == "ivf":
+        n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+        centroids = _spherical_kmeans(vectors, n_lists, seed=seed)
+        assign = _assign(vectors, centroids)
+        # 同じリストの行が連続するように並べ替える
+        order = np.argsort(assign, kind="stable")
+        vectors = vectors[order]
+        standardized = standardized[order]
+        track_ids = [track_ids[i] for i in order]
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=n_lists))
+        np.save(os.path.join(tmp_dir, "centroids.npy"), centroids)
+        np.save(os.path.join(tmp_dir, "list_offsets.npy"), offsets)
+    elif method != "exact":
+        raise ValueError(f"unknown index method: {method}")
+
+    np.save(os.path.join(tmp_dir, "vectors.npy"), vectors)
+    np.save(os.path.join(tmp_dir, "standardized.npy"), standardized)
+    meta = {
+        "method": method,
+        "ids": track_ids,
+        "names": names,
+        "groups": groups,
+        "mean": mean.tolist(),
+        "std": std.tolist(),
+        "scale": scale.tolist(),
+    }
+    with open(os.path.join(tmp_dir, META_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    if os.path.exists(index_dir):
+        shutil.rmtree(index_dir)
+    os.replace(tmp_dir, index_dir)
+
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+class SimilarityIndex:
+    """
+    write_similarity_index で書いたインデックスを読み、似たトラックを探す。
+
+        index = SimilarityIndex("./similarity")
+        index.similar_to("track-007", k=10)                       # -> [(track_id, 類似度), ...]
+        index.near_profile({"energy": 0.05, "tempo": 70}, k=10)   # -> [(track_id, 距離), ...]
+    """
+
+    def __init__(self, index_dir, mmap_mode="r"):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, META_FILENAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.method = meta["method"]
+        self.ids = meta["ids"]
+        self.names = meta["names"]
+        self.mean = np.array(meta["mean"])
+        self.std = np.array(meta["std"])
+        self.scale = np.array(meta["scale"])
+        self._row_of = {track_id: i for i, track_id in enumerate(self.ids)}
+        self.vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode=mmap_mode)
+        self.standardized = np.load(os.path.join(index_dir, "standardized.npy"), mmap_mode=mmap_mode)
+        self.centroids = None
+        self.offsets = None
+        if self.method == "ivf":
+            self.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+            self.offsets = np.load(os.path.join(index_dir, "list_offsets.npy"))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidates(self, query, nprobe):
+        """
+        (候補の行番号, 候補のベクトル) を返す。exact なら全件。
+        """
+        if self.method != "ivf":
+            return None, self.vectors
+        lists = _top_k(self.centroids @ query, nprobe)
+        rows = np.concatenate([
+            np.arange(self.offsets[i], self.offsets[i + 1]) for i in np.sort(lists)
+        ])
+        return rows, self.vectors[rows]
+
+    def query_vector(self, query, k=10, nprobe=8, exclude=None):
+        """
+        単位ベクトル query にコサイン類似度の高い順で k 件 [(track_id, 類似度), ...] を返す。
+        nprobe は ivf で調べるリスト数 (多いほど正確で遅い)。exclude の行は除く。
+        """
+        query = np.asarray(query, dtype=np.float32)
+        rows, candidates = self._candidates(query, nprobe)
+        scores = candidates @ query
+        if exclude is not None:
+            hits = np.flatnonzero((rows if rows is not None else np.arange(len(scores))) == exclude)
+            scores[hits] = -np.inf
+        top = _top_k(scores, k)
+        if rows is not None:
+            top_rows = rows[top]
+        else:
+            top_rows = top
+        return [(self.ids[r], float(scores[t])) for r, t in zip(top_rows, top) if np.isfinite(scores[t])]
+
+    def similar_to(self, track_id, k=10, nprobe=8):
+        """
+        track_id に似たトラックを k 件返す (自分自身は含めない)
+        """
+        row = self._row_of[track_id]
+        return self.query_vector(self.vectors[row], k, nprobe, exclude=row)
+
+    def near_profile(self, profile, k=10):
+        """
+        {次元名: 値} (例: {"energy": 0.05, "tempo": 70, "lofi": True}) に近いトラックを、
+        指定した次元だけの標準化空間での距離が小さい順に k 件 [(track_id, 距離), ...] 返す。
+        次元が少ないので ivf でも全件を走査する。
+        """
+        dims = []
+        values = []
+        for name, value in profile.items():
+            if name not in self.names:
+                raise KeyError(f"unknown profile dimension: {name}")
+            dims.append(self.names.index(name))
+            values.append(float(value))
+        dims = np.array(dims)
+        query = ((np.array(values) - self.mean[dims]) / self.std[dims] * self.scale[dims]).astype(np.float32)
+        diff = self.standardized[:, dims] - query
+        distances = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+        top = _top_k(-distances, k)
+        return [(self.ids[r], float(distances[r])) for r in top]
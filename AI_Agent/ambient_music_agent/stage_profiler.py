@@ -0,0 +1,200 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+# ==============================================
+# 特徴量パイプラインの段階別計測
+# ==============================================
+# 解析コードは `with stage("stft"):` のように計測区間を宣言するだけにしておき、
+# profile_stages() の中で実行されたときだけ記録する。無効時は共有の no-op
+# コンテキストマネージャを返すだけなので、本番のインデックス処理に入れたままでよい。
+
+_active = None
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """
+    計測区間。profile_stages() が有効なときだけ時間とメモリを記録する。
+    """
+    if _active is None:
+        return _NULL_STAGE
+    return _active.stage(name)
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "wall", "cpu", "base", "child_wall", "child_peak")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.child_wall = 0.0
+        self.child_peak = 0
+        if profiler.track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # ここまでのピークを親区間に引き継いでからリセットする
+            if profiler.stack:
+                parent = profiler.stack[-1]
+                parent.child_peak = max(parent.child_peak, peak)
+            tracemalloc.reset_peak()
+            self.base = current
+        profiler.stack.append(self)
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        profiler = self.profiler
+        profiler.stack.pop()
+
+        peak_bytes = 0
+        if profiler.track_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self.child_peak)
+            peak_bytes = max(peak - self.base, 0)
+            if profiler.stack:
+                parent = profiler.stack[-1]
+                parent.child_peak = max(parent.child_peak, peak)
+            tracemalloc.reset_peak()
+
+        if profiler.stack:
+            profiler.stack[-1].child_wall += wall
+
+        record = profiler.records.setdefault(
+            self.name, {"calls": 0, "wall_s": 0.0, "self_wall_s": 0.0, "cpu_s": 0.0, "peak_bytes": 0}
+        )
+        record["calls"] += 1
+        record["wall_s"] += wall
+        record["self_wall_s"] += wall - self.child_wall
+        record["cpu_s"] += cpu
+        record["peak_bytes"] = max(record["peak_bytes"], peak_bytes)
+        return False
+
+
+class StageProfiler:
+    """
+    区間名ごとの呼び出し回数・経過時間 (wall_s: 子区間込み / self_wall_s: 子区間除く)・
+    CPU時間・ピーク割り当て量 (track_memory=True のときのみ) を集める。
+    """
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.records = {}
+        self.stack = []
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+
+@contextmanager
+def profile_stages(track_memory=False):
+    """
+    このブロック内で実行された stage() を記録する。
+
+        with profile_stages() as profiler:
+            extract_features(path)
+        profiler.records
+    """
+    global _active
+    previous = _active
+    profiler = StageProfiler(track_memory=track_memory)
+    started_tracemalloc = False
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        started_tracemalloc = True
+    _active = profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+        if started_tracemalloc:
+            tracemalloc.stop()
+
+
+def scale_records(records, factor):
+    """
+    複数ファイルで共有した区間の時間をファイル数で按分するときに使う。
+    呼び出し回数はそのまま (各ファイルが共有区間に1回参加したものとして数える)。
+    """
+    return {
+        name: dict(r, wall_s=r["wall_s"] * factor, self_wall_s=r["self_wall_s"] * factor,
+                   cpu_s=r["cpu_s"] * factor)
+        for name, r in records.items()
+    }
+
+
+def merge_records(target, records):
+    for name, r in records.items():
+        total = target.setdefault(
+            name, {"calls": 0, "wall_s": 0.0, "self_wall_s": 0.0, "cpu_s": 0.0, "peak_bytes": 0}
+        )
+        total["calls"] += r["calls"]
+        total["wall_s"] += r["wall_s"]
+        total["self_wall_s"] += r["self_wall_s"]
+        total["cpu_s"] += r["cpu_s"]
+        total["peak_bytes"] = max(total["peak_bytes"], r["peak_bytes"])
+    return target
+
+
+class StageSummary:
+    """
+    バッチ全体の段階別計測を集計し、表と JSON を出力する
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.per_file = []
+        self.audio_seconds = 0.0
+
+    def add(self, path, records, audio_seconds=0.0):
+        merge_records(self.stages, records)
+        self.per_file.append({"path": path, "audio_seconds": audio_seconds, "stages": records})
+        self.audio_seconds += audio_seconds
+
+    def to_dict(self):
+        return {
+            "files": len(self.per_file),
+            "audio_seconds": self.audio_seconds,
+            "stages": self.stages,
+            "per_file": self.per_file,
+        }
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def table(self):
+        """
+        self_wall_s (子区間を除いた時間) の大きい順に並べた表を返す
+        """
+        total_self = sum(r["self_wall_s"] for r in self.stages.values()) or 1e-9
+        minutes = self.audio_seconds / 60.0
+        lines = [
+            f"{'stage':20s} {'calls':>6s} {'wall s':>9s} {'self s':>9s} {'cpu s':>9s} "
+            f"{'self %':>7s} {'s/audio-min':>11s} {'peak MB':>8s}"
+        ]
+        for name, r in sorted(self.stages.items(), key=lambda kv: -kv[1]["self_wall_s"]):
+            per_minute = r["self_wall_s"] / minutes if minutes else 0.0
+            lines.append(
+                f"{name:20s} {r['calls']:6d} {r['wall_s']:9.3f} {r['self_wall_s']:9.3f} "
+                f"{r['cpu_s']:9.3f} {r['self_wall_s'] / total_self:7.1%} {per_minute:11.3f} "
+                f"{r['peak_bytes'] / 1e6:8.1f}"
+            )
+        return "\n".join(lines)
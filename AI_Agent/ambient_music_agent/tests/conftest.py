@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+# ambient_music_agent のモジュールはパッケージではなく、ディレクトリ直下から import する
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def scripted_graph():
+    """
+    build_graph と同じ形 (chatbot <-> tools) で、fake_llm.ScriptedChatModel が応答するグラフを作る関数。
+    ツールは再生状態を返す music_status_tool だけ。langgraph が無ければ skip する。
+
+        graph, model = scripted_graph(script=[[], [{"name": "music_status_tool", "args": {}}]])
+    """
+    pytest.importorskip("langgraph")
+    from langchain_core.runnables import RunnableLambda
+    from langchain_core.tools import tool
+    from langgraph.checkpoint.memory import MemorySaver
+    from langgraph.graph import START, MessagesState, StateGraph
+    from langgraph.prebuilt import ToolNode, tools_condition
+
+    import fake_llm
+
+    @tool
+    def music_status_tool() -> str:
+        """再生状態を返す"""
+        return "playing: rain.wav"
+
+    def build(checkpointer=None, **model_kwargs):
+        model = fake_llm.ScriptedChatModel(**model_kwargs)
+
+        def chatbot(state):
+            return {"messages": [model.invoke(state["messages"])]}
+
+        async def achatbot(state):
+            return {"messages": [await model.ainvoke(state["messages"])]}
+
+        builder = StateGraph(MessagesState)
+        builder.add_node("chatbot", RunnableLambda(chatbot, afunc=achatbot, name="chatbot"))
+        builder.add_node("tools", ToolNode(tools=[music_status_tool]))
+        builder.add_conditional_edges("chatbot", tools_condition)
+        builder.add_edge("tools", "chatbot")
+        builder.add_edge(START, "chatbot")
+        graph = builder.compile(checkpointer=checkpointer if checkpointer is not None else MemorySaver())
+        return graph, model
+
+    return build
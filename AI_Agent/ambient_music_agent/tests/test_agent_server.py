@@ -0,0 +1,191 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+import agent_server
+import audio_sink
+import playback
+
+
+class RecordingCheckpointer:
+    def __init__(self):
+        self.deleted = []
+
+    def delete_thread(self, thread_id):
+        self.deleted.append(thread_id)
+
+
+def make_server(checkpointer):
+    engines = playback.PlaybackSessions(sink_factory=lambda: audio_sink.NullSink(speed=None))
+    return agent_server.AgentServer(graph=None, playback_engines=engines, checkpointer=checkpointer)
+
+
+def test_close_keeps_history_and_forget_deletes_it():
+    checkpointer = RecordingCheckpointer()
+    server = make_server(checkpointer)
+
+    async def run():
+        server._session("alice")
+        server.playback_engines.get("alice")
+        closed = await server.dispatch({"session": "alice", "close": True}, "conn-1", None)
+        forgotten = await server.dispatch({"session": "alice", "close": True, "forget": True}, "conn-1", None)
+        return closed, forgotten
+
+    closed, forgotten = asyncio.run(run())
+    assert closed == {"session": "alice", "closed": True}
+    assert forgotten == {"session": "alice", "closed": False, "forgotten": True}
+    assert checkpointer.deleted == ["alice"]
+    assert server.playback_engines.get("alice", create=False) is None
+
+
+def test_idle_sessions_are_closed_without_deleting_history():
+    checkpointer = RecordingCheckpointer()
+    server = make_server(checkpointer)
+    server.idle_timeout = 0.02
+
+    async def run():
+        server._session("alice")
+        reaper = asyncio.create_task(server._reap())
+        await asyncio.sleep(0.1)
+        reaper.cancel()
+
+    asyncio.run(run())
+    assert "alice" not in server.sessions
+    assert checkpointer.deleted == []
+
+
+def run_with_server(server, coro_fn):
+    async def run():
+        await server.start("127.0.0.1", 0)
+        try:
+            return await coro_fn()
+        finally:
+            await server.aclose()
+
+    return asyncio.run(run())
+
+
+def test_session_lifecycle(scripted_graph):
+    import conversation
+
+    saver = conversation.BoundedMemorySaver()
+    graph, _ = scripted_graph(saver, output_tokens=2)
+    server = make_server(saver)
+    server.graph = graph
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        first = await server.dispatch({"session": "alice", "text": "hi"}, "conn-1", send)
+        await server.dispatch({"session": "alice", "close": True}, "conn-1", send)
+        # 閉じた後も同じ session なら続きから話せる
+        await server.dispatch({"session": "alice", "text": "again", "stream": True}, "conn-1", send)
+        history = graph.get_state({"configurable": {"thread_id": "alice"}}).values["messages"]
+        await server.dispatch({"session": "alice", "close": True, "forget": True}, "conn-1", send)
+        forgotten = graph.get_state({"configurable": {"thread_id": "alice"}}).values
+        return first, history, forgotten
+
+    first, history, forgotten = asyncio.run(run())
+    assert first["session"] == "alice" and first["replies"] == ["ambient ambient"]
+    assert [m.content for m in history] == ["hi", "ambient ambient", "again", "ambient ambient"]
+    assert forgotten == {}
+    # stream: true のときだけトークンのイベントが送られる
+    assert [m["event"] for m in sent] == ["token", "token"]
+    assert all(m["session"] == "alice" for m in sent)
+
+
+def test_close_waits_for_running_turn(scripted_graph):
+    import conversation
+
+    saver = conversation.BoundedMemorySaver()
+    graph, _ = scripted_graph(saver, output_tokens=1, latency_ms=100)
+    server = make_server(saver)
+    server.graph = graph
+    config = {"configurable": {"thread_id": "alice"}}
+
+    async def run():
+        first = asyncio.create_task(server.turn("alice", "hi"))
+        await asyncio.sleep(0.02)
+        closing = asyncio.create_task(server.close_session("alice", forget=True))
+        await asyncio.sleep(0)
+        # close の途中に届いたターンは、閉じ終わってから新しいセッションで実行される
+        second = asyncio.create_task(server.turn("alice", "again"))
+        await asyncio.gather(first, closing, second)
+        return closing.result(), graph.get_state(config).values["messages"]
+
+    closed, history = asyncio.run(run())
+    assert closed is True
+    # 実行中のターンの後に履歴を消し、その後のターンは空の履歴から始まる
+    assert [m.content for m in history] == ["again", "ambient"]
+    assert list(server.sessions) == ["alice"]
+
+
+def test_forget_without_session_blocks_new_turns(scripted_graph):
+    import conversation
+
+    saver = conversation.BoundedMemorySaver()
+    graph, _ = scripted_graph(saver, output_tokens=1)
+    server = make_server(saver)
+    server.graph = graph
+    config = {"configurable": {"thread_id": "alice"}}
+
+    async def run():
+        await server.turn("alice", "hi")
+        await server.close_session("alice")
+        forgetting = asyncio.create_task(server.close_session("alice", forget=True))
+        await asyncio.sleep(0)
+        turn = asyncio.create_task(server.turn("alice", "again"))
+        await asyncio.gather(forgetting, turn)
+        return forgetting.result(), graph.get_state(config).values["messages"]
+
+    forgotten, history = asyncio.run(run())
+    assert forgotten is False
+    assert [m.content for m in history] == ["again", "ambient"]
+
+
+def test_session_limit(scripted_graph):
+    graph, _ = scripted_graph()
+    server = make_server(None)
+    server.graph = graph
+    server.max_sessions = 1
+
+    async def run():
+        await server.turn("alice", "hi")
+        try:
+            await server.turn("bob", "hi")
+        except RuntimeError as e:
+            return str(e)
+
+    assert "too many sessions" in asyncio.run(run())
+
+
+def test_tcp_sessions_run_concurrently(scripted_graph):
+    graph, _ = scripted_graph(output_tokens=1, latency_ms=200)
+    server = make_server(None)
+    server.graph = graph
+
+    async def client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        start = asyncio.get_running_loop().time()
+        for session in ("alice", "bob"):
+            writer.write(json.dumps({"session": session, "text": "hi"}).encode() + b"\n")
+        await writer.drain()
+        responses = [json.loads(await reader.readline()) for _ in range(2)]
+        elapsed = asyncio.get_running_loop().time() - start
+        writer.write(b"not json\n")
+        await writer.drain()
+        error = json.loads(await reader.readline())
+        writer.close()
+        return responses, elapsed, error
+
+    responses, elapsed, error = run_with_server(server, client)
+    assert sorted(r["session"] for r in responses) == ["alice", "bob"]
+    assert all(r["replies"] == ["ambient"] for r in responses)
+    # 1つの接続から送った2つのセッションのターンは並行して進む (順に処理すると 400ms 以上)
+    assert elapsed < 0.35
+    assert error == {"error": "invalid JSON request"}
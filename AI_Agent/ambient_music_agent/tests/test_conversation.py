@@ -0,0 +1,113 @@
+import pytest
+
+pytest.importorskip("langgraph")
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.graph.message import add_messages
+
+import conversation
+
+
+def make_history(turns, tool_result_chars=2000):
+    # 1ターン = 発話・ツール呼び出し・長いツール結果・応答
+    messages = []
+    for i in range(turns):
+        call_id = f"call_{i}"
+        messages += [
+            HumanMessage(f"request {i}"),
+            AIMessage("", tool_calls=[{"name": "music_catalog_search_tool", "args": {"query": f"q{i}"}, "id": call_id}]),
+            ToolMessage("x" * tool_result_chars, tool_call_id=call_id, name="music_catalog_search_tool"),
+            AIMessage(f"reply {i}"),
+        ]
+    # add_messages が ID を振る (RemoveMessage は ID で消す)
+    return add_messages([], messages)
+
+
+def history_tokens(messages):
+    return sum(conversation.message_tokens(m) for m in messages)
+
+
+def test_history_within_budget_is_unchanged():
+    messages = make_history(2, tool_result_chars=10)
+    assert conversation.compact_history(messages, "old", budget=10_000) == ([], "old")
+    assert conversation.compact_history(messages, "old", budget=None) == ([], "old")
+
+
+def test_compaction_fits_budget_and_keeps_recent_turns():
+    messages = make_history(8)
+    budget = history_tokens(messages[-4 * conversation.KEEP_RECENT_TURNS:]) + 200
+    assert history_tokens(messages) > budget
+
+    updates, summary = conversation.compact_history(messages, "", budget=budget)
+    compacted = add_messages(messages, updates)
+
+    assert history_tokens(compacted) <= budget
+    # ターン単位で消すので、ツール呼び出しとその結果の対応が崩れない
+    assert isinstance(compacted[0], HumanMessage)
+    call_ids = {c["id"] for m in compacted if isinstance(m, AIMessage) for c in m.tool_calls}
+    assert {m.tool_call_id for m in compacted if isinstance(m, ToolMessage)} <= call_ids
+    # 直近のターンはそのまま残る
+    assert [m.content for m in compacted[-4 * conversation.KEEP_RECENT_TURNS:]] == [
+        m.content for m in messages[-4 * conversation.KEEP_RECENT_TURNS:]
+    ]
+    # 消したターンは要約に1行ずつ残る
+    assert "ユーザー: request 0" in summary
+    assert "ツール: music_catalog_search_tool" in summary
+
+
+def test_old_tool_results_are_clipped_before_turns_are_removed():
+    messages = make_history(5)
+    clipped_total = history_tokens(messages) - 2 * (conversation.message_tokens(messages[2]) - 150)
+    updates, summary = conversation.compact_history(messages, "", budget=clipped_total)
+
+    compacted = add_messages(messages, updates)
+    assert len(compacted) == len(messages)
+    assert summary == ""
+    old_results = [m for m in compacted[:8] if isinstance(m, ToolMessage)]
+    assert all("省略" in m.content for m in old_results)
+
+
+def test_summary_is_bounded():
+    summary = ""
+    for i in range(400):
+        summary = conversation.extractive_summary(summary, [HumanMessage(f"turn {i}"), AIMessage(f"reply {i}")])
+    lines = summary.splitlines()
+    assert sum(conversation.count_tokens(line) + 1 for line in lines) <= conversation.SUMMARY_TOKEN_BUDGET
+    # 古い行から捨てる
+    assert lines[-2:] == ["ユーザー: turn 399", "アシスタント: reply 399"]
+
+
+def test_build_prompt_puts_summary_in_system_message():
+    prompt = conversation.build_prompt("system", "ユーザー: hi", [HumanMessage("now")])
+    assert isinstance(prompt[0], SystemMessage)
+    assert "ユーザー: hi" in prompt[0].content
+    assert [m.content for m in prompt[1:]] == ["now"]
+
+
+def test_bounded_memory_saver_relies_on_memory_saver_layout(scripted_graph):
+    # BoundedMemorySaver は MemorySaver の内部の辞書を直接消すので、その形が変わったらここで失敗させる
+    saver = conversation.BoundedMemorySaver(keep=2)
+    graph, _ = scripted_graph(saver)
+    alice = {"configurable": {"thread_id": "alice"}}
+    bob = {"configurable": {"thread_id": "bob"}}
+    for text in ("hi", "again", "more"):
+        graph.invoke({"messages": [HumanMessage(text)]}, alice)
+    graph.invoke({"messages": [HumanMessage("hi")]}, bob)
+
+    saved = saver.storage["alice"][""]
+    assert len(saved) == 2
+    referenced = set()
+    for checkpoint_id, (checkpoint, _, _) in saved.items():
+        checkpoint = saver.serde.loads_typed(checkpoint)
+        assert checkpoint["id"] == checkpoint_id
+        referenced.update(checkpoint["channel_versions"].items())
+    assert all(len(key) == 3 and key[2] in saved for key in saver.writes if key[0] == "alice")
+    blob_keys = [key for key in saver.blobs if key[0] == "alice"]
+    assert blob_keys and all(len(key) == 4 and (key[2], key[3]) in referenced for key in blob_keys)
+    # 古いチェックポイントを消しても最新の履歴は欠けない
+    assert len(graph.get_state(alice).values["messages"]) == 6
+
+    saver.delete_thread("alice")
+    assert graph.get_state(alice).values == {}
+    assert not any(key[0] == "alice" for key in list(saver.writes) + list(saver.blobs))
+    assert len(graph.get_state(bob).values["messages"]) == 2
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.messages import HumanMessage, ToolMessage
+
+import fake_llm
+
+STATUS = [{"name": "music_status_tool", "args": {}}]
+
+
+def test_script_alternates_tool_calls_and_replies():
+    model = fake_llm.ScriptedChatModel(script=[[], STATUS], output_tokens=3)
+
+    first = model.invoke([HumanMessage("hi")])
+    assert first.content == "ambient ambient ambient"
+    assert first.usage_metadata["output_tokens"] == 3
+
+    second = model.invoke([HumanMessage("status?")])
+    assert second.content == ""
+    assert [(c["name"], c["id"]) for c in second.tool_calls] == [("music_status_tool", "call_1")]
+
+    # ツールの結果を受けたら文章で応答する
+    third = model.invoke([HumanMessage("status?"), second, ToolMessage("playing", tool_call_id="call_1")])
+    assert third.content.startswith("ambient")
+    assert len(model.input_tokens) == 3
+
+
+def test_stream_yields_one_word_per_chunk():
+    model = fake_llm.ScriptedChatModel(output_tokens=4)
+    # langchain_core の版によっては最後に空のチャンクが付くので、中身のあるチャンクだけを比べる
+    words = [c.content for c in model.stream([HumanMessage("hi")]) if c.content]
+    assert "".join(words) == "ambient ambient ambient ambient"
+    assert len(words) == 4
+
+    async def collect():
+        return [c.content async for c in model.astream([HumanMessage("hi")]) if c.content]
+
+    assert "".join(asyncio.run(collect())) == "".join(words)
+
+
+def test_token_counter_and_from_env(monkeypatch):
+    monkeypatch.setenv("TEST_FAKE_LLM_SCRIPT", '[[{"name": "music_status_tool", "args": {}}]]')
+    monkeypatch.setenv("TEST_FAKE_LLM_OUTPUT_TOKENS", "2")
+    model = fake_llm.ScriptedChatModel.from_env("TEST_FAKE_LLM", token_counter=lambda message: 7)
+
+    message = model.invoke([HumanMessage("a"), HumanMessage("b")])
+    assert message.tool_calls[0]["name"] == "music_status_tool"
+    assert model.output_tokens == 2
+    assert model.input_tokens == [14]
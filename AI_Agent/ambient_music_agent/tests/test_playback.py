@@ -0,0 +1,68 @@
+import pytest
+import soundfile as sf
+
+import audio_sink
+import fixtures
+import playback
+
+
+def write_tone(path, sr=8000, seconds=2.0):
+    sf.write(path, fixtures.tone(sr, seconds), sr, subtype="PCM_16")
+    return str(path)
+
+
+def enqueue_all(engine, tracks, gap_ms=100):
+    # 再生スレッドが最初の曲を書き終える前に全曲をキューに入れる (最後の曲の判定がずれないように)
+    with engine._cond:
+        for i, path in enumerate(tracks):
+            engine.enqueue(f"t{i}", path, 0, 2000, gap_ms=gap_ms)
+
+
+@pytest.fixture
+def tracks(tmp_path):
+    return [write_tone(tmp_path / f"track{i}.wav") for i in range(3)]
+
+
+def test_device_sink_without_pyaudio_plays_each_track_in_one_call(tracks, monkeypatch):
+    pydub_playback = pytest.importorskip("pydub.playback")
+    played = []
+    monkeypatch.setattr(audio_sink, "_open_pyaudio", lambda: None)
+    monkeypatch.setattr(pydub_playback, "play", lambda segment: played.append(segment.frame_count()))
+
+    engine = playback.PlaybackEngine()
+    enqueue_all(engine, tracks)
+    assert engine.wait_idle(timeout=30)
+    engine.close()
+
+    # 100ms のブロックごとではなく、曲 (と曲間の無音) ごとに1回だけ再生する
+    assert played == [16800, 16800, 16000]
+
+
+@pytest.mark.parametrize("crossfade_ms, expected_frames", [
+    # 2秒 x 3曲 + 曲間の無音 100ms x 2 (最後の曲の後には入れない)
+    (0, 3 * 16000 + 2 * 800),
+    # 500ms ずつ重ねる (無音は入れない)
+    (500, 3 * 16000 - 2 * 4000),
+])
+def test_wav_sink_frame_count(tracks, tmp_path, crossfade_ms, expected_frames):
+    out = str(tmp_path / "out.wav")
+    sinks = []
+
+    def sink_factory():
+        sinks.append(audio_sink.WavFileSink(out))
+        return sinks[-1]
+
+    engine = playback.PlaybackEngine(sink_factory=sink_factory, crossfade_ms=crossfade_ms)
+    enqueue_all(engine, tracks)
+    assert engine.wait_idle(timeout=30)
+    engine.close()
+
+    assert sinks[0].paths == [out]
+    assert sf.info(out).frames == expected_frames
+
+
+def test_pyaudio_format_keeps_32bit_pcm_integer():
+    pyaudio = pytest.importorskip("pyaudio")
+    assert audio_sink.pyaudio_format(pyaudio, 4) == pyaudio.paInt32
+    assert audio_sink.pyaudio_format(pyaudio, 2) == pyaudio.paInt16
+    assert audio_sink.pyaudio_format(pyaudio, 1) == pyaudio.paUInt8
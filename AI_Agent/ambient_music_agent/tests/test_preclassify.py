@@ -0,0 +1,64 @@
+import pytest
+import soundfile as sf
+
+import audio_analysis
+import fixtures
+
+SIMILARITY_FIELDS = audio_analysis.CATALOG_FIELDS + ("embedding",)
+
+
+@pytest.fixture(scope="module")
+def environment_heavy_paths(tmp_path_factory):
+    """
+    環境音 (オンセットの無い持続音) 60秒 x 3 と、テンポを求める音楽1曲のライブラリ
+    """
+    output_dir = tmp_path_factory.mktemp("fixtures")
+    paths = []
+    for i, freqs in enumerate([(110.0,), (220.0, 330.0), (146.8, 220.0, 293.7)]):
+        path = str(output_dir / f"drone{i}.wav")
+        sf.write(path, fixtures.tone(44100, 60.0, freqs=freqs), 44100, subtype="PCM_16")
+        paths.append(path)
+    paths.append(fixtures.write_fixtures(str(output_dir), ["click120_22k_30s"])["click120_22k_30s"])
+    return paths
+
+
+def test_environment_verdict_skips_tempo_for_every_field_set():
+    for fields in (audio_analysis.CATALOG_FIELDS, SIMILARITY_FIELDS, None):
+        skippable = audio_analysis.preclassify_skippable(fields)
+        assert {"tempo", "beat_onset_envelope"} <= skippable["environment"]
+    # 全特徴量を計算するなら、音楽と判定しても判定用の中間表現はすべて使う
+    assert audio_analysis.preclassify_skippable(None)["music"] == set()
+
+
+def test_saved_seconds_counts_each_skipped_intermediate():
+    stats = audio_analysis.BatchStats()
+
+    def result(audio_seconds, classified_by, full, skipped):
+        return {
+            "error": None, "audio_seconds": audio_seconds, "classified_by": classified_by,
+            "classify_seconds": {"excerpt": 0.1, "full": full, "skipped": skipped},
+        }
+
+    # 音楽: テンポとその依存先を全体で計算した (10秒の音声で mel_db 0.2 秒、tempo 0.5 秒)
+    stats.add(result(10.0, "excerpt", {"mel_db": 0.2, "tempo": 0.5}, ["onset_envelope"]))
+    # 環境音: mel_db は埋め込みに使うので、省けたのはテンポとオンセット包絡だけ
+    stats.add(result(40.0, "excerpt", None, ["onset_envelope", "tempo"]))
+
+    # tempo 0.05 s/音声秒 x 40 秒。onset_envelope は一度も計算していないので数えない
+    assert stats.classify_saved_seconds() == pytest.approx(40.0 * 0.05 - 0.2)
+    assert stats.summary()["skipped_audio_seconds"] == 40.0
+
+
+@pytest.mark.parametrize("fields", [audio_analysis.CATALOG_FIELDS, SIMILARITY_FIELDS])
+def test_preclassify_saves_time_on_environment_heavy_library(environment_heavy_paths, fields):
+    paths = environment_heavy_paths
+    stats = audio_analysis.BatchStats()
+    for result in audio_analysis.batch_extract_features(paths, workers=1, fields=fields, preclassify=True):
+        assert result["error"] is None
+        stats.add(result)
+
+    summary = stats.summary()
+    assert summary["preclassified"] == len(paths)
+    # 埋め込みのために STFT / メルを全体で計算する場合も、環境音ではテンポ推定を省ける
+    assert summary["skipped_audio_seconds"] == 180.0
+    assert summary["classify_saved_seconds"] > 0
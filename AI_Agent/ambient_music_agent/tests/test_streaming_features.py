@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import audio_analysis
+import fixtures
+
+# StreamingFeatureAccumulator の docstring に書いた許容誤差
+RELATIVE_TOLERANCE = 2e-3
+# STFT クロマから推定するので extract_features と一致するとは限らない
+UNCHECKED = {"id", "key", "mode"}
+
+
+@pytest.fixture(scope="module")
+def fixture_paths(tmp_path_factory):
+    return fixtures.write_fixtures(
+        str(tmp_path_factory.mktemp("fixtures")), ["tone_22k_10s", "tone_48k_45s", "click60_44k_20s"]
+    )
+
+
+@pytest.mark.parametrize("name", ["tone_22k_10s", "tone_48k_45s", "click60_44k_20s"])
+@pytest.mark.parametrize("environment_flag", [True, False])
+def test_streaming_matches_full_analysis(fixture_paths, name, environment_flag):
+    path = fixture_paths[name]
+    full = audio_analysis.extract_features(path, environment_flag=environment_flag)
+    streamed = audio_analysis.extract_features_streaming(path, environment_flag=environment_flag)
+
+    assert set(streamed) == set(full)
+    for key, expected in full.items():
+        actual = streamed[key]
+        if key in UNCHECKED:
+            continue
+        if isinstance(expected, (int, float, np.number)) and not isinstance(expected, bool):
+            assert actual == pytest.approx(expected, rel=RELATIVE_TOLERANCE, abs=1e-9), key
+        else:
+            assert actual == expected, key
+
+
+def test_streaming_db_floor_is_shared_across_blocks(fixture_paths):
+    # ブロックごとの最大値で dB をクリップすると、持続音ではオンセット包絡が大きくずれる
+    path = fixture_paths["tone_48k_45s"]
+    y, sr = audio_analysis.audio_io.load(path, sr=None)
+    ctx = audio_analysis.AnalysisContext(y, sr)
+    acc = audio_analysis.StreamingFeatureAccumulator(sr, len(y))
+    for block in audio_analysis.audio_io.stream(
+        path, block_length=256, frame_length=2048, hop_length=512, mono=True, fill_value=0
+    ):
+        acc.update(block)
+
+    np.testing.assert_allclose(acc.onset_envelope, ctx.onset_envelope, rtol=1e-3, atol=1e-4)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import audio_analysis
+import fixtures
+
+SHORT_CLIPS = ["click60_44k_20s", "click120_22k_30s", "click150_48k_10s", "tone_22k_10s", "rain_44k_30s"]
+
+
+@pytest.fixture(scope="module")
+def clip_paths(tmp_path_factory):
+    paths = fixtures.write_fixtures(str(tmp_path_factory.mktemp("fixtures")), SHORT_CLIPS)
+    return [paths[name] for name in SHORT_CLIPS]
+
+
+def test_batch_estimate_tempo_matches_per_file():
+    sr = 22050
+    envelopes = []
+    for name, seconds in [("click", 10.0), ("click", 25.0), ("mixed", 15.0)]:
+        y = fixtures.GENERATORS[name](sr, seconds, seed=1)
+        envelopes.append(audio_analysis.AnalysisContext(y, sr).beat_onset_envelope)
+    # オンセットの無い包絡はテンポ 0 (beat_track と同じ)
+    envelopes.append(np.zeros(200, dtype=np.float32))
+
+    batch = audio_analysis.batch_estimate_tempo(envelopes, sr)
+    assert batch == pytest.approx([audio_analysis.estimate_tempo(env, sr) for env in envelopes])
+    assert batch[-1] == 0.0
+
+
+def test_plan_tasks_groups_only_short_clips(clip_paths, tmp_path):
+    long_path = fixtures.write_fixtures(str(tmp_path), ["rain_22k_120s"])["rain_22k_120s"]
+    paths = clip_paths[:3] + [long_path] + clip_paths[3:]
+
+    assert audio_analysis.plan_tasks(paths) == [[(i, p)] for i, p in enumerate(paths)]
+    tasks = audio_analysis.plan_tasks(paths, tempo_batch_size=3)
+    assert tasks == [[(0, paths[0]), (1, paths[1]), (2, paths[2])], [(3, long_path)], [(4, paths[4]), (5, paths[5])]]
+
+
+def test_tempo_batch_size_gives_the_same_features(clip_paths):
+    def run(**options):
+        results = audio_analysis.batch_extract_features(
+            clip_paths, workers=1, fields=audio_analysis.CATALOG_FIELDS, instrument="time", **options
+        )
+        return list(results)
+
+    per_file = run()
+    batched = run(tempo_batch_size=len(clip_paths))
+
+    assert [r["index"] for r in batched] == list(range(len(clip_paths)))
+    for expected, actual in zip(per_file, batched):
+        assert actual["error"] is None
+        for key in ("type", "tempo", "energy", "duration_ms"):
+            assert actual["features"].get(key) == pytest.approx(expected["features"].get(key))
+    # まとめて推定した区間は各ファイルの段階別計測に按分して入る
+    assert all("tempo_batch" in r["stages"] for r in batched)
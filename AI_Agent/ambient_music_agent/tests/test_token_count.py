@@ -0,0 +1,19 @@
+import sys
+import types
+
+import token_count
+
+
+def test_falls_back_to_estimate_when_tiktoken_cannot_load(monkeypatch):
+    # オフラインでは get_encoding が BPE ファイルを取りに行けずに例外になる
+    def get_encoding(name):
+        raise ConnectionError("offline")
+
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(get_encoding=get_encoding))
+    monkeypatch.setattr(token_count, "_encoder", None)
+    monkeypatch.setattr(token_count, "_tokenizer_name", None)
+
+    assert token_count.count_tokens("abcdefgh") == 2
+    assert token_count.count_tokens("雨の日") == 3
+    assert token_count.tokenizer_name().startswith(token_count.ESTIMATE_NAME)
+    assert "offline" in token_count.tokenizer_name()
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langgraph")
+
+import turn_events
+
+STATUS = [{"name": "music_status_tool", "args": {}}]
+
+
+def without_timings(events):
+    return [{k: v for k, v in e.items() if k not in ("ms", "ttft_ms")} for e in events]
+
+
+def test_stream_turn_yields_tokens_then_done(scripted_graph):
+    graph, _ = scripted_graph(output_tokens=5)
+    config = {"configurable": {"thread_id": "t"}}
+
+    events = list(turn_events.stream_turn(graph, "hi", config))
+    assert [e["event"] for e in events] == ["token"] * 5 + ["done"]
+    done = events[-1]
+    assert "".join(e["text"] for e in events[:-1]) == done["replies"][0] == " ".join(["ambient"] * 5)
+    assert done["tools"] == []
+    assert 0 <= done["ttft_ms"] <= done["ms"]
+
+
+def test_stream_turn_reports_tool_calls_and_results(scripted_graph):
+    graph, _ = scripted_graph(script=[STATUS], output_tokens=2)
+    config = {"configurable": {"thread_id": "t"}}
+
+    events = list(turn_events.stream_turn(graph, "what is playing?", config))
+    kinds = [e["event"] for e in events]
+    assert kinds == ["tool_call", "tool_result", "token", "token", "done"]
+    assert events[0] == {"event": "tool_call", "name": "music_status_tool", "args": {}}
+    assert events[1]["content"] == "playing: rain.wav"
+    assert events[-1]["tools"] == ["music_status_tool"]
+    assert events[-1]["replies"] == ["ambient ambient"]
+
+
+def test_astream_turn_matches_stream_turn(scripted_graph):
+    graph, _ = scripted_graph(script=[STATUS], output_tokens=3)
+
+    async def collect():
+        return [e async for e in turn_events.astream_turn(graph, "status", {"configurable": {"thread_id": "a"}})]
+
+    streamed = list(turn_events.stream_turn(graph, "status", {"configurable": {"thread_id": "s"}}))
+    events = asyncio.run(collect())
+    assert without_timings(events) == without_timings(streamed)
+
+
+def test_first_token_arrives_before_the_reply_finishes(scripted_graph):
+    graph, _ = scripted_graph(output_tokens=10, latency_ms=20, token_ms=10)
+    done = list(turn_events.stream_turn(graph, "hi", {"configurable": {"thread_id": "t"}}))[-1]
+    # 最初の語は latency_ms 後に届き、残りの語の分 (約 90ms) だけ応答全体より早い
+    assert done["ttft_ms"] < done["ms"] - 50
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEDIA_AGENT = os.path.join(HERE, "..", "..", "langgraph", "langgraph-media-api-agent", "media_agent")
+MARKER = "# ---- vendored ----\n"
+
+# media_agent がそのまま取り込んでいるモジュール (取り込み先, 元)
+VENDORED = [
+    (os.path.join(MEDIA_AGENT, "utils", "checkpoint.py"), os.path.join(HERE, "checkpoint_store.py")),
+    (os.path.join(MEDIA_AGENT, "utils", "fake_model.py"), os.path.join(HERE, "fake_llm.py")),
+]
+
+
+@pytest.mark.parametrize("copy, source", VENDORED, ids=[os.path.basename(c) for c, _ in VENDORED])
+def test_vendored_copy_matches_source(copy, source):
+    if not os.path.exists(copy):
+        pytest.skip("media_agent is not checked out next to ambient_music_agent")
+    with open(copy, encoding="utf-8") as f:
+        vendored = f.read()
+    with open(source, encoding="utf-8") as f:
+        original = f.read()
+    assert MARKER in vendored
+    assert vendored.split(MARKER, 1)[1] == original, f"copy {source} to {copy} (below the marker line)"
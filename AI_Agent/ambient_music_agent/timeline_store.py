@@ -0,0 +1,130 @@
+import os
+import json
+
+import numpy as np
+
+
+# ==============================================
+# フレーム単位の特徴量タイムライン
+# ==============================================
+# timeline_dir/
+#     index.json        track_id -> {filename, resolution_s, duration_ms, names, steps}
+#     <track_id>.npy    (特徴量, 時間ステップ) の float16 配列
+#
+# トラックごとに別ファイルなので、1曲の区間を探すときに他の曲は読み込まない。
+# .npy は np.load(mmap_mode="r") でメモリマップして使う。
+
+INDEX_FILENAME = "index.json"
+
+
+class TimelineStore:
+    """
+    特徴量タイムラインの保存と区間検索
+
+        store = TimelineStore("./timelines")
+        store.quietest_window("track-007", window_s=60)   # -> (start_time_ms, end_time_ms)
+        store.find_ranges("track-007", "rms", below=0.02, min_duration_s=10)
+    """
+
+    def __init__(self, timeline_dir):
+        self.timeline_dir = timeline_dir
+        os.makedirs(timeline_dir, exist_ok=True)
+        self.index_path = os.path.join(timeline_dir, INDEX_FILENAME)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+
+    def _path(self, track_id):
+        return os.path.join(self.timeline_dir, f"{track_id}.npy")
+
+    def has(self, track_id):
+        return track_id in self.index and os.path.exists(self._path(track_id))
+
+    def put(self, track_id, filename, timeline):
+        """
+        timeline: audio_analysis.feature_timelines の戻り値
+        """
+        values = np.asarray(timeline["values"], dtype=np.float16)
+        tmp_path = self._path(track_id) + ".tmp.npy"
+        np.save(tmp_path, values)
+        os.replace(tmp_path, self._path(track_id))
+        self.index[track_id] = {
+            "filename": filename,
+            "resolution_s": float(timeline["resolution_s"]),
+            "duration_ms": int(timeline["duration_ms"]),
+            "names": list(timeline["names"]),
+            "steps": int(values.shape[1]),
+        }
+
+    def evict(self, keep_track_ids):
+        """
+        keep_track_ids に無いトラックのタイムラインを削除する
+        """
+        keep = set(keep_track_ids)
+        for track_id in [t for t in self.index if t not in keep]:
+            del self.index[track_id]
+            if os.path.exists(self._path(track_id)):
+                os.remove(self._path(track_id))
+
+    def save(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    # ---------- 読み出しと検索 ----------
+    def load(self, track_id, feature=None):
+        """
+        メモリマップしたタイムラインを返す。feature を指定するとその1系列 (float32) だけ返す。
+        """
+        meta = self.index[track_id]
+        values = np.load(self._path(track_id), mmap_mode="r")
+        if feature is None:
+            return values
+        return np.asarray(values[meta["names"].index(feature)], dtype=np.float32)
+
+    def _steps_to_ms(self, track_id, start, stop):
+        meta = self.index[track_id]
+        resolution_ms = meta["resolution_s"] * 1000.0
+        # 最後のステップは端数を含むので曲の長さで切る
+        return (
+            min(int(round(start * resolution_ms)), meta["duration_ms"]),
+            min(int(round(stop * resolution_ms)), meta["duration_ms"]),
+        )
+
+    def find_ranges(self, track_id, feature, below=None, above=None, min_duration_s=0.0):
+        """
+        feature が条件 (below 未満 / above 超) を満たし続ける区間を
+        [(start_time_ms, end_time_ms), ...] で返す。min_duration_s より短い区間は除く。
+        """
+        series = self.load(track_id, feature)
+        mask = np.ones(series.shape, dtype=bool)
+        if below is not None:
+            mask &= series < below
+        if above is not None:
+            mask &= series > above
+
+        # 条件を満たす連続区間の開始・終了ステップを差分から求める
+        edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+        starts = np.flatnonzero(edges == 1)
+        stops = np.flatnonzero(edges == -1)
+        min_steps = min_duration_s / self.index[track_id]["resolution_s"]
+        return [
+            self._steps_to_ms(track_id, start, stop)
+            for start, stop in zip(starts, stops)
+            if stop - start >= min_steps
+        ]
+
+    def quietest_window(self, track_id, window_s, feature="rms"):
+        """
+        feature の平均が最も小さい window_s 秒の区間を (start_time_ms, end_time_ms) で返す。
+        曲が window_s より短い場合は曲全体。
+        """
+        series = self.load(track_id, feature).astype(np.float64)
+        window = max(1, int(round(window_s / self.index[track_id]["resolution_s"])))
+        if window >= series.size:
+            return self._steps_to_ms(track_id, 0, series.size)
+        sums = np.cumsum(np.concatenate([[0.0], series]))
+        start = int(np.argmin(sums[window:] - sums[:-window]))
+        return self._steps_to_ms(track_id, start, start + window)
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+# ==============================================
+# トークン数の計測 (プロンプト・会話履歴の予算管理とベンチマーク用)
+# ==============================================
+# tiktoken があれば o200k_base (gpt-4o) で数え、無ければ ASCII は4文字、
+# それ以外 (日本語など) は1文字を1トークンとして見積もる。
+# o200k_base の読み込みは初回にネットワークから BPE ファイルを取りに行くので、import 時ではなく
+# 最初に数えるときに1回だけ行い、失敗したら (オフラインなど) 見積もりに切り替える。
+
+ESTIMATE_NAME = "estimate (ASCII 4 chars/token, others 1 char/token)"
+
+# None: まだ読み込んでいない / False: tiktoken を使えない
+_encoder = None
+_tokenizer_name = None
+
+
+def _get_encoder():
+    global _encoder, _tokenizer_name
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("o200k_base")
+            _tokenizer_name = "tiktoken o200k_base"
+        except Exception as e:
+            _encoder = False
+            _tokenizer_name = ESTIMATE_NAME if isinstance(e, ImportError) else f"{ESTIMATE_NAME}; tiktoken failed: {e}"
+    return _encoder
+
+
+def tokenizer_name():
+    """
+    count_tokens が実際に使う数え方の名前 (ベンチマークの表示用)
+    """
+    _get_encoder()
+    return _tokenizer_name
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder:
+        return len(encoder.encode(text))
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return int(np.ceil(ascii_chars / 4)) + (len(text) - ascii_chars)
@@ -0,0 +1,89 @@
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from conversation import message_text
+
+
+# ==============================================
+# 1ターンの実行をイベントの列として返す
+# ==============================================
+# グラフを stream_mode=["messages", "updates"] で実行し、届いた順に次の dict を返す。
+#   {"event": "token", "text": "..."}                      LLM の応答の断片
+#   {"event": "tool_call", "name": "...", "args": {...}}     LLM がツールを呼んだ
+#   {"event": "tool_result", "name": "...", "content": "..."} ツールの結果 (先頭だけ)
+#   {"event": "done", "replies": [...], "tools": [...], "ttft_ms": ..., "ms": ...}
+# ttft_ms はターンの開始から最初の token までの時間 (文章の応答が無ければ None)。
+# stream_mode="values" と違い新しい出力だけが届くので、前のメッセージを繰り返し表示しない。
+
+STREAM_MODES = ["messages", "updates"]
+
+# tool_result に載せるツールの結果の文字数
+TOOL_RESULT_CHARS = 200
+
+
+class TurnEvents:
+    """
+    グラフの stream の出力 (mode, payload) をイベントに変換する
+    """
+
+    def __init__(self, reply_node="chatbot", tool_node="tools"):
+        self.reply_node = reply_node
+        self.tool_node = tool_node
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.replies = []
+        self.tools = []
+
+    def feed(self, mode, payload):
+        if mode == "messages":
+            chunk, metadata = payload
+            # compact ノードが書き換えた履歴などは流さない
+            if metadata.get("langgraph_node") != self.reply_node or not isinstance(chunk, AIMessage):
+                return
+            text = message_text(chunk)
+            if text:
+                if self.first_token is None:
+                    self.first_token = time.perf_counter()
+                yield {"event": "token", "text": text}
+            return
+        for node, values in payload.items():
+            for message in (values or {}).get("messages", []):
+                if isinstance(message, AIMessage) and node == self.reply_node:
+                    if message_text(message):
+                        self.replies.append(message_text(message))
+                    for call in message.tool_calls:
+                        self.tools.append(call["name"])
+                        yield {"event": "tool_call", "name": call["name"], "args": call["args"]}
+                elif isinstance(message, ToolMessage) and node == self.tool_node:
+                    yield {
+                        "event": "tool_result",
+                        "name": message.name,
+                        "content": message_text(message)[:TOOL_RESULT_CHARS],
+                    }
+
+    def done(self):
+        now = time.perf_counter()
+        return {
+            "event": "done",
+            "replies": self.replies,
+            "tools": self.tools,
+            "ttft_ms": None if self.first_token is None else (self.first_token - self.start) * 1e3,
+            "ms": (now - self.start) * 1e3,
+        }
+
+
+def stream_turn(graph, text, config):
+    events = TurnEvents()
+    for mode, payload in graph.stream({"messages": [HumanMessage(content=text)]}, config, stream_mode=STREAM_MODES):
+        yield from events.feed(mode, payload)
+    yield events.done()
+
+
+async def astream_turn(graph, text, config):
+    events = TurnEvents()
+    stream = graph.astream({"messages": [HumanMessage(content=text)]}, config, stream_mode=STREAM_MODES)
+    async for mode, payload in stream:
+        for event in events.feed(mode, payload):
+            yield event
+    yield events.done()
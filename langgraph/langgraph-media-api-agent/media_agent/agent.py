@@ -1,3 +1,4 @@
+import os
 from typing import TypedDict, Literal
 
 from langgraph.graph import StateGraph, END
@@ -7,7 +8,7 @@ from media_agent.utils.state import AgentState
 
 # Define the config
 class GraphConfig(TypedDict):
-    model_name: Literal["anthropic", "openai"]
+    model_name: Literal["anthropic", "openai", "fake"]
 
 # Define a new graph
 workflow = StateGraph(AgentState, config_schema=GraphConfig)
@@ -45,7 +46,18 @@ workflow.add_conditional_edges(
 # This means that after `tools` is called, `agent` node is called next.
 workflow.add_edge("action", "agent")
 
+# Checkpointer for running the graph locally.
+# LangGraph Cloud / Studio supply their own persistence, so by default we compile without one.
+# Set MEDIA_AGENT_CHECKPOINT_DB to a SQLite path to keep threads on disk across restarts.
+# The saver needs a newer langgraph checkpoint API than the graph itself, so it is only imported when used.
+checkpoint_db = os.environ.get("MEDIA_AGENT_CHECKPOINT_DB")
+checkpointer = None
+if checkpoint_db:
+    from media_agent.utils.checkpoint import SqliteCheckpointSaver
+
+    checkpointer = SqliteCheckpointSaver(checkpoint_db)
+
 # Finally, we compile it!
 # This compiles it into a LangChain Runnable,
 # meaning you can use it as you would any other runnable
-graph = workflow.compile()
+graph = workflow.compile(checkpointer=checkpointer)
@@ -11,6 +11,12 @@ def _get_model(model_name: str):
         model = ChatOpenAI(temperature=0, model_name="gpt-4o")
     elif model_name == "anthropic":
         model =  ChatAnthropic(temperature=0, model_name="claude-3-sonnet-20240229")
+    elif model_name == "fake":
+        # Offline model for timing the graph without API latency (see fake_model.py).
+        # Imported here so the production graph does not depend on it.
+        from media_agent.utils.fake_model import ScriptedChatModel
+
+        model = ScriptedChatModel.from_env("MEDIA_AGENT_FAKE_LLM")
     else:
         raise ValueError(f"Unsupported model type: {model_name}")
 